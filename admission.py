@@ -0,0 +1,272 @@
+"""Admission control in front of the model: per-session and global token buckets
+
+Every request costs one request plus its estimated tokens (prompt estimate
+and an allowance for the reply) from two pairs of token buckets: one pair
+per session and one shared by the process. A session over its own budget is
+turned away at once with a retry hint. When only the shared budget is
+exhausted the request waits in a fair queue that serves sessions round-robin,
+and is rejected if it would wait longer than ADMISSION_MAX_WAIT. Callers then
+degrade to a cached or canned reply instead of surfacing an error.
+
+The clock is injectable, and request()/pump() never block, so the policy can
+be tested deterministically; admit() is the blocking wrapper the app uses.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+SESSION_RPM = float(os.getenv('ADMISSION_SESSION_RPM', '10'))
+SESSION_BURST = float(os.getenv('ADMISSION_SESSION_BURST', '3'))
+SESSION_TPM = float(os.getenv('ADMISSION_SESSION_TPM', '60000'))
+GLOBAL_RPM = float(os.getenv('ADMISSION_GLOBAL_RPM', '60'))
+GLOBAL_TPM = float(os.getenv('ADMISSION_GLOBAL_TPM', '1000000'))
+MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '5'))
+MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '64'))
+# Seconds to suggest waiting after the Gemini API reports its quota exhausted
+QUOTA_RETRY = float(os.getenv('ADMISSION_QUOTA_RETRY', '30'))
+# Allowance for the reply when estimating a request's tokens
+REPLY_TOKENS = int(os.getenv('ADMISSION_REPLY_TOKENS', '400'))
+# Sessions whose buckets have been full this long are forgotten
+SESSION_IDLE = 3600.0
+
+GRANTED = 'granted'
+QUEUED = 'queued'
+SESSION_LIMIT = 'session_limit'
+BUSY = 'busy'
+
+
+class TokenBucket:
+    """Refills at `rate` per second up to `capacity`"""
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def cost(self, amount):
+        """What a single request of `amount` draws; one larger than the bucket only needs it full"""
+        return min(amount, self.capacity)
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` has accumulated (amounts over capacity count as debt to refill)"""
+        self.refill(now)
+        missing = amount - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else math.inf
+
+    def take(self, amount):
+        self.tokens -= self.cost(amount)
+
+    def give(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Ticket:
+    """One request's place in admission; `state` is GRANTED, QUEUED, SESSION_LIMIT or BUSY"""
+
+    def __init__(self, session_id, tokens, state, retry_after=0.0, deadline=None):
+        self.session_id = session_id
+        self.tokens = tokens
+        self.state = state
+        self.retry_after = retry_after
+        self.deadline = deadline
+
+    @property
+    def granted(self):
+        return self.state == GRANTED
+
+
+class TurnedAway(Exception):
+    """Raised in place of a model call that admission control turned away"""
+
+    def __init__(self, ticket):
+        super().__init__(f"Request turned away ({ticket.state})")
+        self.ticket = ticket
+
+
+class AdmissionController:
+    """Per-session and global request/token budgets with a round-robin wait queue"""
+
+    def __init__(self, session_rpm=SESSION_RPM, session_burst=SESSION_BURST, session_tpm=SESSION_TPM,
+                 global_rpm=GLOBAL_RPM, global_tpm=GLOBAL_TPM, max_wait=MAX_WAIT, max_queue=MAX_QUEUE,
+                 clock=time.monotonic):
+        self.session_rpm = session_rpm
+        self.session_burst = session_burst
+        self.session_tpm = session_tpm
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.clock = clock
+        now = clock()
+        # Global budgets allow a burst of up to a minute's worth
+        self._global = (TokenBucket(global_rpm / 60, global_rpm, now), TokenBucket(global_tpm / 60, global_tpm, now))
+        self._sessions = {}
+        # session_id -> waiting tickets; sessions take turns in insertion order
+        self._queue = OrderedDict()
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self.granted = 0
+        self.rejected = {SESSION_LIMIT: 0, BUSY: 0}
+
+    def _session_buckets(self, session_id, now):
+        buckets = self._sessions.get(session_id)
+        if buckets is None:
+            if len(self._sessions) > 1000:
+                self._forget_idle(now)
+            buckets = self._sessions[session_id] = (
+                TokenBucket(self.session_rpm / 60, self.session_burst, now),
+                TokenBucket(self.session_tpm / 60, self.session_tpm, now),
+            )
+        return buckets
+
+    def _forget_idle(self, now):
+        for session_id, (requests, _) in list(self._sessions.items()):
+            if session_id not in self._queue and now - requests.updated > SESSION_IDLE:
+                del self._sessions[session_id]
+
+    def _global_wait(self, tickets, now):
+        """Seconds until the global budget covers `tickets` in turn"""
+        request_bucket, token_bucket = self._global
+        tokens = sum(token_bucket.cost(ticket.tokens) for ticket in tickets)
+        return max(request_bucket.wait_time(len(tickets), now), token_bucket.wait_time(tokens, now))
+
+    def request(self, session_id, tokens):
+        """Ask to send a request of `tokens` estimated tokens; never blocks"""
+        with self._cond:
+            now = self.clock()
+            session_requests, session_tokens = self._session_buckets(session_id, now)
+            wait = max(session_requests.wait_time(1, now), session_tokens.wait_time(session_tokens.cost(tokens), now))
+            if wait > 0:
+                self.rejected[SESSION_LIMIT] += 1
+                return Ticket(session_id, tokens, SESSION_LIMIT, retry_after=wait)
+            ticket = Ticket(session_id, tokens, QUEUED)
+            # Demand already queued goes first
+            wait = self._global_wait([t for waiting in self._queue.values() for t in waiting] + [ticket], now)
+            if wait > self.max_wait or (wait > 0 and self._waiting >= self.max_queue):
+                self.rejected[BUSY] += 1
+                ticket.state, ticket.retry_after = BUSY, wait
+                return ticket
+            session_requests.take(1)
+            session_tokens.take(tokens)
+            if wait == 0 and not self._waiting:
+                self._grant(ticket)
+                return ticket
+            ticket.retry_after, ticket.deadline = wait, now + self.max_wait
+            self._queue.setdefault(session_id, deque()).append(ticket)
+            self._waiting += 1
+            return ticket
+
+    def _grant(self, ticket):
+        request_bucket, token_bucket = self._global
+        request_bucket.take(1)
+        token_bucket.take(ticket.tokens)
+        ticket.state = GRANTED
+        self.granted += 1
+
+    def _reject(self, ticket):
+        # Queued tickets were already charged to their session
+        session_requests, session_tokens = self._sessions[ticket.session_id]
+        session_requests.give(1)
+        session_tokens.give(ticket.tokens)
+        ticket.state = BUSY
+        self.rejected[BUSY] += 1
+
+    def _remove(self, ticket):
+        waiting = self._queue[ticket.session_id]
+        waiting.remove(ticket)
+        if not waiting:
+            del self._queue[ticket.session_id]
+        self._waiting -= 1
+
+    def pump(self):
+        """Grant queued tickets in round-robin session order while the global budget allows"""
+        with self._cond:
+            now = self.clock()
+            for waiting in list(self._queue.values()):
+                for ticket in [t for t in waiting if t.deadline <= now]:
+                    self._remove(ticket)
+                    self._reject(ticket)
+            while self._queue:
+                session_id, waiting = next(iter(self._queue.items()))
+                ticket = waiting[0]
+                if self._global_wait([ticket], now) > 0:
+                    break
+                self._remove(ticket)
+                self._grant(ticket)
+                # The session goes to the back of the rotation
+                if session_id in self._queue:
+                    self._queue.move_to_end(session_id)
+            self._cond.notify_all()
+
+    def cancel(self, ticket):
+        with self._cond:
+            if ticket.state == QUEUED:
+                self._remove(ticket)
+                self._reject(ticket)
+                self._cond.notify_all()
+
+    def admit(self, session_id, tokens):
+        """Blocking request(): waits in the queue until granted or rejected"""
+        ticket = self.request(session_id, tokens)
+        while ticket.state == QUEUED:
+            self.pump()
+            with self._cond:
+                if ticket.state != QUEUED:
+                    break
+                now = self.clock()
+                self._cond.wait(max(0.01, min(self._global_wait([ticket], now), ticket.deadline - now)))
+        return ticket
+
+    def stats(self):
+        with self._cond:
+            return {"granted": self.granted, "waiting": self._waiting, **self.rejected}
+
+
+def rejection_message(ticket):
+    """Friendly chat text for a request admission turned away"""
+    seconds = max(1, math.ceil(ticket.retry_after))
+    if ticket.state == SESSION_LIMIT:
+        return (f"💙 You're sending messages faster than I can thoughtfully reply. Take a slow breath with me, "
+                f"and try again in about {seconds} second{'s' if seconds != 1 else ''}.")
+    return ("💙 A lot of people are talking with me right now, so I couldn't answer this one just yet. "
+            f"Please try again in about {seconds} second{'s' if seconds != 1 else ''}. If you need support "
+            "right away, the crisis resources in the sidebar are available 24/7.")
+
+
+# Replies when the model can't be reached or we're over quota, by mood
+CANNED_REPLIES = {
+    "Anxious": "It sounds like things feel tense right now. Try breathing in for 4 counts, holding for 4 and "
+               "breathing out for 6 — a few rounds can settle your body while I catch up.",
+    "Sad": "I'm sorry you're feeling low. You don't have to carry it alone; reaching out to someone you trust, "
+           "even with a short message, can help while I catch up.",
+    "Frustrated": "Frustration is exhausting. If you can, step away for a minute, stretch, and let your "
+                  "shoulders drop before we pick this back up.",
+    "Tired": "Rest matters. A glass of water and a few quiet minutes away from screens can help while I catch up.",
+}
+DEFAULT_CANNED_REPLY = ("I'm here with you. While I catch up, try naming five things you can see and three things "
+                        "you can hear — it can help ground you in the moment.")
+
+
+def canned_reply(ticket, mood=None):
+    """Chat text for a turned-away request: a session over its limit only gets the notice,
+    others also get a short supportive message that needs no model call"""
+    if ticket.state == SESSION_LIMIT:
+        return rejection_message(ticket)
+    return f"{rejection_message(ticket)}\n\n{CANNED_REPLIES.get(mood, DEFAULT_CANNED_REPLY)}"
+
+
+def quota_ticket(session_id, retry_after=QUOTA_RETRY):
+    """A rejected ticket standing for a request the Gemini API refused as over quota"""
+    return Ticket(session_id, 0, BUSY, retry_after=retry_after)
+
+
+# Shared by every session in the process
+admission = AdmissionController()
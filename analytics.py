@@ -0,0 +1,278 @@
+"""Columnar snapshot of the conversation store and vectorized trend reports
+
+The conversation store is append-only with increasing row ids, so a
+snapshot ingests only rows it has not seen: each refresh() reads the new
+messages and mood logs in large batches (message text is reduced to its
+length in SQL and never leaves SQLite) and writes them as one more part
+file: Parquet when pyarrow is installed, otherwise NumPy .npz. Sessions are
+stored as integer codes, with the mapping and ingest position in
+manifest.json. Rows later deleted from the store (Clear Chat History) stay
+in the snapshot as lengths and timestamps only; no message text is kept.
+
+Reports are computed with NumPy over whole columns:
+- mood_trends: mood counts and mean valence per day
+- length_stats: message-length percentiles and histogram by role
+- response_times: seconds from each user message to the reply after it
+
+Run `python analytics.py [--db mindfulai.db] [--dir analytics]` to refresh
+the snapshot and print a report. The app's sidebar trends view calls
+session_report() for the current session.
+"""
+import argparse
+import json
+import os
+import sqlite3
+from itertools import chain
+
+import numpy as np
+
+from message_log import MOODS
+
+ANALYTICS_DIR = os.getenv('ANALYTICS_DIR', 'analytics')
+BATCH_SIZE = 100_000
+DAY = 86400
+
+# Rough pleasantness of each mood, for a single trend line
+MOOD_VALENCE = np.array([2.0, 1.0, -1.0, -1.0, -1.0, 0.0])
+ROLES = ("user", "assistant")
+NO_MOOD = -1
+
+MESSAGE_COLUMNS = {'id': np.int64, 'session': np.int32, 'created_at': np.float64, 'role': np.int8,
+                   'length': np.int32, 'mood': np.int8, 'flagged': np.bool_}
+MOOD_COLUMNS = {'id': np.int64, 'session': np.int32, 'created_at': np.float64, 'mood': np.int8}
+
+_MOOD_CASE = ' '.join(f"WHEN '{mood}' THEN {code}" for code, mood in enumerate(MOODS))
+# Everything is coded to numbers in SQL, so a batch converts to arrays in one pass
+MESSAGES_SQL = ("SELECT m.id, c.code, m.created_at, CASE m.role WHEN 'assistant' THEN 1 ELSE 0 END, "
+                f"length(m.content), CASE m.mood {_MOOD_CASE} ELSE {NO_MOOD} END, m.flagged "
+                "FROM messages m JOIN temp.session_codes c USING (session_id) WHERE m.id > ? {session} ORDER BY m.id")
+MOODS_SQL = (f"SELECT m.id, c.code, m.created_at, 0, 0, CASE m.mood {_MOOD_CASE} ELSE {NO_MOOD} END, 0 "
+             "FROM moods m JOIN temp.session_codes c USING (session_id) WHERE m.id > ? {session} ORDER BY m.id")
+ROW_FIELDS = ('id', 'session', 'created_at', 'role', 'length', 'mood', 'flagged')
+
+
+def empty(columns):
+    return {name: np.empty(0, dtype=dtype) for name, dtype in columns.items()}
+
+
+def concat(parts, columns):
+    if not parts:
+        return empty(columns)
+    return {name: np.concatenate([part[name] for part in parts]).astype(dtype, copy=False)
+            for name, dtype in columns.items()}
+
+
+def code_sessions(conn, sessions, session_ids=None):
+    """Give every session in the store (or just `session_ids`) a code, adding new ones to `sessions`,
+    and load the codes into SQLite"""
+    if session_ids is None:
+        session_ids = [row[0] for row in conn.execute(
+            "SELECT DISTINCT session_id FROM messages INDEXED BY idx_messages_session "
+            "UNION SELECT DISTINCT session_id FROM moods INDEXED BY idx_moods_session")]
+    for session_id in session_ids:
+        sessions.setdefault(session_id, len(sessions))
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS session_codes (session_id TEXT PRIMARY KEY, code INTEGER NOT NULL)")
+    conn.execute("DELETE FROM temp.session_codes")
+    conn.executemany("INSERT INTO temp.session_codes VALUES (?, ?)", sessions.items())
+
+
+def read_rows(conn, sql, columns, after_id=0, session_id=None, batch_size=BATCH_SIZE):
+    """Rows after `after_id` as NumPy columns; code_sessions() must have run on `conn`"""
+    params = [after_id]
+    if session_id is not None:
+        sql = sql.format(session='AND m.session_id = ?')
+        params.append(session_id)
+    else:
+        sql = sql.format(session='')
+    cursor = conn.execute(sql, params)
+    width = len(ROW_FIELDS)
+    parts = []
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        # Every field is numeric and ids stay far below 2**53, so float64 holds them all exactly
+        flat = np.fromiter(chain.from_iterable(rows), np.float64, len(rows) * width).reshape(len(rows), width)
+        parts.append({name: flat[:, ROW_FIELDS.index(name)].astype(dtype) for name, dtype in columns.items()})
+    return concat(parts, columns)
+
+
+def read_messages(conn, after_id=0, session_id=None):
+    return read_rows(conn, MESSAGES_SQL, MESSAGE_COLUMNS, after_id, session_id)
+
+
+def read_moods(conn, after_id=0, session_id=None):
+    return read_rows(conn, MOODS_SQL, MOOD_COLUMNS, after_id, session_id)
+
+
+def percentiles(values, qs=(50, 95, 99)):
+    if not len(values):
+        return {f"p{q}": None for q in qs}
+    return {f"p{q}": float(v) for q, v in zip(qs, np.percentile(values, qs))}
+
+
+def mood_trends(moods, bucket=DAY):
+    """Per day (or `bucket` seconds): start times, counts per mood, and mean valence"""
+    known = moods['mood'] >= 0
+    if not known.any():
+        return {"days": np.empty(0), "counts": np.zeros((0, len(MOODS)), np.int64), "valence": np.empty(0)}
+    days, day_index = np.unique((moods['created_at'][known] // bucket).astype(np.int64), return_inverse=True)
+    codes = moods['mood'][known].astype(np.int64)
+    counts = np.bincount(day_index * len(MOODS) + codes, minlength=len(days) * len(MOODS))
+    counts = counts.reshape(len(days), len(MOODS))
+    valence = counts @ MOOD_VALENCE / counts.sum(axis=1)
+    return {"days": days * bucket, "counts": counts, "valence": valence}
+
+
+def length_stats(messages, bins=20):
+    """Message-length count, mean, percentiles and log-spaced histogram, by role"""
+    stats = {}
+    for code, role in enumerate(ROLES):
+        lengths = messages['length'][messages['role'] == code]
+        edges = np.unique(np.geomspace(1, max(2, int(lengths.max(initial=1)) + 1), bins + 1).astype(np.int64))
+        histogram, _ = np.histogram(lengths, bins=edges)
+        stats[role] = {"count": int(len(lengths)),
+                       "mean": float(lengths.mean()) if len(lengths) else None,
+                       **percentiles(lengths),
+                       "histogram": histogram.tolist(), "edges": edges.tolist()}
+    return stats
+
+
+def response_times(messages):
+    """Seconds from each user message to the assistant message right after it in the same session"""
+    order = np.lexsort((messages['id'], messages['created_at'], messages['session']))
+    session = messages['session'][order]
+    role = messages['role'][order]
+    created = messages['created_at'][order]
+    replied = ((role[:-1] == ROLES.index("user")) & (role[1:] == ROLES.index("assistant"))
+               & (session[:-1] == session[1:]))
+    return (created[1:] - created[:-1])[replied]
+
+
+def report(messages, moods):
+    """Summary of a snapshot; arrays are converted to lists so it serializes to JSON"""
+    times = response_times(messages)
+    trends = mood_trends(moods)
+    return {
+        "messages": int(len(messages['id'])),
+        "sessions": int(len(np.unique(messages['session']))),
+        "flagged": int(messages['flagged'].sum()),
+        "lengths": length_stats(messages),
+        "response_seconds": {"count": int(len(times)),
+                             "mean": float(times.mean()) if len(times) else None,
+                             **percentiles(times)},
+        "moods": {"logs": int(len(moods['id'])),
+                  "totals": dict(zip(MOODS, trends["counts"].sum(axis=0).tolist())),
+                  "days": trends["days"].tolist(),
+                  "valence": trends["valence"].round(3).tolist()},
+    }
+
+
+def session_report(db_path, session_id):
+    """report() for one session, read straight from the store"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        # Only this session is read, so only it needs a code
+        code_sessions(conn, {}, [session_id])
+        return report(read_messages(conn, session_id=session_id), read_moods(conn, session_id=session_id))
+    finally:
+        conn.close()
+
+
+class Snapshot:
+    """Part files of store rows in `directory`; refresh() appends only rows newer than the last part"""
+
+    def __init__(self, directory=ANALYTICS_DIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+
+    def _manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"messages_after": 0, "moods_after": 0, "sessions": {}, "parts": []}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def refresh(self, db_path):
+        """Ingest new rows from the store at `db_path`; returns (messages, mood logs) added"""
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self._manifest()
+        sessions = manifest["sessions"]
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            code_sessions(conn, sessions)
+            messages = read_messages(conn, after_id=manifest["messages_after"])
+            moods = read_moods(conn, after_id=manifest["moods_after"])
+        finally:
+            conn.close()
+        if len(messages['id']) or len(moods['id']):
+            name = f"part-{len(manifest['parts']):05d}"
+            for table, columns in (('messages', messages), ('moods', moods)):
+                write_part(os.path.join(self.directory, f"{name}.{table}"), columns)
+            manifest["parts"].append(name)
+            manifest["messages_after"] = int(messages['id'].max(initial=manifest["messages_after"]))
+            manifest["moods_after"] = int(moods['id'].max(initial=manifest["moods_after"]))
+            tmp = f"{self.manifest_path}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            # The manifest is replaced last, so a crash mid-refresh leaves the old snapshot readable
+            os.replace(tmp, self.manifest_path)
+        return len(messages['id']), len(moods['id'])
+
+    def load(self):
+        """(messages, moods, session ids by code)"""
+        manifest = self._manifest()
+        messages = concat([read_part(os.path.join(self.directory, f"{name}.messages"), MESSAGE_COLUMNS)
+                           for name in manifest["parts"]], MESSAGE_COLUMNS)
+        moods = concat([read_part(os.path.join(self.directory, f"{name}.moods"), MOOD_COLUMNS)
+                        for name in manifest["parts"]], MOOD_COLUMNS)
+        session_ids = sorted(manifest["sessions"], key=manifest["sessions"].get)
+        return messages, moods, session_ids
+
+
+def write_part(stem, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        np.savez(f"{stem}.npz", **columns)
+        return
+    pq.write_table(pa.table(columns), f"{stem}.parquet", compression='zstd')
+
+
+def read_part(stem, columns):
+    if os.path.exists(f"{stem}.parquet"):
+        import pyarrow.parquet as pq
+        table = pq.read_table(f"{stem}.parquet")
+        return {name: table.column(name).to_numpy() for name in columns}
+    with np.load(f"{stem}.npz") as data:
+        return {name: data[name] for name in columns}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the analytics snapshot and print a report")
+    parser.add_argument('--db', default=os.getenv('CHAT_DB_PATH', 'mindfulai.db'))
+    parser.add_argument('--dir', default=ANALYTICS_DIR)
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = parser.parse_args()
+    snapshot = Snapshot(args.dir)
+    added = snapshot.refresh(args.db)
+    messages, moods, _ = snapshot.load()
+    summary = report(messages, moods)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"Ingested {added[0]} messages and {added[1]} mood logs into {args.dir}")
+    print(f"{summary['messages']} messages in {summary['sessions']} sessions, {summary['flagged']} flagged")
+    for role, stats in summary["lengths"].items():
+        if stats["count"]:
+            print(f"  {role:<9} length mean {stats['mean']:.0f}, p50 {stats['p50']:.0f}, p95 {stats['p95']:.0f}, "
+                  f"p99 {stats['p99']:.0f} chars")
+    times = summary["response_seconds"]
+    if times["count"]:
+        print(f"  replies   p50 {times['p50']:.2f}s, p95 {times['p95']:.2f}s, p99 {times['p99']:.2f}s")
+    print(f"{summary['moods']['logs']} mood logs: "
+          + ", ".join(f"{mood} {count}" for mood, count in summary["moods"]["totals"].items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""Headless chat API: the app.py turn pipeline over JSON, SSE and WebSocket
+
+Run it with `python api_server.py --port 8000 --workers 4`. Every worker keeps
+its own LRU of live sessions; a session another worker started (or that was
+evicted) is rebuilt from the shared conversation store on first use, so
+requests can be load-balanced across workers without sticky routing.
+
+    POST /v1/sessions                         -> {"session_id"}
+    POST /v1/sessions/{id}/mood               {"mood"}
+    POST /v1/sessions/{id}/chat               {"message", "mood"?} -> {"reply", "crisis", ...}
+    POST /v1/sessions/{id}/chat/stream        same body; text/event-stream of chunks
+    WS   /v1/sessions/{id}/ws                 {"message", "mood"?} or {"mood"} frames
+    GET  /v1/sessions/{id}/messages?start=&stop=
+    GET  /healthz, GET /metrics
+
+The Gemini key comes from GOOGLE_API_KEY, or per client from an X-API-Key
+header when the server has none.
+"""
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+from chat_pipeline import (MOODS, ChatSession, finish_turn, get_bot_response, is_session_id, latest_mood, log_mood,
+                           save_session, session_exists, start_turn)
+from conversation_store import store
+from crisis_detector import CRISIS_BANNER, CRISIS_RESOURCES
+from instrumentation import metrics, start_exporters
+
+load_dotenv()
+
+API_SESSIONS = int(os.getenv('API_SESSIONS', '1000'))
+API_MAX_MESSAGE = int(os.getenv('API_MAX_MESSAGE', '4000'))
+
+
+class ApiError(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class SessionPool:
+    """The worker's live ChatSessions, least recently used evicted first.
+
+    Each session has a lock so its turns run one at a time, as they do on
+    the Streamlit page.
+    """
+
+    def __init__(self, capacity=API_SESSIONS):
+        self.capacity = capacity
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def create(self, api_key):
+        session = ChatSession(api_key)
+        # Saved at once, so other workers know the id before its first message
+        save_session(session)
+        return self._keep(session)
+
+    def get(self, session_id, api_key):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+        # Started on another worker or evicted: rebuild it from the store
+        return self._keep(ChatSession.resume(api_key, session_id))
+
+    def _keep(self, session):
+        session.lock = threading.Lock()
+        with self._lock:
+            session = self._sessions.setdefault(session.session_id, session)
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.capacity:
+                _, evicted = self._sessions.popitem(last=False)
+                evicted.close()
+        return session
+
+    def clear(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), OrderedDict()
+        for session in sessions:
+            session.close()
+
+
+sessions = SessionPool()
+
+
+def api_key(request):
+    key = os.getenv('GOOGLE_API_KEY') or request.headers.get('x-api-key')
+    if not key or not key.strip():
+        raise ApiError(401, "Set GOOGLE_API_KEY on the server or send an X-API-Key header")
+    return key.strip()
+
+
+def known_session_id(request):
+    """The request's session id, checked without rebuilding the session.
+
+    Ids only come from POST /v1/sessions: one that this worker does not hold
+    and the stores do not know is a 404, so a client cannot pick its own.
+    """
+    session_id = request.path_params['session_id']
+    if not is_session_id(session_id):
+        raise ApiError(404, "Unknown session")
+    api_key(request)
+    if session_id not in sessions and not session_exists(session_id):
+        raise ApiError(404, "Unknown session")
+    return session_id
+
+
+def session_for(request):
+    return sessions.get(known_session_id(request), api_key(request))
+
+
+def parse_turn(body):
+    """The (message, mood) of a chat request body"""
+    if not isinstance(body, dict):
+        raise ApiError(422, "Expected a JSON object")
+    message = body.get('message')
+    if not isinstance(message, str) or not message.strip():
+        raise ApiError(422, "'message' must be a non-empty string")
+    if len(message) > API_MAX_MESSAGE:
+        raise ApiError(413, f"'message' is longer than {API_MAX_MESSAGE} characters")
+    return message, parse_mood(body, required=False)
+
+
+def parse_mood(body, required=True):
+    mood = body.get('mood') if isinstance(body, dict) else None
+    if mood is None and not required:
+        return None
+    if mood not in MOODS:
+        raise ApiError(422, f"'mood' must be one of {', '.join(MOODS)}")
+    return mood
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise ApiError(400, "Request body is not valid JSON")
+
+
+def crisis_fields(crisis):
+    return {"crisis": crisis, **({"banner": CRISIS_BANNER, "resources": CRISIS_RESOURCES} if crisis else {})}
+
+
+def run_turn(session, message, mood):
+    """One blocking turn; the mood is the one sent with the message or the session's latest"""
+    with session.lock, metrics.span('turn'):
+        mood = mood or latest_mood(session)
+        question, crisis = start_turn(session, message, mood)
+        reply = get_bot_response(session, message, mood)
+        finish_turn(session, question, reply, mood)
+    return {"reply": reply, "mood": mood, **crisis_fields(crisis)}
+
+
+def stream_turn(session, message, mood):
+    """One turn as events: ('crisis', fields) when flagged, ('chunk', text)..., then ('done', fields).
+
+    Closing the generator early (a client disconnect) cancels the upstream
+    request and still saves whatever part of the reply was sent.
+    """
+    with session.lock, metrics.span('turn'):
+        mood = mood or latest_mood(session)
+        question, crisis = start_turn(session, message, mood)
+        if crisis:
+            # Sent before the model is called, and shown even if the call fails
+            yield 'crisis', crisis_fields(crisis)
+        parts = []
+        chunks = get_bot_response(session, message, mood, stream=True)
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield 'chunk', {"text": chunk}
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            reply = "".join(parts)
+            if parts:
+                finish_turn(session, question, reply, mood)
+        yield 'done', {"reply": reply, "mood": mood, **crisis_fields(crisis)}
+
+
+async def create_session(request):
+    session = await run_in_threadpool(sessions.create, api_key(request))
+    return JSONResponse({"session_id": session.session_id}, status_code=201)
+
+
+async def set_mood(request):
+    mood = parse_mood(await read_json(request))
+    session = await run_in_threadpool(session_for, request)
+    await run_in_threadpool(log_mood, session, mood)
+    return JSONResponse({"mood": mood})
+
+
+async def chat(request):
+    message, mood = parse_turn(await read_json(request))
+    session = await run_in_threadpool(session_for, request)
+    return JSONResponse(await run_in_threadpool(run_turn, session, message, mood))
+
+
+async def chat_stream(request):
+    message, mood = parse_turn(await read_json(request))
+    session = await run_in_threadpool(session_for, request)
+
+    def events():
+        for event, data in stream_turn(session, message, mood):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    # A sync iterator is consumed on the threadpool, so blocking model calls never stall the event loop
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def messages(request):
+    session_id = await run_in_threadpool(known_session_id, request)
+    try:
+        start = int(request.query_params.get('start', 0))
+        stop = int(request.query_params.get('stop', start + 100))
+    except ValueError:
+        raise ApiError(422, "'start' and 'stop' must be integers")
+    rows = await run_in_threadpool(store.slice, session_id, start, min(stop, start + 1000))
+    return JSONResponse({"session_id": session_id, "start": start, "messages": rows})
+
+
+async def chat_socket(websocket):
+    await websocket.accept()
+    try:
+        session = await run_in_threadpool(session_for, websocket)
+    except ApiError as e:
+        await websocket.close(code=4000 + e.status, reason=e.detail)
+        return
+    try:
+        while True:
+            body = await websocket.receive_json()
+            try:
+                if isinstance(body, dict) and 'message' not in body:
+                    mood = parse_mood(body)
+                    await run_in_threadpool(log_mood, session, mood)
+                    await websocket.send_json({"type": "mood", "mood": mood})
+                    continue
+                message, mood = parse_turn(body)
+            except ApiError as e:
+                await websocket.send_json({"type": "error", "status": e.status, "detail": e.detail})
+                continue
+            async for event, data in iterate_in_threadpool(stream_turn(session, message, mood)):
+                await websocket.send_json({"type": event, **data})
+    except WebSocketDisconnect:
+        pass
+
+
+async def healthz(request):
+    return JSONResponse({"status": "ok", "sessions": len(sessions), "pid": os.getpid()})
+
+
+async def prometheus(request):
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def api_error(request, exc):
+    return JSONResponse({"detail": exc.detail}, status_code=exc.status)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    start_exporters()
+    yield
+    sessions.clear()
+
+
+app = Starlette(
+    routes=[
+        Route('/v1/sessions', create_session, methods=['POST']),
+        Route('/v1/sessions/{session_id}/mood', set_mood, methods=['POST']),
+        Route('/v1/sessions/{session_id}/chat', chat, methods=['POST']),
+        Route('/v1/sessions/{session_id}/chat/stream', chat_stream, methods=['POST']),
+        Route('/v1/sessions/{session_id}/messages', messages, methods=['GET']),
+        WebSocketRoute('/v1/sessions/{session_id}/ws', chat_socket),
+        Route('/healthz', healthz),
+        Route('/metrics', prometheus),
+    ],
+    exception_handlers={ApiError: api_error},
+    lifespan=lifespan,
+)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="MindfulAI chat API")
+    parser.add_argument('--host', default=os.getenv('API_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('API_PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('API_WORKERS', '1')))
+    args = parser.parse_args()
+    uvicorn.run('api_server:app', host=args.host, port=args.port, workers=args.workers, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""Replay a corpus of multi-turn conversations through the chat pipeline and score the replies
+
+Each corpus line is one conversation:
+
+    {"id": "exam-stress", "mood": "Anxious", "turns": [
+        {"user": "I have three exams next week", "expect": ["breath", "break"]},
+        {"user": "I can't go on like this", "mood": "Sad", "crisis": true}]}
+
+A turn's mood carries over to later turns, like a mood logged in the app.
+`crisis` marks messages that should trip the crisis detector and `expect`
+lists words a good reply should contain (any case). Every turn is built with
+the app's ContextBuilder and SYSTEM_PROMPT, answered by the routed models
+with retries, and older turns are folded into the rolling summary as they
+are in the app (waited for here, so runs are repeatable).
+
+Conversations run on a thread pool, --concurrency at a time. Each finished
+conversation is appended to --out as one JSON line with its per-turn
+replies, latencies and checks, so an interrupted run picks up where it
+stopped when started again with the same --out. The file's first line
+records the system prompt and models; resuming with different ones is
+refused.
+
+    python batch_eval.py evals/corpus.jsonl --concurrency 8
+    python batch_eval.py evals/corpus.jsonl --offline      # fake Gemini server, no key or network
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from chat_pipeline import MOODS, SYSTEM_PROMPT
+from context_builder import ContextBuilder
+from crisis_detector import detector
+from measurement import git_commit, latency_summary
+from model_registry import ROUTED_MODELS, registry
+from resilience import classify
+from summarizer import summarizer
+
+EVAL_RESULTS = os.getenv('EVAL_RESULTS', os.path.join('evals', 'results.jsonl'))
+EVAL_CONCURRENCY = int(os.getenv('EVAL_CONCURRENCY', '4'))
+
+OFFLINE_REPLIES = (
+    "That sounds really hard. Let's take a slow breath together and take it one step at a time.",
+    "Thank you for sharing that with me. What has helped you feel a little better before?",
+    "It makes sense to feel this way. A short break, some water and a walk can help reset things.",
+)
+
+
+def load_corpus(path):
+    """The conversations in a JSONL corpus, checked; raises ValueError naming the bad line"""
+    conversations, seen = [], set()
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                conversation = json.loads(line)
+                turns = conversation["turns"]
+                conversation_id = str(conversation.get("id", number))
+                if not turns or not all(isinstance(turn.get("user"), str) and turn["user"].strip() for turn in turns):
+                    raise ValueError("every turn needs a non-empty 'user' message")
+                for mood in [conversation.get("mood")] + [turn.get("mood") for turn in turns]:
+                    if mood is not None and mood not in MOODS:
+                        raise ValueError(f"unknown mood {mood!r}")
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                raise ValueError(f"{path}:{number}: {e}") from None
+            if conversation_id in seen:
+                raise ValueError(f"{path}:{number}: duplicate id {conversation_id!r}")
+            seen.add(conversation_id)
+            conversations.append(dict(conversation, id=conversation_id))
+    return conversations
+
+
+def fingerprint(models):
+    """What the results depend on besides the corpus; a resumed run must match it"""
+    return {"system_prompt_sha256": hashlib.sha256(SYSTEM_PROMPT.encode()).hexdigest()[:16], "models": list(models)}
+
+
+class Checkpoint:
+    """The results file: a header line, then one line per finished conversation"""
+
+    def __init__(self, path, models):
+        self.path = path
+        self.fingerprint = fingerprint(models)
+        self.done = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._resume()
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._write({"run": dict(self.fingerprint, started=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                                     commit=git_commit())})
+
+    def _resume(self):
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            # A line cut off by an interruption is dropped and its conversation replayed
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+        lines = data[:end].decode('utf-8').splitlines()
+        header = json.loads(lines[0])["run"] if lines else {}
+        if {name: header.get(name) for name in self.fingerprint} != self.fingerprint:
+            raise ValueError(f"{self.path} holds results for a different system prompt or models; "
+                             f"use another --out or --restart")
+        for line in lines[1:]:
+            result = json.loads(line)
+            self.done[result["conversation"]] = result
+
+    def _write(self, record):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, result):
+        with self._lock:
+            self._write(result)
+            self.done[result["conversation"]] = result
+
+
+def replay(conversation, model):
+    """Run one conversation turn by turn; returns its result record"""
+    context = ContextBuilder(SYSTEM_PROMPT)
+    mood = conversation.get("mood")
+    turns, summaries = [], []
+    started = time.perf_counter()
+    for index, turn in enumerate(conversation["turns"]):
+        mood = turn.get("mood", mood)
+        message = turn["user"]
+        prompt = context.build(message, mood)
+        record = {"turn": index, "user": message, "mood": mood, "prompt_tokens": context.prompt_tokens(message, mood),
+                  "crisis_detected": detector.match(message) is not None}
+        if "crisis" in turn:
+            record["crisis_expected"] = bool(turn["crisis"])
+        start = time.perf_counter()
+        try:
+            reply = model.generate_content(prompt)
+            record["error"] = None
+        except Exception as e:
+            reply, record["error"] = "", classify(e)
+        record["latency_ms"] = (time.perf_counter() - start) * 1000
+        record["reply"] = reply
+        record["reply_words"] = len(reply.split())
+        if turn.get("expect"):
+            lowered = reply.lower()
+            record["expect_hits"] = sum(word.lower() in lowered for word in turn["expect"])
+            record["expect_total"] = len(turn["expect"])
+        turns.append(record)
+        if record["error"]:
+            # Unlike the app, which keeps its apology in the window, the eval leaves
+            # failed turns out so they do not steer the replies that follow
+            continue
+        context.add("user", message)
+        context.add("assistant", reply)
+        job = summarizer.schedule(context, model.generate_content)
+        if job is not None:
+            start = time.perf_counter()
+            try:
+                job.result()
+                summaries.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                pass
+    return {"conversation": conversation["id"], "turns": turns, "summary_ms": summaries,
+            "elapsed_ms": (time.perf_counter() - started) * 1000}
+
+
+def run(conversations, checkpoint, api_key, models=ROUTED_MODELS, concurrency=EVAL_CONCURRENCY, progress=None):
+    """Replay the conversations not in the checkpoint yet; returns how many were replayed"""
+    pending = [c for c in conversations if c["id"] not in checkpoint.done]
+    lease = registry.acquire(api_key, tuple(models))
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='eval')
+    try:
+        futures = [executor.submit(replay, conversation, lease.model) for conversation in pending]
+        for count, future in enumerate(as_completed(futures), 1):
+            checkpoint.add(future.result())
+            if progress:
+                progress(count, len(pending))
+    finally:
+        # On an interruption, finished conversations are already saved; queued ones are dropped
+        executor.shutdown(wait=True, cancel_futures=True)
+        lease.release()
+    return len(pending)
+
+
+def report(results):
+    """Latency, error, crisis-detection and expectation summary over result records"""
+    turns = [turn for result in results for turn in result["turns"]]
+    answered = [turn for turn in turns if not turn["error"]]
+    errors = {}
+    for turn in turns:
+        if turn["error"]:
+            errors[turn["error"]] = errors.get(turn["error"], 0) + 1
+    labelled = [turn for turn in turns if "crisis_expected" in turn]
+    crisis = {"true_positive": sum(t["crisis_expected"] and t["crisis_detected"] for t in labelled),
+              "false_negative": sum(t["crisis_expected"] and not t["crisis_detected"] for t in labelled),
+              "false_positive": sum(not t["crisis_expected"] and t["crisis_detected"] for t in labelled)}
+    expected = [turn for turn in answered if "expect_total" in turn]
+    return {"conversations": len(results), "turns": len(turns), "errors": errors,
+            "latency": latency_summary([turn["latency_ms"] / 1000 for turn in answered]),
+            "summary_latency": latency_summary([ms / 1000 for result in results for ms in result["summary_ms"]]),
+            "reply_words_mean": sum(t["reply_words"] for t in answered) / len(answered) if answered else None,
+            "crisis": crisis,
+            "expect_hit_rate": (sum(t["expect_hits"] for t in expected) / sum(t["expect_total"] for t in expected)
+                                if expected else None)}
+
+
+def offline_server(latency):
+    """Start the fake Gemini server and point the client at it"""
+    import gemini_client
+    from fake_gemini import FakeGemini
+
+    fake = FakeGemini(reply=lambda model, prompt: OFFLINE_REPLIES[len(prompt) % len(OFFLINE_REPLIES)],
+                      latency=latency).start()
+    gemini_client.runtime.base_url = fake.url
+    return fake
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Replay a conversation corpus and score the replies")
+    parser.add_argument('corpus')
+    parser.add_argument('--out', default=EVAL_RESULTS, help='results file; rerun with the same one to resume')
+    parser.add_argument('--models', default=','.join(ROUTED_MODELS), help='comma-separated, preferred first')
+    parser.add_argument('--concurrency', type=int, default=EVAL_CONCURRENCY)
+    parser.add_argument('--restart', action='store_true', help='discard earlier results in --out')
+    parser.add_argument('--offline', action='store_true', help='answer from the local fake Gemini server')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake server latency with --offline')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    models = [name.strip() for name in args.models.split(',') if name.strip()]
+    api_key = 'offline' if args.offline else os.getenv('GOOGLE_API_KEY')
+    if not api_key:
+        parser.error("set GOOGLE_API_KEY or use --offline")
+    conversations = load_corpus(args.corpus)
+    if args.restart and os.path.exists(args.out):
+        os.remove(args.out)
+    try:
+        checkpoint = Checkpoint(args.out, models)
+    except ValueError as e:
+        parser.error(str(e))
+    fake = offline_server(args.latency) if args.offline else None
+
+    print(f"{len(checkpoint.done)} of {len(conversations)} conversations already in {args.out}")
+    try:
+        run(conversations, checkpoint, api_key, models, args.concurrency,
+            progress=lambda done, total: print(f"\r  {done}/{total} replayed", end='', flush=True))
+        print()
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; run again with --out {args.out} to resume")
+        return
+    finally:
+        if fake:
+            fake.stop()
+
+    ids = {conversation["id"] for conversation in conversations}
+    summary = report([result for name, result in checkpoint.done.items() if name in ids])
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    latency = summary["latency"]
+    print(f"{summary['conversations']} conversations, {summary['turns']} turns, errors: {summary['errors'] or 'none'}")
+    if latency["count"]:
+        print(f"  reply latency p50 {latency['p50_ms']:.0f} ms, p95 {latency['p95_ms']:.0f} ms, "
+              f"p99 {latency['p99_ms']:.0f} ms; {summary['reply_words_mean']:.0f} words per reply")
+    crisis = summary["crisis"]
+    print(f"  crisis detection: {crisis['true_positive']} caught, {crisis['false_negative']} missed, "
+          f"{crisis['false_positive']} false alarms")
+    if summary["expect_hit_rate"] is not None:
+        print(f"  expected words found: {summary['expect_hit_rate']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Analytics over millions of turns: snapshot ingest and vectorized report vs a Python loop
+
+Fills a fresh conversation store with --turns user/assistant turns across
+--sessions sessions (plus a mood log every few turns), then times a full
+snapshot refresh, an incremental refresh after one more day of traffic,
+loading the snapshot and computing the report. The baseline computes the same
+response-time and mood aggregates row by row from SQLite.
+Run with `python -m benchmarks.bench_analytics [--turns 1000000]`.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from analytics import MOODS, Snapshot, report
+from benchmarks.harness import record
+
+
+def fill(conn, sessions, turns, start, seed):
+    rng = random.Random(seed)
+    messages, moods = [], []
+    for turn in range(turns):
+        session = f"session-{rng.randrange(sessions)}"
+        at = start + turn * 2.0
+        mood = rng.choice(MOODS)
+        messages.append((session, at, 'user', 'x' * rng.randint(5, 300), mood, 0))
+        messages.append((session, at + rng.uniform(0.5, 6.0), 'assistant', 'y' * rng.randint(200, 1500), mood, 0))
+        if turn % 4 == 0:
+            moods.append((session, at, mood))
+    with conn:
+        conn.executemany('INSERT INTO messages (session_id, created_at, role, content, mood, flagged) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', messages)
+        conn.executemany('INSERT INTO moods (session_id, created_at, mood) VALUES (?, ?, ?)', moods)
+
+
+def python_baseline(db_path):
+    """Response times and daily mood counts with a loop over rows, as a point of comparison"""
+    conn = sqlite3.connect(db_path)
+    last = {}
+    times = []
+    for session, created, role in conn.execute(
+            'SELECT session_id, created_at, role FROM messages ORDER BY session_id, created_at, id'):
+        previous = last.get(session)
+        if role == 'assistant' and previous and previous[1] == 'user':
+            times.append(created - previous[0])
+        last[session] = (created, role)
+    days = {}
+    for created, mood in conn.execute('SELECT created_at, mood FROM moods'):
+        key = (int(created // 86400), mood)
+        days[key] = days.get(key, 0) + 1
+    conn.close()
+    times.sort()
+    return times[len(times) // 2] if times else None, len(days)
+
+
+def timed(call):
+    start = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=1_000_000)
+    parser.add_argument('--sessions', type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['CHAT_DB_PATH'] = db_path = os.path.join(tmp, 'bench.db')
+        from conversation_store import ConversationStore
+        conn = ConversationStore(db_path).db
+        print(f"Filling a store with {args.turns:,} turns ...")
+        fill(conn, args.sessions, args.turns, start=1_700_000_000, seed=1)
+
+        snapshot = Snapshot(os.path.join(tmp, 'analytics'))
+        _, ingest_s = timed(lambda: snapshot.refresh(db_path))
+        fill(conn, args.sessions, args.turns // 30, start=1_700_000_000 + args.turns * 2, seed=2)
+        _, incremental_s = timed(lambda: snapshot.refresh(db_path))
+        (messages, moods, _), load_s = timed(snapshot.load)
+        summary, report_s = timed(lambda: report(messages, moods))
+        (baseline_p50, _), baseline_s = timed(lambda: python_baseline(db_path))
+        assert np.isclose(summary["response_seconds"]["p50"], baseline_p50, rtol=1e-3)
+
+    metrics = {"messages": summary["messages"], "ingest_s": ingest_s, "incremental_ingest_s": incremental_s,
+               "load_s": load_s, "report_s": report_s, "python_baseline_s": baseline_s}
+    run = record('analytics', vars(args), metrics)
+    print(f"{summary['messages']:,} messages, {summary['moods']['logs']:,} mood logs")
+    print(f"  full ingest          {ingest_s:7.2f} s")
+    print(f"  incremental ingest   {incremental_s:7.2f} s  ({args.turns // 30:,} new turns)")
+    print(f"  load snapshot        {load_s:7.2f} s")
+    print(f"  vectorized report    {report_s:7.2f} s")
+    print(f"  Python loop baseline {baseline_s:7.2f} s  (response times and daily moods only)")
+    print(f"  peak RSS {run['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
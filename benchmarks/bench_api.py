@@ -0,0 +1,156 @@
+"""Multi-session load against api_server.py, optionally compared with the Streamlit path
+
+Starts `api_server.py --workers N` in a subprocess against the local fake
+Gemini server. Simulates --users clients on threads that each send --turns
+messages with --think seconds between them, the same way bench_load does,
+over JSON (--mode json) or SSE (--mode sse). A turn is timed from sending the
+message until the full reply has arrived. Admission limits are lifted unless
+--admission is given.
+
+With --compare, bench_load is then run with the same users, turns, think
+time and fake latency (blocking replies for --mode json), and the two
+results are printed side by side.
+Run with `python -m benchmarks.bench_api [--users 20] [--turns 5] [--workers 2] [--compare]`.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from benchmarks.bench_load import MESSAGES, UNLIMITED_ADMISSION
+from benchmarks.harness import ROOT, latency_summary, load, record
+from fake_gemini import FakeGemini
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(base, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            httpx.get(f'{base}/healthz')
+            return
+        except httpx.TransportError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("api_server did not start")
+            time.sleep(0.1)
+
+
+def send(client, session_id, message, mode):
+    """The reply to one message, read to the end"""
+    url = f'/v1/sessions/{session_id}/chat'
+    if mode == 'json':
+        return client.post(url, json={'message': message}).json()['reply']
+    with client.stream('POST', f'{url}/stream', json={'message': message}) as response:
+        for line in response.iter_lines():
+            if line.startswith('data: '):
+                data = json.loads(line[6:])
+        return data['reply']
+
+
+def user(base, index, turns, think, seed, mode, latencies, errors):
+    rng = random.Random(seed + index)
+    with httpx.Client(base_url=base, timeout=120) as client:
+        session_id = client.post('/v1/sessions').json()['session_id']
+        for turn in range(turns):
+            time.sleep(rng.uniform(0, 2 * think))
+            message = f"{rng.choice(MESSAGES)} ({index}.{turn})"
+            start = time.perf_counter()
+            try:
+                reply = send(client, session_id, message, mode)
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                errors.append(repr(e))
+                continue
+            elapsed = time.perf_counter() - start
+            if reply.startswith('💙 Reply'):
+                latencies.append(elapsed)
+            else:
+                errors.append(reply[:80])
+
+
+def streamlit_run(args):
+    """Run bench_load with matching parameters and return its recorded run"""
+    command = [sys.executable, '-m', 'benchmarks.bench_load', '--users', str(args.users), '--turns', str(args.turns),
+               '--think', str(args.think), '--latency', str(args.latency), '--chunk-delay', str(args.chunk_delay),
+               '--seed', str(args.seed)]
+    command += ['--no-stream'] if args.mode == 'json' else []
+    command += ['--admission'] if args.admission else []
+    subprocess.run(command, cwd=ROOT, check=True, capture_output=True)
+    return [run for run in load() if run['benchmark'] == 'load'][-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--think', type=float, default=0.5, help='mean seconds between a user\'s messages')
+    parser.add_argument('--latency', type=float, default=0.5, help='fake server time to first byte')
+    parser.add_argument('--chunk-delay', type=float, default=0.02)
+    parser.add_argument('--mode', choices=('json', 'sse'), default='sse')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--admission', action='store_true', help='keep the configured admission limits')
+    parser.add_argument('--compare', action='store_true', help='also run bench_load with the same parameters')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    with FakeGemini(reply=lambda model, prompt: f"💙 Reply from {model}. Let's take this one step at a time.",
+                    latency=args.latency, chunk_delay=args.chunk_delay, chunks=4) as fake, \
+            tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(os.environ, GEMINI_API_BASE=fake.url, GOOGLE_API_KEY='bench',
+                   CHAT_DB_PATH=os.path.join(tmp, 'bench.db'))
+        if not args.admission:
+            env.update(UNLIMITED_ADMISSION)
+        server = subprocess.Popen([sys.executable, 'api_server.py', '--port', str(port),
+                                   '--workers', str(args.workers)], cwd=ROOT, env=env)
+        base = f'http://127.0.0.1:{port}'
+        try:
+            wait_ready(base, server)
+            latencies, errors = [], []
+            threads = [threading.Thread(target=user, args=(base, i, args.turns, args.think, args.seed, args.mode,
+                                                            latencies, errors))
+                       for i in range(args.users)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        upstream = len(fake.requests)
+
+    metrics = {"turns": latency_summary(latencies, elapsed), "errors": len(errors),
+               "upstream_requests": upstream, "elapsed_s": elapsed}
+    params = {k: v for k, v in vars(args).items() if k != 'compare'}
+    record('api', params, metrics)
+    runs = [("api", metrics)]
+    if args.compare:
+        runs.append(("streamlit", streamlit_run(args)["metrics"]))
+
+    print(f"{args.users} users x {args.turns} turns, {args.latency:g}s upstream latency, {args.mode}, "
+          f"{args.workers} API workers")
+    print(f"  {'path':<10} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'failed':>7}")
+    for name, result in runs:
+        turns = result["turns"]
+        print(f"  {name:<10} {turns.get('throughput_per_s', 0):>8.1f} {turns['p50_ms'] or 0:>8.0f} "
+              f"{turns['p95_ms'] or 0:>8.0f} {turns['p99_ms'] or 0:>8.0f} {result['errors']:>7}")
+    for error in errors[:5]:
+        print(f"  failed: {error}")
+
+
+if __name__ == '__main__':
+    main()
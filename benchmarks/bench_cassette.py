@@ -0,0 +1,115 @@
+"""Chat turns replayed from a cassette vs answered by the fake Gemini server
+
+Runs --sessions conversations of --turns messages through the chat pipeline
+(start_turn, get_bot_response, finish_turn, with the reply cache off and
+admission limits lifted) twice. The first pass answers from the fake server
+with --latency seconds to first byte and records every call to a cassette.
+The second replays them from the cassette with no server and no pacing.
+Also times bare replayed generate and stream calls. Replies are compared
+turn by turn, so a mismatch or a cassette miss shows up as an error; each
+turn waits for its background summary so both passes send the same prompts.
+Run with `python -m benchmarks.bench_cassette [--sessions 20] [--turns 10] [--threads 4]`.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_load import MESSAGES, UNLIMITED_ADMISSION
+from benchmarks.harness import latency_summary, record, time_calls
+from fake_gemini import FakeGemini
+
+CALL_PROMPT = "Say hello in one sentence"
+
+
+def conversation(session, turns, api_key, stream):
+    from chat_pipeline import ChatSession, finish_turn, get_bot_response, start_turn
+    from summarizer import summarizer
+
+    state = ChatSession(api_key, session_id=f"{session:032x}")
+    replies, latencies = [], []
+    for turn in range(turns):
+        message = f"{MESSAGES[(session + turn) % len(MESSAGES)]} ({session}.{turn})"
+        start = time.perf_counter()
+        question, _ = start_turn(state, message)
+        reply = get_bot_response(state, message, stream=stream, use_cache=False)
+        reply = "".join(reply) if stream else reply
+        finish_turn(state, question, reply)
+        # The next prompt carries the summary, so let it land in both passes
+        summarizer.wait(state.context)
+        latencies.append(time.perf_counter() - start)
+        replies.append(reply)
+    state.close()
+    return replies, latencies
+
+
+def run_pass(args, api_key):
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda s: conversation(s, args.turns, api_key, args.stream), range(args.sessions)))
+        elapsed = time.perf_counter() - start
+    replies = [reply for session_replies, _ in results for reply in session_replies]
+    latencies = [latency for _, session_latencies in results for latency in session_latencies]
+    return replies, latency_summary(latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--turns', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05, help='fake server time to first byte')
+    parser.add_argument('--stream', action='store_true', help='stream replies instead of waiting for them')
+    parser.add_argument('--calls', type=int, default=2000, help='bare replayed model calls to time')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Read by the pipeline's modules at import. One model, since the router
+        # picks between several by measured latency, which differs between passes
+        os.environ.update(CHAT_DB_PATH=os.path.join(tmp, 'bench.db'), SESSION_BACKEND='memory',
+                          GEMINI_MODELS='gemini-2.5-flash', **UNLIMITED_ADMISSION)
+        import gemini_client
+        from cassette import RECORD, REPLAY, Cassette
+
+        path = os.path.join(tmp, 'bench.jsonl')
+        with FakeGemini(reply=lambda model, prompt: f"💙 Reply {len(prompt)} from {model}. One step at a time.",
+                        latency=args.latency, chunks=4) as fake:
+            gemini_client.runtime.base_url = fake.url
+            gemini_client.runtime.cassette = Cassette(path, RECORD)
+            live, live_turns = run_pass(args, 'bench-record')
+            upstream = len(fake.requests)
+            model = gemini_client.GeminiModel('bench-record', gemini_client.DEFAULT_MODEL)
+            model.generate_content(CALL_PROMPT)
+            list(model.generate_content(CALL_PROMPT, stream=True))
+        size = os.path.getsize(path)
+
+        cassette = gemini_client.runtime.cassette = Cassette(path, REPLAY)
+        replayed, replay_turns = run_pass(args, 'bench-replay')
+        model = gemini_client.GeminiModel('bench-replay', gemini_client.DEFAULT_MODEL)
+        calls = {"generate": latency_summary(time_calls(lambda: model.generate_content(CALL_PROMPT), args.calls, 50)),
+                 "stream": latency_summary(time_calls(lambda: list(model.generate_content(CALL_PROMPT, stream=True)),
+                                                      args.calls, 50))}
+        for summary in calls.values():
+            summary["throughput_per_s"] = 1000 / summary["p50_ms"]
+        errors = sum(a != b for a, b in zip(live, replayed)) + cassette.misses
+        gemini_client.runtime.close()
+
+    metrics = {"live": live_turns, "replay": replay_turns, "calls": calls, "errors": errors,
+               "upstream_requests": upstream,
+               "cassette_bytes": size, "cassette_bytes_per_call": size / max(1, upstream)}
+    record('cassette', vars(args), metrics)
+    print(f"{args.sessions} sessions x {args.turns} turns on {args.threads} threads, "
+          f"{'streaming' if args.stream else 'blocking'}, fake latency {args.latency:g}s")
+    for name, turns in (("fake server", live_turns), ("replay", replay_turns)):
+        print(f"  {name:<12} {turns['throughput_per_s']:>8.0f} turns/s   p50 {turns['p50_ms']:.2f} ms, "
+              f"p99 {turns['p99_ms']:.2f} ms")
+    for name, summary in calls.items():
+        print(f"  bare {name:<8} p50 {summary['p50_ms'] * 1000:.0f} µs, p99 {summary['p99_ms'] * 1000:.0f} µs "
+              f"(~{summary['throughput_per_s']:.0f} calls/s on one thread)")
+    print(f"  cassette: {upstream} calls, {size / 1024:.0f} KiB ({metrics['cassette_bytes_per_call']:.0f} B/call), "
+          f"{errors} mismatches or misses")
+
+
+if __name__ == '__main__':
+    main()
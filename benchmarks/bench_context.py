@@ -0,0 +1,53 @@
+"""Per-turn prompt size: last-5 window vs full history vs budget + rolling summary
+
+Run with `python -m benchmarks.bench_context` from the project root.
+"""
+import time
+
+from context_builder import ContextBuilder, estimate_tokens
+from summarizer import ConversationSummarizer
+
+SYSTEM_PROMPT = "You are MindfulAI, a compassionate mental health support companion. " * 8
+USER_TURN = "I've been feeling overwhelmed with work and I can't switch off at night, any ideas? "
+BOT_TURN = ("That sounds exhausting. A short wind-down routine can help: dim the lights, "
+            "write tomorrow's to-do list, and try slow breathing for a few minutes. ") * 2
+STUB_SUMMARY = ("User is overwhelmed by work and struggling to switch off at night. "
+                "MindfulAI suggested a wind-down routine, to-do lists and slow breathing. ") * 3
+CHECKPOINTS = (10, 50, 100, 500, 1000)
+
+
+def last_five(history, message):
+    # The pre-builder approach: messages[-5:] (including the new message) plus the message again
+    window = history[-4:] + [("user", message)]
+    lines = "".join(f"{'User' if role == 'user' else 'MindfulAI'}: {text}\n" for role, text in window)
+    return f"{SYSTEM_PROMPT}\n\nRecent conversation:\n{lines}\nUser: {message}\nMindfulAI:"
+
+
+def full_history(history, message):
+    lines = "".join(f"{'User' if role == 'user' else 'MindfulAI'}: {text}\n" for role, text in history)
+    return f"{SYSTEM_PROMPT}\n\nRecent conversation:\n{lines}\nUser: {message}\nMindfulAI:"
+
+
+def main():
+    builder = ContextBuilder(SYSTEM_PROMPT)
+    summarizer = ConversationSummarizer()
+    history = []
+    print(f"{'turn':>6} {'last-5':>8} {'full':>8} {'budget+summary':>15} {'build us':>9}")
+    for turn in range(1, max(CHECKPOINTS) + 1):
+        if turn in CHECKPOINTS:
+            start = time.perf_counter()
+            prompt = builder.build(USER_TURN)
+            build_us = (time.perf_counter() - start) * 1e6
+            print(f"{turn:>6} {estimate_tokens(last_five(history, USER_TURN)):>8} "
+                  f"{estimate_tokens(full_history(history, USER_TURN)):>8} "
+                  f"{estimate_tokens(prompt):>15} {build_us:>9.1f}")
+        history += [("user", USER_TURN), ("assistant", BOT_TURN)]
+        builder.add("user", USER_TURN)
+        builder.add("assistant", BOT_TURN)
+        job = summarizer.schedule(builder, lambda prompt: STUB_SUMMARY)
+        if job:
+            job.result()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Crisis detector throughput over a large synthetic message corpus
+
+Compares the compiled detector against a naive lowercase substring scan over
+the same phrase list and checks both flag the same messages.
+Run with `python -m benchmarks.bench_crisis [--messages 200000] [--crisis-rate 0.01]`.
+"""
+import argparse
+import random
+import time
+
+from crisis_detector import CRISIS_PHRASES, CrisisDetector
+
+WORDS = ("i feel really tired today and work has been stressful my friends say i should rest more but "
+         "sleep is hard when my mind keeps racing about deadlines family money and whether things will "
+         "get better honestly it has been a long week and i just need someone to talk to").split()
+
+
+def corpus(count, crisis_rate, seed=7):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(5, 60))
+        if rng.random() < crisis_rate:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(CRISIS_PHRASES))
+        messages.append(" ".join(words).capitalize())
+    return messages
+
+
+def naive(phrases):
+    lowered = [phrase.lower() for phrase in phrases]
+    return lambda text: any(phrase in text.lower() for phrase in lowered)
+
+
+def measure(check, messages):
+    start = time.perf_counter()
+    flagged = sum(1 for message in messages if check(message))
+    return time.perf_counter() - start, flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--crisis-rate', type=float, default=0.01)
+    args = parser.parse_args()
+
+    messages = corpus(args.messages, args.crisis_rate)
+    start = time.perf_counter()
+    detector = CrisisDetector()
+    compile_ms = (time.perf_counter() - start) * 1000
+    variants = {
+        'substring scan': naive(CRISIS_PHRASES),
+        'compiled regex': lambda text: detector.match(text) is not None,
+    }
+    avg_chars = sum(map(len, messages)) / len(messages)
+    print(f"{len(messages):,} messages, {avg_chars:.0f} chars on average, "
+          f"{len(CRISIS_PHRASES)} phrases (compiled in {compile_ms:.2f} ms)")
+    print(f"{'variant':<16} {'messages/s':>12} {'us/message':>11} {'flagged':>8}")
+    for name, check in variants.items():
+        elapsed, flagged = measure(check, messages)
+        print(f"{name:<16} {len(messages) / elapsed:>12,.0f} {elapsed / len(messages) * 1e6:>11.2f} {flagged:>8,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Conversation export: serialization throughput, incremental saves and bulk export
+
+Fills a fresh conversation store with one long session of --messages messages
+plus --sessions shorter ones of --session-messages each. It then times:
+- the original Save Conversation handler: the history as a list, json.dump(indent=2)
+- the exporter's JSON array format, which the app saved before JSON Lines
+- full exporter runs as JSON Lines and gzip at levels 1 and 6
+- a save after --new more messages, which appends only those
+- how long the Save button's thread waits for submit()
+- a bulk export of every session into one file, and into one file each
+Run with `python -m benchmarks.bench_export [--messages 200000] [--sessions 2000]`.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.harness import latency_summary, record, time_calls
+from message_log import MOODS
+
+LONG_SESSION = "long-session"
+
+
+WORDS = ("I", "feel", "anxious", "about", "exams", "and", "sleep", "badly", "try", "a", "slow", "breath", "walk",
+         "break", "it", "makes", "sense", "to", "rest", "today", "tomorrow", "friends", "work", "💙", "\"okay\"")
+
+
+def fill(conn, session_ids, per_session, start, seed):
+    rng = random.Random(seed)
+    rows = []
+    for index in range(per_session):
+        for session_id in session_ids:
+            role = 'user' if index % 2 == 0 else 'assistant'
+            words = rng.randint(4, 50) if role == 'user' else rng.randint(40, 250)
+            rows.append((session_id, start + index * 30.0 + rng.random(), role,
+                         ' '.join(rng.choices(WORDS, k=words)), rng.choice(MOODS), 0))
+    with conn:
+        conn.executemany('INSERT INTO messages (session_id, created_at, role, content, mood, flagged) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+def timed(call):
+    start = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - start
+
+
+def rate(messages, size, seconds):
+    return {"seconds": seconds, "messages_per_s": messages / seconds, "bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200_000, help='messages in the long session')
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--session-messages', type=int, default=50)
+    parser.add_argument('--new', type=int, default=20, help='messages added before the incremental save')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        from conversation_store import ConversationStore
+        from exporter import Exporter
+
+        store = ConversationStore(os.path.join(tmp, 'bench.db'))
+        print(f"Filling a store with {args.messages:,} + {args.sessions * args.session_messages:,} messages ...")
+        fill(store.db, [LONG_SESSION], args.messages, 1_700_000_000, seed=1)
+        fill(store.db, [f"session-{i}" for i in range(args.sessions)], args.session_messages, 1_700_000_000, seed=2)
+        total = args.messages + args.sessions * args.session_messages
+
+        results = {}
+        # What the button did originally: the whole history in memory, pretty-printed
+        history = [{"role": m["role"], "content": m["content"]} for m in store.iter_messages(LONG_SESSION)]
+        out = io.StringIO()
+        _, seconds = timed(lambda: json.dump(history, out, indent=2))
+        results["json_dump_indent"] = rate(len(history), len(out.getvalue().encode('utf-8')), seconds)
+        del history, out
+        for name, fmt, level in (("json_array", "json", 6), ("jsonl", "jsonl", 6), ("jsonl_gz1", "jsonl.gz", 1), ("jsonl_gz6", "jsonl.gz", 6)):
+            exporter = Exporter(store, os.path.join(tmp, name), fmt, gzip_level=level)
+            result = exporter.export(LONG_SESSION)
+            results[name] = rate(result["written"], result["bytes"], result["seconds"])
+
+        fill(store.db, [LONG_SESSION], args.new, 1_800_000_000, seed=3)
+        incremental = {}
+        for name, fmt in (("jsonl", "jsonl"), ("jsonl_gz1", "jsonl.gz")):
+            result = Exporter(store, os.path.join(tmp, name), fmt, gzip_level=1).export(LONG_SESSION)
+            assert result["written"] == args.new and not result["rewritten"]
+            incremental[name] = {"seconds": result["seconds"], "bytes": result["bytes"]}
+
+        exporter = Exporter(store, os.path.join(tmp, 'submit'), 'jsonl')
+        submit = latency_summary(time_calls(lambda: exporter.submit(LONG_SESSION), 200))
+        exporter.close()
+
+        bulk = Exporter(store, os.path.join(tmp, 'bulk'), 'jsonl.gz', workers=4, gzip_level=1)
+        result = bulk.export()
+        results["bulk_combined_gz"] = rate(result["written"], result["bytes"], result["seconds"])
+        each, seconds = timed(lambda: bulk.export_many(store.session_ids()))
+        results["bulk_each_gz"] = rate(sum(r["written"] for r in each), sum(r["bytes"] for r in each), seconds)
+        bulk.close()
+        store.close()
+
+    metrics = {"messages": total, "exports": results, "incremental": incremental, "submit": submit}
+    run = record('export', vars(args), metrics)
+    print(f"Long session: {args.messages:,} messages")
+    labels = {"json_dump_indent": "json.dump(indent=2) of a list (old button)",
+              "json_array": "exporter json array",
+              "jsonl": "exporter jsonl", "jsonl_gz1": "exporter jsonl.gz level 1",
+              "jsonl_gz6": "exporter jsonl.gz level 6",
+              "bulk_combined_gz": f"bulk, one .gz for {args.sessions + 1:,} sessions",
+              "bulk_each_gz": f"bulk, {args.sessions + 1:,} .gz files on 4 threads"}
+    for name, label in labels.items():
+        if name == "bulk_combined_gz":
+            print(f"All sessions: {total:,} messages")
+        stats = results[name]
+        print(f"  {label:<44} {stats['messages_per_s']:>10,.0f} msg/s {stats['bytes'] / 2 ** 20:>8.1f} MiB "
+              f"{stats['seconds']:>6.2f} s")
+    for name, stats in incremental.items():
+        print(f"  save after {args.new} new messages, {name:<10} {stats['seconds'] * 1000:7.1f} ms "
+              f"(file {stats['bytes'] / 2 ** 20:.1f} MiB)")
+    print(f"  Save button waits for submit()            p50 {submit['p50_ms'] * 1000:.0f} µs, "
+          f"p99 {submit['p99_ms'] * 1000:.0f} µs")
+    print(f"  peak RSS {run['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
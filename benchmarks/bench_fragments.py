@@ -0,0 +1,99 @@
+"""Script-run time of a sidebar mood click: full-app rerun vs fragment rerun
+
+AppTest always reruns the whole script, which is what every mood click cost
+before the sidebar moved into fragments. For the fragment case the benchmark
+scopes the rerun to the mood tracker fragment, as the browser does. The time
+reported runs from SCRIPT_STARTED to the run's stop event, so AppTest's own
+setup is excluded, along with the number of elements the run sent.
+Run with `python -m benchmarks.bench_fragments [--lengths 20 1000]`.
+"""
+import argparse
+import dataclasses
+import os
+import statistics
+import tempfile
+import time
+
+from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+from benchmarks.bench_render import APP, seed
+
+_fragment_scope = []
+_last_run = {}
+_request_rerun = LocalScriptRunner.request_rerun
+_STOPPED = {ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS, ScriptRunnerEvent.FRAGMENT_STOPPED_WITH_SUCCESS}
+
+
+def _record(sender, event, **kwargs):
+    now = time.perf_counter()
+    if event == ScriptRunnerEvent.SCRIPT_STARTED:
+        _last_run.update(start=now, deltas=0)
+    elif event == ScriptRunnerEvent.ENQUEUE_FORWARD_MSG and kwargs['forward_msg'].HasField('delta'):
+        _last_run['deltas'] += 1
+    elif event in _STOPPED:
+        _last_run['elapsed'] = now - _last_run['start']
+
+
+def _scoped_request_rerun(self, rerun_data):
+    self.on_event.connect(_record, weak=False)
+    requested = _request_rerun(self, rerun_data)
+    if _fragment_scope:
+        # A fresh runner starts with a pending full rerun that would absorb a
+        # fragment request, so scope the pending request itself
+        pending = self._requests._rerun_data
+        self._requests._rerun_data = dataclasses.replace(pending, fragment_id_queue=list(_fragment_scope))
+    return requested
+
+
+LocalScriptRunner.request_rerun = _scoped_request_rerun
+
+
+def fragment_id(at, name):
+    for fid, wrapped in at._fragment_storage._fragments.items():
+        if any(getattr(cell.cell_contents, '__name__', None) == name for cell in wrapped.__closure__ or ()):
+            return fid
+    raise LookupError(name)
+
+
+def time_clicks(length, scoped, reruns):
+    from conversation_store import MEMORY_TAIL, store
+
+    session_id = f'bench-{length}-{"fragment" if scoped else "full"}'
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.session_state['api_key'] = 'bench'
+    at.session_state['session_id'] = session_id
+    at.session_state['messages'] = seed(store, session_id, length, MEMORY_TAIL)
+    at.run()
+    mood_fragment = fragment_id(at, 'mood_tracker')
+    timings, deltas = [], 0
+    for _ in range(reruns):
+        # Scoped runs only return the fragment's elements, so re-render fully to find the button
+        at.run()
+        button = next(b for b in at.button if b.label == "😌 Calm")
+        _fragment_scope[:] = [mood_fragment] if scoped else []
+        button.click().run()
+        _fragment_scope.clear()
+        timings.append(_last_run['elapsed'])
+        deltas = _last_run['deltas']
+    assert not at.exception, at.exception
+    return statistics.median(timings) * 1000, deltas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[20, 1000])
+    parser.add_argument('--reruns', type=int, default=7)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault('CHAT_DB_PATH', os.path.join(tmp, 'bench.db'))
+        print(f"{'messages':>9} {'full rerun ms':>14} {'elements':>9} {'fragment ms':>12} {'elements':>9}")
+        for length in args.lengths:
+            full, full_deltas = time_clicks(length, False, args.reruns)
+            scoped, scoped_deltas = time_clicks(length, True, args.reruns)
+            print(f"{length:>9} {full:>14.1f} {full_deltas:>9} {scoped:>12.1f} {scoped_deltas:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Multi-session load against app.py with the local fake Gemini server
+
+Each simulated user is an AppTest session on its own thread, all in one
+process like sessions on a Streamlit server, so they share the model
+registry, caches and admission budgets. Every user sends --turns messages
+with --think seconds between them; a turn is timed from submitting the
+message until the script run that renders the reply finishes. Messages are
+unique per user and turn, so no reply comes from the response cache.
+Admission limits are lifted unless --admission is given, so the numbers show
+the pipeline rather than the rate limits.
+
+Reports turn throughput, p50/p95/p99 turn latency, upstream requests and
+RSS, and appends them to the benchmark results file.
+Run with `python -m benchmarks.bench_load [--users 20] [--turns 5] [--latency 0.5]`.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.harness import latency_summary, record, rss_bytes
+from fake_gemini import FakeGemini
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+MESSAGES = ["I've been feeling anxious about work lately.", "I can't sleep well, what can I do?",
+            "Sometimes I feel like nobody understands me.", "How do I stop overthinking?",
+            "I had a good day today, actually!"]
+UNLIMITED_ADMISSION = {'ADMISSION_SESSION_RPM': '1000000', 'ADMISSION_SESSION_BURST': '1000000',
+                       'ADMISSION_GLOBAL_RPM': '1000000'}
+
+
+def allow_concurrent_sessions():
+    """Let AppTest sessions run at once on threads, as sessions do on a Streamlit server
+
+    AppTest compiles the script on every run, and many sessions compiling at
+    once trips a CPython 3.11 parser bug, so every session shares one
+    compiled script as the server does. Each run also clears the global
+    Runtime when it ends, even while other sessions' scripts still use it, so
+    the last one set stays in use.
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: cache
+    last = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            last['runtime'] = cls._instance
+        return cls._instance or last['runtime']
+
+    Runtime.instance = classmethod(instance)
+
+
+def user(index, turns, think, seed, latencies, errors):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed + index)
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.run()
+    for turn in range(turns):
+        time.sleep(rng.uniform(0, 2 * think))
+        message = f"{rng.choice(MESSAGES)} ({index}.{turn})"
+        start = time.perf_counter()
+        at.chat_input[0].set_value(message).run()
+        elapsed = time.perf_counter() - start
+        reply = at.session_state['messages'][-1]
+        if at.exception or reply['role'] != 'assistant' or not reply['content'].startswith('💙 Reply'):
+            errors.append(str(at.exception) if at.exception else reply['content'][:80])
+        else:
+            latencies.append(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--think', type=float, default=0.5, help='mean seconds between a user\'s messages')
+    parser.add_argument('--latency', type=float, default=0.5, help='fake server time to first byte')
+    parser.add_argument('--chunk-delay', type=float, default=0.02)
+    parser.add_argument('--no-stream', action='store_true', help='ask for whole replies instead of streaming')
+    parser.add_argument('--admission', action='store_true', help='keep the configured admission limits')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    with FakeGemini(reply=lambda model, prompt: f"💙 Reply from {model}. Let's take this one step at a time.",
+                    latency=args.latency, chunk_delay=args.chunk_delay, chunks=4) as fake, \
+            tempfile.TemporaryDirectory() as tmp:
+        # Read by the app's modules at import, before the first session starts
+        os.environ.update(GEMINI_API_BASE=fake.url, GOOGLE_API_KEY='bench',
+                          CHAT_DB_PATH=os.path.join(tmp, 'bench.db'),
+                          STREAM_RESPONSES='false' if args.no_stream else 'true')
+        if not args.admission:
+            os.environ.update(UNLIMITED_ADMISSION)
+        allow_concurrent_sessions()
+        rss_before = rss_bytes()
+        latencies, errors = [], []
+        threads = [threading.Thread(target=user, args=(i, args.turns, args.think, args.seed, latencies, errors))
+                   for i in range(args.users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        upstream = len(fake.requests)
+        max_in_flight = fake.max_in_flight
+
+    metrics = {"turns": latency_summary(latencies, elapsed), "errors": len(errors),
+               "upstream_requests": upstream, "upstream_max_in_flight": max_in_flight,
+               "elapsed_s": elapsed, "rss_growth_mb": (rss_bytes() - rss_before) / 2 ** 20}
+    run = record('load', vars(args), metrics)
+    turns = metrics["turns"]
+    print(f"{args.users} users x {args.turns} turns, {args.latency:g}s upstream latency, "
+          f"{'blocking' if args.no_stream else 'streaming'}")
+    print(f"  {turns['count']} turns in {elapsed:.1f}s: {turns.get('throughput_per_s', 0):.1f} turns/s")
+    if latencies:
+        print(f"  turn latency p50 {turns['p50_ms']:.0f} ms, p95 {turns['p95_ms']:.0f} ms, "
+              f"p99 {turns['p99_ms']:.0f} ms")
+    print(f"  {upstream} upstream requests, at most {max_in_flight} at once, {len(errors)} failed turns")
+    print(f"  RSS {run['rss_mb']:.0f} MB (+{metrics['rss_growth_mb']:.0f} MB under load, "
+          f"peak {run['peak_rss_mb']:.0f} MB)")
+    for error in errors[:5]:
+        print(f"  failed: {error}")
+
+
+if __name__ == '__main__':
+    main()
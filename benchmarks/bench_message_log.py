@@ -0,0 +1,80 @@
+"""Session-state memory: dict entries vs slotted message_log records
+
+Builds the session's messages, chat_history and mood_history for N turns
+(with a mood click every 5 turns) the way app.py does, once with the old
+dicts and datetimes and once with message_log records. The logs are left
+unbounded so the per-turn cost shows, and allocations are measured with
+tracemalloc. Message text is allocated before measuring because both layouts
+share the same string objects. The numbers are the container and record
+overhead on top of the text.
+Run with `python -m benchmarks.bench_message_log [--turns 1000 10000]`.
+"""
+import argparse
+import gc
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+from benchmarks.harness import record
+from message_log import MOODS, ChatTurn, MessageLog, MoodEntry
+
+
+def texts(turns):
+    return [(f"I've been feeling anxious about exams, turn {t}. What can I do? ",
+             f"It makes sense to feel anxious before exams (turn {t}). Try slow breathing. " * 4)
+            for t in range(turns)]
+
+
+def build_dicts(pairs):
+    messages, chat_history, mood_history = deque(), deque(), deque()
+    for t, (prompt, response) in enumerate(pairs):
+        mood = MOODS[t % len(MOODS)]
+        if t % 5 == 0:
+            mood_history.append({"mood": mood, "time": datetime.now()})
+        messages.append({"role": "user", "content": prompt, "flagged": False})
+        messages.append({"role": "assistant", "content": response, "flagged": False})
+        chat_history.append({"timestamp": datetime.now().isoformat(), "user": prompt, "assistant": response,
+                             "mood": mood, "crisis": False})
+    return messages, chat_history, mood_history
+
+
+def build_records(pairs):
+    messages, chat_history, mood_history = MessageLog(), deque(), deque()
+    for t, (prompt, response) in enumerate(pairs):
+        mood = MOODS[t % len(MOODS)]
+        if t % 5 == 0:
+            mood_history.append(MoodEntry(mood))
+        question = messages.append("user", prompt, mood)
+        reply = messages.append("assistant", response, mood)
+        chat_history.append(ChatTurn(question, reply))
+    return messages, chat_history, mood_history
+
+
+def measure(build, pairs):
+    gc.collect()
+    tracemalloc.start()
+    kept = build(pairs)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert kept
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, nargs='+', default=[1000, 10_000])
+    args = parser.parse_args()
+    metrics = {}
+    print(f"{'turns':>7} {'text MB':>8} {'dicts MB':>9} {'records MB':>11} {'bytes/turn':>17} {'saved':>6}")
+    for turns in args.turns:
+        pairs = texts(turns)
+        text = sum(len(p.encode()) + len(r.encode()) for p, r in pairs)
+        dicts, records = measure(build_dicts, pairs), measure(build_records, pairs)
+        metrics[str(turns)] = {"dicts_bytes": dicts, "records_bytes": records, "text_bytes": text}
+        print(f"{turns:>7} {text / 2 ** 20:>8.2f} {dicts / 2 ** 20:>9.2f} {records / 2 ** 20:>11.2f} "
+              f"{dicts / turns:>8.0f} -> {records / turns:<6.0f} {1 - records / dicts:>6.0%}")
+    record('message_log', vars(args), metrics)
+
+
+if __name__ == '__main__':
+    main()
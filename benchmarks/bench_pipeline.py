@@ -0,0 +1,102 @@
+"""Microbenchmarks for the steps of a chat turn outside the model call
+
+- prompt: what get_bot_response does before calling Gemini (cache key,
+  token-budgeted context, admission estimate and single-flight key) for a
+  session whose window is full
+- persist: appending one message to the conversation store, and reading the
+  session tail and one history page back
+- render: a rerun of app.py under AppTest with --history stored messages
+
+Results are printed and appended to the benchmark results file.
+Run with `python -m benchmarks.bench_pipeline [--repeat 2000] [--history 1000]`.
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks.harness import latency_summary, record, time_calls
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+USER_TURN = "I've been feeling overwhelmed with work and I can't switch off at night, any ideas? "
+BOT_TURN = ("That sounds exhausting. A short wind-down routine can help: dim the lights, "
+            "write tomorrow's to-do list, and try slow breathing for a few minutes. ") * 2
+
+
+def bench_prompt(repeat):
+    import response_cache
+    from context_builder import ContextBuilder
+    from single_flight import flight_key
+
+    builder = ContextBuilder("You are MindfulAI, a compassionate mental health support companion. " * 8)
+    for _ in range(100):
+        builder.add("user", USER_TURN)
+        builder.add("assistant", BOT_TURN)
+    builder.set_summary("User is overwhelmed by work and struggling to sleep. " * 4)
+
+    def turn():
+        response_cache.cache_key(USER_TURN, "Anxious", builder.messages())
+        context = builder.build(USER_TURN, "Anxious")
+        builder.prompt_tokens(USER_TURN, "Anxious")
+        flight_key('bench', context)
+
+    return latency_summary(time_calls(turn, repeat, warmup=50))
+
+
+def bench_persist(repeat, path):
+    from conversation_store import ConversationStore
+
+    store = ConversationStore(path)
+    appends = time_calls(lambda: store.append_message('bench-persist', 'user', USER_TURN, 'Calm'), repeat)
+    tails = time_calls(lambda: store.tail('bench-persist'), repeat)
+    pages = time_calls(lambda: store.slice('bench-persist', repeat // 2, repeat // 2 + 20), repeat)
+    store.close()
+    return {"append": latency_summary(appends), "tail": latency_summary(tails), "page": latency_summary(pages)}
+
+
+def bench_render(history, reruns):
+    from streamlit.testing.v1 import AppTest
+    from benchmarks.bench_render import seed
+    from conversation_store import MEMORY_TAIL, store
+
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.session_state['api_key'] = 'bench'
+    at.session_state['session_id'] = 'bench-render'
+    at.session_state['messages'] = seed(store, 'bench-render', history, MEMORY_TAIL)
+    at.run()
+
+    def rerun():
+        next(b for b in at.button if b.label == "😌 Calm").click().run()
+
+    samples = time_calls(rerun, reruns, warmup=1)
+    assert not at.exception, at.exception
+    return latency_summary(samples)
+
+
+def print_row(name, summary):
+    print(f"{name:<10} {summary['count']:>7} {summary['p50_ms']:>10.3f} {summary['p95_ms']:>10.3f} "
+          f"{summary['p99_ms']:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--history', type=int, default=1000)
+    parser.add_argument('--reruns', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app's store reads its path at import
+        os.environ['CHAT_DB_PATH'] = os.path.join(tmp, 'bench.db')
+        metrics = {"prompt": bench_prompt(args.repeat)}
+        metrics.update(bench_persist(args.repeat, os.path.join(tmp, 'persist.db')))
+        metrics["render"] = bench_render(args.history, args.reruns)
+
+    print(f"{'step':<10} {'calls':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, summary in metrics.items():
+        print_row(name, summary)
+    run = record('pipeline', vars(args), metrics)
+    print(f"RSS {run['rss_mb']:.0f} MB (peak {run['peak_rss_mb']:.0f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Script-run time of app.py against chat history length
+
+Seeds a session with N stored messages and times reruns triggered by a mood
+button click, once with paged rendering (the default) and once rendering
+every message as a chat bubble like the app used to. Each configuration runs
+in its own subprocess because the page sizes are read at import time.
+Run with `python -m benchmarks.bench_render [--lengths 10 100 1000 5000]`.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+MODES = {
+    'paged': {},
+    'full': {'MEMORY_TAIL': '1000000', 'HISTORY_PAGE_SIZE': '1000000'},
+}
+
+
+def seed(store, session_id, length, tail):
+    from message_log import MessageLog
+
+    messages = MessageLog(maxlen=tail)
+    for i in range(length):
+        role = "user" if i % 2 == 0 else "assistant"
+        content = f"Message {i}: I've been thinking about **sleep** and _stress_ a lot lately. " * 3
+        store.append_message(session_id, role, content)
+        messages.append(role, content)
+    return messages
+
+
+def child(length, reruns):
+    from streamlit.testing.v1 import AppTest
+    from conversation_store import MEMORY_TAIL, store
+
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.session_state['api_key'] = 'bench'
+    at.session_state['session_id'] = f'bench-{length}'
+    at.session_state['messages'] = seed(store, f'bench-{length}', length, MEMORY_TAIL)
+    at.run()
+    timings = []
+    for _ in range(reruns):
+        button = next(b for b in at.button if b.label == "😌 Calm")
+        start = time.perf_counter()
+        button.click().run()
+        timings.append(time.perf_counter() - start)
+    assert not at.exception, at.exception
+    print(json.dumps({"median_ms": statistics.median(timings) * 1000,
+                      "elements": len(at.markdown)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--reruns', type=int, default=5)
+    parser.add_argument('--child', type=int)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(args.child, args.reruns)
+        return
+    print(f"{'messages':>9} {'mode':>6} {'median ms':>10} {'markdown elements':>18}")
+    for length in args.lengths:
+        for mode, overrides in MODES.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(os.environ, CHAT_DB_PATH=os.path.join(tmp, 'bench.db'), **overrides)
+                out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_render', '--child', str(length),
+                                      '--reruns', str(args.reruns)],
+                                     env=env, capture_output=True, text=True, check=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(f"{length:>9} {mode:>6} {result['median_ms']:>10.1f} {result['elements']:>18}")
+
+
+if __name__ == '__main__':
+    main()
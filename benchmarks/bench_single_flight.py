@@ -0,0 +1,71 @@
+"""Upstream calls during a quick-prompt burst, with and without single-flight
+
+N simulated sessions send the same prompt within a short window to the local
+fake Gemini server. Each session either calls the model directly or goes
+through single_flight, streaming or not. The table shows how many requests
+reached the server and the latency each session saw.
+Run with `python -m benchmarks.bench_single_flight [--sessions 200] [--latency 0.8]`.
+"""
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_gemini import FakeGemini
+from gemini_client import GeminiModel, GeminiRuntime
+from single_flight import SingleFlight, flight_key
+
+PROMPT = "I'm feeling really stressed about work. Can you help me?"
+
+
+def burst(model, sessions, window, stream, coalesce):
+    flights = SingleFlight()
+    rng = random.Random(3)
+    offsets = sorted(rng.uniform(0, window) for _ in range(sessions))
+    start = time.perf_counter()
+
+    def session(offset):
+        time.sleep(max(0.0, start + offset - time.perf_counter()))
+        began = time.perf_counter()
+        if coalesce:
+            key = flight_key('bench', PROMPT)
+            if stream:
+                reply = ''.join(flights.stream(key, lambda: model.generate_content(PROMPT, stream=True)))
+            else:
+                reply = flights.do(key, lambda: model.generate_content(PROMPT))
+        else:
+            reply = ''.join(model.generate_content(PROMPT, stream=True)) if stream else model.generate_content(PROMPT)
+        assert reply
+        return time.perf_counter() - began
+
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        latencies = sorted(pool.map(session, offsets))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--window', type=float, default=1.0, help='seconds over which the burst arrives')
+    parser.add_argument('--latency', type=float, default=0.8, help='fake server time to first byte')
+    args = parser.parse_args()
+
+    print(f"{args.sessions} sessions within {args.window:g}s, {args.latency:g}s upstream latency")
+    print(f"{'mode':<22} {'upstream calls':>15} {'p50 ms':>8} {'p95 ms':>8}")
+    for stream in (False, True):
+        for coalesce in (False, True):
+            with FakeGemini(reply='Let us take a slow breath together.', latency=args.latency,
+                            chunk_delay=0.02, chunks=4) as fake:
+                runtime = GeminiRuntime(base_url=fake.url, max_in_flight=args.sessions)
+                model = GeminiModel('bench', runtime=runtime)
+                latencies = burst(model, args.sessions, args.window, stream, coalesce)
+                runtime.close()
+                calls = len(fake.requests)
+            name = f"{'stream' if stream else 'blocking'} {'single-flight' if coalesce else 'direct'}"
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            print(f"{name:<22} {calls:>15} {statistics.median(latencies) * 1000:>8.0f} {p95 * 1000:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Cold-start cost: module import times and the first render of app.py
+
+Import times come from `python -X importtime -c "import <module>"` in a fresh
+interpreter, reported as the cumulative time of the module itself. The first
+render runs app.py once under AppTest in a fresh process with GOOGLE_API_KEY
+set and checks that no HTTP client was loaded before the first message.
+google.generativeai is measured too when it is installed, as a reference for
+the SDK import the app used to pay on startup.
+Run with `python -m benchmarks.bench_startup [--repeat 5]`.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, 'app.py')
+MODULES = ['gemini_client', 'theme', 'context_builder', 'conversation_store', 'summarizer',
+           'response_cache', 'streamlit', 'httpx', 'google.generativeai']
+
+
+def import_time_us(module):
+    """Cumulative import time of `module` in microseconds, from a fresh interpreter"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    for line in reversed(result.stderr.splitlines()):
+        # "import time:   self [us] | cumulative | imported package"
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    return None
+
+
+def child():
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP, default_timeout=120)
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    assert not at.exception, at.exception
+    print(json.dumps({"first_render_ms": elapsed * 1000,
+                      "httpx_loaded": 'httpx' in sys.modules}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', action='store_true')
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    print(f"{'module':<22} {'median import ms':>17}")
+    for module in MODULES:
+        if importlib.util.find_spec(module.split('.')[0]) is None:
+            print(f"{module:<22} {'not installed':>17}")
+            continue
+        times = [import_time_us(module) for _ in range(args.repeat)]
+        print(f"{module:<22} {statistics.median(times) / 1000:>17.1f}")
+
+    renders = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, GOOGLE_API_KEY='bench', CHAT_DB_PATH=os.path.join(tmp, 'bench.db'))
+        for _ in range(args.repeat):
+            out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--child'],
+                                 cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+            renders.append(json.loads(out.strip().splitlines()[-1]))
+    print(f"\nfirst render of app.py: {statistics.median(r['first_render_ms'] for r in renders):.1f} ms median")
+    print(f"HTTP client loaded before the first message: {any(r['httpx_loaded'] for r in renders)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Per-session memory of in-memory lists vs the SQLite store with a short tail
+
+Each mode runs in a fresh subprocess so RSS deltas are not polluted by the
+other. Run with `python -m benchmarks.bench_store [--sessions 5 --turns 10000]`.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime
+
+from benchmarks.harness import rss_bytes
+
+USER_TEXT = "I've been feeling anxious about my exams and can't sleep well. What can I do? "
+BOT_TEXT = ("It makes sense to feel anxious before exams. Try a short wind-down routine, "
+            "limit screens before bed and practice slow breathing for a few minutes. ") * 4
+
+
+def run_lists(sessions, turns):
+    # The original session_state layout: unbounded messages, chat_history and mood_history lists
+    kept = []
+    for s in range(sessions):
+        messages, chat_history, mood_history = [], [], []
+        for t in range(turns):
+            user, bot = f"{USER_TEXT}{s}-{t}", f"{BOT_TEXT}{s}-{t}"
+            messages.append({"role": "user", "content": user})
+            messages.append({"role": "assistant", "content": bot})
+            chat_history.append({"timestamp": datetime.now().isoformat(), "user": user,
+                                 "assistant": bot, "mood": "Calm"})
+            if t % 10 == 0:
+                mood_history.append({"mood": "Calm", "time": datetime.now()})
+        kept.append((messages, chat_history, mood_history))
+    return kept
+
+
+def run_store(sessions, turns, path):
+    from conversation_store import MEMORY_TAIL, ConversationStore
+    store = ConversationStore(path)
+    kept = []
+    for s in range(sessions):
+        session_id = f"bench-{s}"
+        messages, chat_history, mood_history = (deque(maxlen=MEMORY_TAIL) for _ in range(3))
+        for t in range(turns):
+            user, bot = f"{USER_TEXT}{s}-{t}", f"{BOT_TEXT}{s}-{t}"
+            for role, content in (("user", user), ("assistant", bot)):
+                messages.append({"role": role, "content": content})
+                store.append_message(session_id, role, content, "Calm")
+            chat_history.append({"timestamp": datetime.now().isoformat(), "user": user,
+                                 "assistant": bot, "mood": "Calm"})
+            if t % 10 == 0:
+                mood_history.append({"mood": "Calm", "time": datetime.now()})
+                store.log_mood(session_id, "Calm")
+        kept.append((messages, chat_history, mood_history))
+    return store, kept
+
+
+def child(mode, sessions, turns):
+    before = rss_bytes()
+    start = time.perf_counter()
+    result = {"mode": mode}
+    if mode == "lists":
+        kept = run_lists(sessions, turns)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            store, kept = run_store(sessions, turns, os.path.join(tmp, 'bench.db'))
+            result["append_turns_per_s"] = sessions * turns / (time.perf_counter() - start)
+            from exporter import Exporter
+            export_start = time.perf_counter()
+            exported = Exporter(store, os.path.join(tmp, 'exports'), 'jsonl').export("bench-0")["written"]
+            result["export_messages_per_s"] = exported / (time.perf_counter() - export_start)
+            store.close()
+    result["rss_per_session_mb"] = (rss_bytes() - before) / sessions / 2 ** 20
+    result["elapsed_s"] = time.perf_counter() - start
+    assert kept
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=5)
+    parser.add_argument('--turns', type=int, default=10_000)
+    parser.add_argument('--mode', choices=['lists', 'store'])
+    args = parser.parse_args()
+    if args.mode:
+        child(args.mode, args.sessions, args.turns)
+        return
+    print(f"{args.sessions} sessions x {args.turns} turns")
+    for mode in ('lists', 'store'):
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_store', '--mode', mode,
+                              '--sessions', str(args.sessions), '--turns', str(args.turns)],
+                             capture_output=True, text=True, check=True).stdout
+        result = json.loads(out)
+        extra = ''
+        if mode == 'store':
+            extra = (f"  {result['append_turns_per_s']:,.0f} turns/s appended, "
+                     f"{result['export_messages_per_s']:,.0f} messages/s exported")
+        print(f"  {mode:<6} {result['rss_per_session_mb']:7.2f} MB RSS per session{extra}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""Bytes the theme adds to every script rerun: inline stylesheet vs minified vs linked
+
+Run with `python -m benchmarks.bench_theme`.
+"""
+import gzip
+
+import theme
+
+GOOGLE_FONTS_IMPORT = ("@import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800"
+                       "&family=Space+Grotesk:wght@500;600;700&display=swap');\n")
+
+
+def main():
+    with open(theme.SOURCE, encoding='utf-8') as f:
+        source = f.read()
+    variants = {
+        'inline source (old)': f'<style>\n{GOOGLE_FONTS_IMPORT}{source}</style>',
+        'inline minified': f'<style>{theme.minify(source)}</style>',
+        'linked (new)': theme.stylesheet_tag(),
+    }
+    print(f"{'variant':<22} {'bytes/rerun':>12} {'gzipped':>8}")
+    for name, markup in variants.items():
+        data = markup.encode()
+        print(f"{name:<22} {len(data):>12,} {len(gzip.compress(data)):>8,}")
+
+
+if __name__ == '__main__':
+    main()
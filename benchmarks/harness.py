@@ -0,0 +1,116 @@
+"""Shared helpers for benchmarks: latency percentiles, RSS and the results file
+
+Benchmarks that call record() append one JSON line per run to
+BENCH_RESULTS (default benchmarks/results.jsonl) with the commit, Python
+version, parameters and metrics, so runs can be compared over time.
+Run `python -m benchmarks.harness [--benchmark NAME]` to compare the last two
+runs of each benchmark.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+# Re-exported for the benchmarks; they live in measurement.py so batch_eval.py does not import benchmarks
+from measurement import git_commit, latency_summary, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.getenv('BENCH_RESULTS', os.path.join(ROOT, 'benchmarks', 'results.jsonl'))
+
+
+def rss_bytes():
+    """Current resident set size (Linux), falling back to the peak elsewhere"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def time_calls(call, repeat, warmup=0):
+    """Per-call latencies in seconds of `call()` run `repeat` times"""
+    for _ in range(warmup):
+        call()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def record(benchmark, params, metrics, path=None):
+    """Append one run to the results file, with the process's RSS, and return it"""
+    run = {"benchmark": benchmark,
+           "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+           "commit": git_commit(),
+           "python": platform.python_version(),
+           "platform": platform.platform(),
+           "params": params,
+           "metrics": metrics,
+           "rss_mb": rss_bytes() / 2 ** 20,
+           "peak_rss_mb": peak_rss_bytes() / 2 ** 20}
+    path = path or RESULTS_PATH
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + '\n')
+    return run
+
+
+def load(path=None):
+    path = path or RESULTS_PATH
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def flatten(metrics, prefix=''):
+    """{'a': {'b': 1}} -> {'a.b': 1}, keeping numbers only"""
+    flat = {}
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the last two recorded runs of each benchmark")
+    parser.add_argument('--benchmark')
+    parser.add_argument('--results', default=RESULTS_PATH)
+    args = parser.parse_args()
+    runs = {}
+    for run in load(args.results):
+        runs.setdefault(run["benchmark"], []).append(run)
+    if not runs:
+        print(f"No results in {args.results}")
+        return
+    for benchmark, history in runs.items():
+        if args.benchmark and benchmark != args.benchmark:
+            continue
+        current = history[-1]
+        previous = history[-2] if len(history) > 1 else None
+        print(f"\n{benchmark}: {current['timestamp']} ({current['commit']})"
+              + (f" vs {previous['timestamp']} ({previous['commit']})" if previous else ""))
+        now = flatten({**current["metrics"], "rss_mb": current["rss_mb"], "peak_rss_mb": current["peak_rss_mb"]})
+        before = flatten({**previous["metrics"], "rss_mb": previous["rss_mb"],
+                          "peak_rss_mb": previous["peak_rss_mb"]}) if previous else {}
+        for name, value in now.items():
+            line = f"  {name:<42} {value:>12.2f}"
+            if before.get(name):
+                line += f" {(value - before[name]) / before[name]:>+8.1%}"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
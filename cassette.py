@@ -0,0 +1,228 @@
+"""Record/replay transport for Gemini HTTP calls
+
+A cassette is a JSONL file (gzip when its name ends in .gz) with one line
+per recorded exchange: the request key, status, content type, time to
+first byte and the response body as timed chunks, so streamed replies keep
+their chunking and pacing. Requests are keyed by a hash of the endpoint,
+query and canonical JSON body (the prompt and generation config). The API key
+is never part of the key or the file, so a cassette recorded with one key
+replays with any other.
+
+Point the app, tests or benchmarks at one with GEMINI_CASSETTE=path and
+pick GEMINI_CASSETTE_MODE:
+  replay   answer only from the cassette; unknown requests fail with a 404
+  record   call the API and append every exchange, errors included
+  auto     replay what is recorded and record the rest (the default); only
+           successful exchanges are recorded or replayed, so a 429 or 5xx
+           is asked again next time instead of being replayed forever
+GEMINI_CASSETTE_SPEED scales the recorded timing on replay: 1 reproduces
+the original latency and chunk spacing, 0 (the default) answers at once.
+Identical requests recorded more than once are replayed in turn. The model
+is part of the key, and the router picks among GEMINI_MODELS by measured
+latency, so replay with a single model when the exact calls must repeat.
+"""
+import asyncio
+import codecs
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import httpx
+
+CASSETTE_MODE = os.getenv('GEMINI_CASSETTE_MODE', 'auto')
+CASSETTE_SPEED = float(os.getenv('GEMINI_CASSETTE_SPEED', '0'))
+
+REPLAY = 'replay'
+RECORD = 'record'
+AUTO = 'auto'
+MODES = (REPLAY, RECORD, AUTO)
+
+# Query parameters that identify a request; anything else (e.g. a key) is ignored
+KEY_PARAMS = ('alt', 'pageSize', 'pageToken')
+
+
+def request_key(method, path, params, body):
+    """Stable hash of what a Gemini request asks for, independent of host, key and JSON layout"""
+    endpoint = path[path.find('/models') + 1:] if '/models' in path else path.lstrip('/')
+    query = '&'.join(f"{name}={params[name]}" for name in KEY_PARAMS if name in params)
+    if body:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    text = f"{method} {endpoint}?{query}\n{body or ''}"
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def succeeded(entry):
+    return 200 <= entry['status'] < 300
+
+
+def key_of(request):
+    return request_key(request.method, request.url.path, request.url.params, request.content)
+
+
+class Cassette:
+    """The recorded exchanges of one cassette file, indexed by request key"""
+
+    def __init__(self, path, mode=CASSETTE_MODE, speed=CASSETTE_SPEED):
+        if mode not in MODES:
+            raise ValueError(f"Cassette mode must be one of {', '.join(MODES)}, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._entries = {}
+        self._turns = {}
+        self._lock = threading.Lock()
+        if mode != RECORD and os.path.exists(path):
+            with self._open('rt') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        if self._keeps(entry):
+                            self._entries.setdefault(entry['key'], []).append(entry)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def _open(self, mode):
+        return gzip.open(self.path, mode, encoding='utf-8') if self.path.endswith('.gz') \
+            else open(self.path, mode, encoding='utf-8')
+
+    def find(self, key):
+        """The next recording for a request key, cycling through repeats; None if there is none"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                return None
+            turn = self._turns.get(key, 0)
+            self._turns[key] = turn + 1
+            self.hits += 1
+            return entries[turn % len(entries)]
+
+    def _keeps(self, entry):
+        return self.mode != AUTO or succeeded(entry)
+
+    def add(self, entry):
+        if not self._keeps(entry):
+            return
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Appending to a .gz file adds a gzip member, which readers see as one stream
+            with self._open('at') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._entries.setdefault(entry['key'], []).append(entry)
+            self.recorded += 1
+
+    def transport(self, inner=None):
+        """An httpx transport for one client; `inner` makes the real calls when recording"""
+        if inner is None and self.mode != REPLAY:
+            inner = httpx.AsyncHTTPTransport()
+        return CassetteTransport(self, inner)
+
+    def stats(self):
+        return {"mode": self.mode, "recordings": len(self), "hits": self.hits, "misses": self.misses,
+                "recorded": self.recorded}
+
+
+class ReplayStream(httpx.AsyncByteStream):
+    """A recorded body, paced by the recorded chunk offsets times `speed`"""
+
+    def __init__(self, chunks, speed):
+        self.chunks = chunks
+        self.speed = speed
+
+    async def __aiter__(self):
+        previous = 0.0
+        for offset, text in self.chunks:
+            if self.speed and offset > previous:
+                await asyncio.sleep((offset - previous) * self.speed)
+            previous = offset
+            yield text.encode('utf-8')
+
+
+class RecordingStream(httpx.AsyncByteStream):
+    """Passes the real body through while noting each chunk and when it arrived"""
+
+    def __init__(self, stream, entry, cassette, started):
+        self.stream = stream
+        self.entry = entry
+        self.cassette = cassette
+        self.started = started
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.complete = False
+
+    async def __aiter__(self):
+        async for data in self.stream:
+            text = self.decoder.decode(data)
+            if text:
+                self.entry['chunks'].append([round(time.perf_counter() - self.started, 4), text])
+            yield data
+        self.complete = True
+
+    async def aclose(self):
+        await self.stream.aclose()
+        # A reply the caller abandoned halfway is not worth replaying
+        if self.complete:
+            self.cassette.add(self.entry)
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette, inner=None):
+        self.cassette = cassette
+        self.inner = inner
+
+    async def handle_async_request(self, request):
+        key = key_of(request)
+        if self.cassette.mode != RECORD:
+            entry = self.cassette.find(key)
+            if entry is not None:
+                return await self._replay(entry)
+            if self.cassette.mode == REPLAY:
+                message = f"No recording for this request in cassette {self.cassette.path} (key {key})"
+                return httpx.Response(404, json={'error': {'code': 404, 'message': message}})
+        return await self._record(key, request)
+
+    async def _replay(self, entry):
+        if self.cassette.speed:
+            await asyncio.sleep(entry['ttfb'] * self.cassette.speed)
+        return httpx.Response(entry['status'], headers={'content-type': entry['content_type']},
+                              stream=ReplayStream(entry['chunks'], self.cassette.speed))
+
+    async def _record(self, key, request):
+        # Plain bytes, so the recorded chunks are the text the client reads
+        request.headers['accept-encoding'] = 'identity'
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        ttfb = time.perf_counter() - started
+        endpoint = request.url.path.rsplit('/', 1)[-1]
+        entry = {'key': key, 'endpoint': endpoint, 'status': response.status_code,
+                 'content_type': response.headers.get('content-type', 'application/json'),
+                 'ttfb': round(ttfb, 4), 'chunks': [], 'recorded_at': round(time.time())}
+        headers = [(name, value) for name, value in response.headers.multi_items()
+                   if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')]
+        return httpx.Response(response.status_code, headers=headers,
+                              stream=RecordingStream(response.stream, entry, self.cassette, started + ttfb))
+
+    async def aclose(self):
+        if self.inner is not None:
+            await self.inner.aclose()
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+def open_cassette(path, mode=CASSETTE_MODE, speed=CASSETTE_SPEED):
+    """The process's Cassette for a path, so every client shares one index and file"""
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = _cassettes[path] = Cassette(path, mode, speed)
+        return cassette
@@ -0,0 +1,292 @@
+"""The chat turn pipeline shared by the Streamlit page and the HTTP API
+
+Every function takes the session `state` explicitly: app.py passes
+st.session_state, and api_server.py passes a ChatSession, which has the same
+attributes. Nothing here imports Streamlit.
+
+A turn is start_turn() (crisis check and saving the user's message),
+get_bot_response() (cache, context, admission, single-flight model call)
+and finish_turn() (saving the reply, growing the context window and
+scheduling the rolling summary). Callers render the reply in between.
+
+Messages and moods are written to the conversation store as they happen,
+and the rest of the session (settings, rolling summary) is saved to the
+session backend after each turn and again when a summary job finishes, so
+restore() can rebuild a session on any worker process.
+"""
+import re
+import threading
+import uuid
+from collections import deque
+
+import response_cache
+from admission import REPLY_TOKENS, TurnedAway, admission, canned_reply, quota_ticket
+from context_builder import ContextBuilder
+from conversation_store import MEMORY_TAIL, store
+from crisis_detector import detector
+from instrumentation import metrics
+from message_log import MOODS, ChatTurn, MessageLog, MoodEntry
+from model_registry import ROUTED_MODELS, registry
+from resilience import RATE_LIMITED, CircuitOpen, classify, user_message
+from session_backend import session_backend
+from single_flight import flight_key, flights
+from summarizer import summarizer
+
+# System prompt for the AI
+SYSTEM_PROMPT = """You are MindfulAI, a compassionate and professional mental health support companion. Your role is to:
+
+1. Listen actively and empathetically to users' concerns
+2. Provide supportive, non-judgmental responses
+3. Offer evidence-based coping strategies when appropriate
+4. Recognize signs of crisis and recommend professional help when needed
+5. Maintain a warm, caring, and professional tone
+6. Never diagnose conditions or replace professional mental health care
+7. Encourage healthy habits and self-care practices
+8. Be culturally sensitive and inclusive
+
+Remember: You are a supportive companion, not a replacement for professional mental health services. Always prioritize user safety and well-being."""
+
+# Per-session preferences saved with the session, when the state has them
+SESSION_SETTINGS = ('stream_responses', 'use_cache')
+
+_SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def is_session_id(value):
+    return isinstance(value, str) and _SESSION_ID.fullmatch(value) is not None
+
+
+class ChatSession:
+    """Session state for clients without a Streamlit session, with the attributes app.py keeps in st.session_state"""
+
+    def __init__(self, api_key, session_id=None):
+        self.session_id = session_id or new_session_id()
+        self.api_key = api_key
+        self.messages = MessageLog(maxlen=MEMORY_TAIL)
+        self.chat_history = deque(maxlen=MEMORY_TAIL)
+        self.mood_history = deque(maxlen=MEMORY_TAIL)
+        self.context = ContextBuilder(SYSTEM_PROMPT)
+        self.model_lease = None
+
+    @classmethod
+    def resume(cls, api_key, session_id):
+        """A session rebuilt from the stores, so any worker process can continue it"""
+        session = cls(api_key, session_id)
+        restore(session, session_id)
+        return session
+
+    def close(self):
+        release_model(self)
+
+
+def restore(state, session_id):
+    """Rebuild a session's messages, turns, moods, context and settings from the
+    conversation store and the session backend; returns whether anything was found"""
+    saved = session_backend.get(session_id) or {}
+    state.session_id = session_id
+    state.messages = MessageLog(maxlen=MEMORY_TAIL)
+    state.chat_history = deque(maxlen=MEMORY_TAIL)
+    state.context = ContextBuilder(SYSTEM_PROMPT)
+    question = None
+    for message in store.tail(session_id):
+        record = state.messages.append(message["role"], message["content"], message["mood"], message["flagged"])
+        state.context.add(message["role"], message["content"])
+        if record.role == "user":
+            question = record
+        elif question is not None:
+            state.chat_history.append(ChatTurn(question, record, message["time"]))
+            question = None
+    state.mood_history = deque((MoodEntry(mood, logged_at) for mood, logged_at in store.mood_tail(session_id)),
+                               maxlen=MEMORY_TAIL)
+    # Turns pushed out of the window while rebuilding it are already in the
+    # saved summary; only the ones that were still waiting need summarizing
+    if saved:
+        state.context.set_summary(saved.get("summary", ""))
+        state.context.pending = [tuple(turn) for turn in saved.get("pending", ())]
+    for name, value in saved.get("settings", {}).items():
+        if name in SESSION_SETTINGS:
+            setattr(state, name, value)
+    return bool(saved or state.messages or state.mood_history)
+
+
+def session_exists(session_id):
+    """Whether the conversation store or the session backend holds anything for a session id"""
+    return bool(store.count_messages(session_id) or store.count_moods(session_id) or session_backend.get(session_id))
+
+
+# Keeps a summary job's save from interleaving with a turn's save of the same session
+_save_lock = threading.Lock()
+
+
+def context_state(context):
+    """The rolling summary and every turn it does not cover yet, including those being summarized"""
+    return {"summary": context.summary, "pending": context.summarizing + context.pending}
+
+
+def save_session(state):
+    """Save the parts of a session the conversation store does not hold"""
+    settings = {name: getattr(state, name) for name in SESSION_SETTINGS if hasattr(state, name)}
+    with _save_lock:
+        session_backend.put(state.session_id, {"settings": settings, **context_state(state.context)})
+
+
+def save_summary(session_id, context):
+    """Save a session's new rolling summary.
+
+    Runs on the summarizer's thread, so it takes the session id and context
+    rather than the session state, which may be st.session_state.
+    """
+    with _save_lock:
+        saved = session_backend.get(session_id) or {}
+        saved.update(context_state(context))
+        session_backend.put(session_id, saved)
+
+
+def get_model(state):
+    """The session's model router, leased from the process-wide registry on the first request"""
+    lease = getattr(state, 'model_lease', None)
+    if lease is None or lease.released:
+        lease = state.model_lease = registry.acquire(state.api_key, ROUTED_MODELS)
+    return lease.model
+
+
+def release_model(state):
+    lease = getattr(state, 'model_lease', None)
+    state.model_lease = None
+    if lease is not None:
+        lease.release()
+
+
+def add_message(state, role, content, mood=None, flagged=False):
+    """Record a message in the session tail and the conversation store; returns its record"""
+    message = state.messages.append(role, content, mood, flagged)
+    store.append_message(state.session_id, role, content, mood, flagged=flagged)
+    return message
+
+
+def log_mood(state, mood):
+    """Record a mood click in the session tail and the conversation store"""
+    state.mood_history.append(MoodEntry(mood))
+    store.log_mood(state.session_id, mood)
+
+
+def latest_mood(state):
+    return state.mood_history[-1]["mood"] if state.mood_history else None
+
+
+def fallback_reply(state, ticket, cache_key=None, mood=None):
+    """Cached reply for the same turn if there is one, otherwise a friendly notice;
+    used when admission control or the API quota turns a request away"""
+    cached = response_cache.shared_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return cached
+    return canned_reply(ticket, mood)
+
+
+def error_reply(state, error, cache_key=None, mood=None):
+    """Chat text for a failed model call. Over quota or while the circuit breaker
+    is open this degrades like a turned-away request; other failures get a
+    friendly message that never includes exception details."""
+    if isinstance(error, TurnedAway):
+        return fallback_reply(state, error.ticket, cache_key, mood)
+    if isinstance(error, CircuitOpen):
+        return fallback_reply(state, quota_ticket(state.session_id, error.retry_after), cache_key, mood)
+    if classify(error) == RATE_LIMITED:
+        return fallback_reply(state, quota_ticket(state.session_id), cache_key, mood)
+    return user_message(error)
+
+
+def admission_check(session_id, tokens):
+    """The admit check for a flight: waits in the admission queue, raising TurnedAway if rejected"""
+    def admit():
+        with metrics.span('queue'):
+            ticket = admission.admit(session_id, tokens)
+        if not ticket.granted:
+            raise TurnedAway(ticket)
+    return admit
+
+
+def get_bot_response(state, user_message, mood=None, stream=False, use_cache=True):
+    """Return the reply text, or a generator of text chunks when stream=True.
+
+    Replies are served from the shared response cache when the same message,
+    mood and recent context were answered before; pass use_cache=False to
+    always ask the model. Identical prompts already in flight from other
+    sessions are joined rather than sent again. Requests admission control
+    turns away get a cached or canned reply instead.
+    """
+    key = None
+    try:
+        context_window = state.context
+
+        with metrics.span('cache'):
+            key = response_cache.cache_key(user_message, mood, context_window.messages())
+            cached = response_cache.shared_cache.get(key) if use_cache else None
+        if cached is not None:
+            return iter([cached]) if stream else cached
+
+        # The window holds finished turns only, so the new message appears once
+        with metrics.span('context'):
+            context = context_window.build(user_message, mood)
+            model = get_model(state)
+            flight = flight_key(state.api_key, context)
+
+        # Only a request that starts a flight is admitted, on this thread; joining one costs no
+        # quota. Turned away, every caller of the flight gets TurnedAway and falls back
+        admit = admission_check(state.session_id, context_window.prompt_tokens(user_message, mood) + REPLY_TOKENS)
+        if stream:
+            chunks = flights.stream(flight, lambda: model.generate_content(context, stream=True), admit)
+            return stream_chunks(state, metrics.timed_stream(chunks), key if use_cache else None, mood)
+
+        with metrics.span('generation'):
+            response = flights.do(flight, lambda: model.generate_content(context), admit)
+        if use_cache:
+            response_cache.shared_cache.set(key, response)
+        return response
+    except Exception as e:
+        error = error_reply(state, e, key, mood)
+        return iter([error]) if stream else error
+
+
+def stream_chunks(state, chunks, cache_key=None, mood=None):
+    """Yield each streamed chunk as soon as it arrives and cache the complete reply.
+
+    When a rerun or disconnect stops the consumer mid-reply, closing this
+    generator cancels the upstream request.
+    """
+    try:
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        if cache_key:
+            response_cache.shared_cache.set(cache_key, "".join(parts))
+    except Exception as e:
+        yield error_reply(state, e, cache_key, mood)
+
+
+def start_turn(state, prompt, mood=None):
+    """Check the message for crisis language (locally, in microseconds) and save it; returns (record, crisis)"""
+    crisis = detector.match(prompt) is not None
+    return add_message(state, "user", prompt, mood, flagged=crisis), crisis
+
+
+def finish_turn(state, question, response, mood=None):
+    """Save the reply and fold the turn into the context window; returns the reply's record"""
+    with metrics.span('persist'):
+        reply = add_message(state, "assistant", response, mood, flagged=question.flagged)
+        state.context.add("user", question.content)
+        state.context.add("assistant", response)
+
+        # Fold turns that left the window into the running summary, off the request path
+        session_id, context = state.session_id, state.context
+        summarizer.schedule(context, get_model(state).generate_content,
+                            on_summary=lambda: save_summary(session_id, context))
+
+        state.chat_history.append(ChatTurn(question, reply))
+        save_session(state)
+    return reply
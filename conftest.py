@@ -0,0 +1,22 @@
+"""pytest configuration for the top-level test files"""
+import os
+import shutil
+import tempfile
+
+# A manual check against the live API that exits when no key is set, not a pytest module
+collect_ignore = ['test_api.py']
+
+_db_dir = None
+
+
+def pytest_configure(config):
+    # Runs before any test module is collected. The conversation store and the SQLite
+    # session backend read CHAT_DB_PATH once at import, so later changes would be too late
+    global _db_dir
+    _db_dir = tempfile.mkdtemp(prefix='mindfulai-tests-')
+    os.environ['CHAT_DB_PATH'] = os.path.join(_db_dir, 'chat.db')
+
+
+def pytest_unconfigure(config):
+    if _db_dir:
+        shutil.rmtree(_db_dir, ignore_errors=True)
@@ -0,0 +1,102 @@
+"""Token-budgeted prompt context kept incrementally per session"""
+import os
+import re
+from collections import deque
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+_SUMMARY_HEADER = "\n\nSummary of earlier conversation:\n"
+_RECENT_HEADER = "\n\nRecent conversation:\n"
+
+
+def estimate_tokens(text):
+    """Local token estimate: one per punctuation mark, one per ~4 characters of a word"""
+    return sum((len(piece) + 3) // 4 for piece in _PIECES.findall(text))
+
+
+_SUMMARY_HEADER_TOKENS = estimate_tokens(_SUMMARY_HEADER)
+_ASK_TOKENS = estimate_tokens("\nUser: \nMindfulAI:")
+
+
+class ContextBuilder:
+    """Conversation window for one session, trimmed to a token budget.
+
+    Each turn is formatted and measured once when it is added, so building a
+    prompt is a single join over a window whose size is bounded by the budget
+    rather than by the length of the conversation. Turns that fall out of the
+    window are queued in `pending` for the summarizer, whose running summary
+    is sent ahead of the window.
+    """
+
+    def __init__(self, system_prompt, budget=CONTEXT_TOKEN_BUDGET):
+        self.system_prompt = system_prompt
+        self.header_tokens = estimate_tokens(system_prompt + _RECENT_HEADER)
+        self.budget = budget
+        self.window_tokens = 0
+        self.dropped = 0
+        # Running summary of turns that left the window, the turns evicted
+        # since the summary was last updated, and those a summary job is
+        # folding in right now
+        self.summary = ""
+        self.summary_tokens = 0
+        self.pending = []
+        self.summarizing = []
+        self.epoch = 0
+        self._turns = deque()
+
+    def __len__(self):
+        return len(self._turns)
+
+    def add(self, role, content):
+        """Append a finished turn and drop the oldest ones while over budget"""
+        speaker = "User" if role == "user" else "MindfulAI"
+        line = f"{speaker}: {content}\n"
+        tokens = estimate_tokens(line)
+        self._turns.append((role, content, line, tokens))
+        self.window_tokens += tokens
+        # Always keep the newest turn, even if it alone exceeds the budget
+        while self.window_tokens > self.budget and len(self._turns) > 1:
+            role, content, _, tokens = self._turns.popleft()
+            self.window_tokens -= tokens
+            self.pending.append((role, content))
+            self.dropped += 1
+
+    def set_summary(self, summary):
+        self.summary = summary.strip()
+        self.summary_tokens = estimate_tokens(self.summary)
+
+    def messages(self):
+        """The turns currently in the window as {"role", "content"} dicts"""
+        return [{"role": role, "content": content} for role, content, _, _ in self._turns]
+
+    def build(self, user_message, mood=None):
+        """Assemble the prompt for the next reply"""
+        parts = [self.system_prompt]
+        if self.summary:
+            parts.extend((_SUMMARY_HEADER, self.summary, "\n"))
+        parts.append(_RECENT_HEADER)
+        parts.extend(line for _, _, line, _ in self._turns)
+        if mood:
+            parts.append(f"\nUser's current mood: {mood}\n")
+        parts.append(f"\nUser: {user_message}\nMindfulAI:")
+        return "".join(parts)
+
+    def prompt_tokens(self, user_message, mood=None):
+        """Estimated size of the prompt build() would return"""
+        extra = _ASK_TOKENS + estimate_tokens(user_message)
+        if mood:
+            extra += estimate_tokens(f"\nUser's current mood: {mood}\n")
+        summary = self.summary_tokens + _SUMMARY_HEADER_TOKENS if self.summary else 0
+        return self.header_tokens + summary + self.window_tokens + extra
+
+    def clear(self):
+        self._turns.clear()
+        self.window_tokens = 0
+        self.dropped = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.pending = []
+        self.summarizing = []
+        # Lets an in-flight summary job notice the conversation was reset
+        self.epoch += 1
@@ -0,0 +1,160 @@
+"""SQLite (WAL) store for conversation messages and mood logs
+
+Every message and mood click is an append-only insert indexed by session and
+time, so sessions only need to keep a short tail in memory. Each thread gets
+its own connection; WAL lets readers proceed while another session writes.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+DB_PATH = os.getenv('CHAT_DB_PATH', 'mindfulai.db')
+MEMORY_TAIL = int(os.getenv('MEMORY_TAIL', '50'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    mood TEXT,
+    flagged INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, created_at);
+CREATE TABLE IF NOT EXISTS moods (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    mood TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_moods_session ON moods (session_id, created_at);
+"""
+
+
+class ConversationStore:
+    """Append-only message and mood log shared by every session in the process"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(messages)')}
+            if 'flagged' not in columns:
+                # Databases created before crisis flags were recorded
+                conn.execute('ALTER TABLE messages ADD COLUMN flagged INTEGER NOT NULL DEFAULT 0')
+            self._local.conn = conn
+        return conn
+
+    def append_message(self, session_id, role, content, mood=None, created_at=None, flagged=False):
+        with self.db:
+            self.db.execute(
+                'INSERT INTO messages (session_id, created_at, role, content, mood, flagged) VALUES (?, ?, ?, ?, ?, ?)',
+                (session_id, created_at or time.time(), role, content, mood, int(flagged)),
+            )
+
+    def log_mood(self, session_id, mood, created_at=None):
+        with self.db:
+            self.db.execute(
+                'INSERT INTO moods (session_id, created_at, mood) VALUES (?, ?, ?)',
+                (session_id, created_at or time.time(), mood),
+            )
+
+    def tail(self, session_id, limit=MEMORY_TAIL):
+        """The newest `limit` messages of a session, oldest first"""
+        rows = self.db.execute(
+            'SELECT role, content, mood, created_at, flagged FROM messages WHERE session_id = ? '
+            'ORDER BY created_at DESC, id DESC LIMIT ?',
+            (session_id, limit),
+        ).fetchall()
+        return [{"role": role, "content": content, "mood": mood, "time": created_at, "flagged": bool(flagged)}
+                for role, content, mood, created_at, flagged in reversed(rows)]
+
+    def mood_tail(self, session_id, limit=MEMORY_TAIL):
+        """The newest `limit` mood logs of a session as (mood, created_at), oldest first"""
+        rows = self.db.execute(
+            'SELECT mood, created_at FROM moods WHERE session_id = ? ORDER BY created_at DESC, id DESC LIMIT ?',
+            (session_id, limit),
+        ).fetchall()
+        return rows[::-1]
+
+    def slice(self, session_id, start, stop):
+        """Messages at positions [start, stop) of a session, oldest first"""
+        rows = self.db.execute(
+            'SELECT role, content, flagged FROM messages WHERE session_id = ? ORDER BY created_at, id LIMIT ? OFFSET ?',
+            (session_id, max(0, stop - start), start),
+        ).fetchall()
+        return [{"role": role, "content": content, "flagged": bool(flagged)} for role, content, flagged in rows]
+
+    def count_messages(self, session_id):
+        return self.db.execute('SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+
+    def count_moods(self, session_id):
+        return self.db.execute('SELECT COUNT(*) FROM moods WHERE session_id = ?', (session_id,)).fetchone()[0]
+
+    def iter_messages(self, session_id, batch_size=500):
+        """Yield a session's messages oldest first without loading them all"""
+        cursor = self.db.execute(
+            'SELECT created_at, role, content, mood, flagged FROM messages WHERE session_id = ? ORDER BY created_at, id',
+            (session_id,),
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for created_at, role, content, mood, flagged in rows:
+                yield {"role": role, "content": content, "mood": mood, "time": created_at, "flagged": bool(flagged)}
+
+    def row_batches(self, session_id=None, after_id=0, batch_size=500):
+        """Yield lists of message rows with ids above `after_id`, in id order.
+
+        Rows are (id, session_id, created_at, role, content, mood, flagged).
+        Ids only grow, so a reader that remembers the last id it saw can pick
+        up just the newer rows. session_id=None reads every session.
+        """
+        where, params = ('session_id = ? AND id > ?', (session_id, after_id)) if session_id else ('id > ?', (after_id,))
+        cursor = self.db.execute(
+            f'SELECT id, session_id, created_at, role, content, mood, flagged FROM messages WHERE {where} ORDER BY id',
+            params,
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+    def count_through(self, session_id, last_id):
+        """How many messages with ids up to `last_id` remain; fewer than were read means some were deleted"""
+        if session_id:
+            query, params = 'SELECT COUNT(*) FROM messages WHERE session_id = ? AND id <= ?', (session_id, last_id)
+        else:
+            query, params = 'SELECT COUNT(*) FROM messages WHERE id <= ?', (last_id,)
+        return self.db.execute(query, params).fetchone()[0]
+
+    def session_ids(self):
+        """Every session with at least one message"""
+        return [row[0] for row in self.db.execute(
+            'SELECT DISTINCT session_id FROM messages INDEXED BY idx_messages_session')]
+
+    def clear_messages(self, session_id):
+        with self.db:
+            self.db.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# Shared by every session; the database file is opened on first use
+store = ConversationStore()
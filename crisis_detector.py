@@ -0,0 +1,98 @@
+"""Local crisis-language detector that runs before the model is called
+
+A curated phrase list is compiled once into a single regex whose
+alternatives are merged into a prefix trie, so the engine tests each position
+against a handful of branches instead of every phrase. Messages are
+lowercased first because a case-sensitive pattern runs about twice as fast
+as re.IGNORECASE. Checking a message takes microseconds and does not depend
+on the Gemini API being reachable. A match shows the crisis resources right away and flags
+the turn; the model still answers as usual.
+"""
+import re
+
+CRISIS_PHRASES = [
+    "suicide", "suicidal", "kill myself", "killing myself", "end my life", "ending my life",
+    "take my own life", "taking my own life", "want to die", "wanna die", "wish i was dead",
+    "wish i were dead", "better off dead", "better off without me", "don't want to live",
+    "don't want to be alive", "no reason to live", "not worth living", "can't go on",
+    "end it all", "no way out", "hurt myself", "hurting myself", "harm myself", "harming myself",
+    "self harm", "self harming", "cut myself", "cutting myself", "overdose", "overdosed", "overdosing",
+    "hang myself", "hanging myself", "jump off a bridge", "say goodbye to everyone", "nobody would miss me",
+]
+
+# Shared by the sidebar and the banner shown on a flagged turn
+CRISIS_RESOURCES = """
+**If you're in crisis, please contact:**
+
+🆘 **Emergency**: 911
+
+🤝 **Crisis Text Line**:
+Text HOME to 741741
+
+📞 **National Suicide Prevention**:
+988 or 1-800-273-8255
+
+💬 **SAMHSA Helpline**:
+1-800-662-4357
+
+🌐 **Online Chat**:
+[suicidepreventionlifeline.org](https://suicidepreventionlifeline.org/chat/)
+"""
+
+CRISIS_BANNER = ("💙 It sounds like you may be going through something really painful. You don't have to face it "
+                 "alone — please reach out now:\n\n🆘 **Emergency**: 911 · 📞 **Call or text**: 988 · "
+                 "🤝 **Text** HOME to 741741 · 🌐 [Online chat](https://suicidepreventionlifeline.org/chat/)")
+
+
+def phrase_units(phrase):
+    """Regex pieces for a phrase, tolerating missing or curly apostrophes and any spacing or hyphens, or none"""
+    units = []
+    for word in re.split(r"[\s-]+", phrase.strip().lower()):
+        if units:
+            # "selfharm" and "self-harm" are written as often as "self harm"
+            units.append(r"[\s-]*")
+        units.extend("['’]?" if char == "'" else re.escape(char) for char in word)
+    return units
+
+
+def trie_pattern(sequences):
+    """One regex matching any of the unit sequences, with shared prefixes merged"""
+    root = {}
+    for units in sequences:
+        node = root
+        for unit in units:
+            node = node.setdefault(unit, {})
+        node[''] = {}
+
+    def emit(node):
+        branches = [unit + emit(child) for unit, child in sorted(node.items()) if unit]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # A phrase ends here; the greedy ? still prefers the longer phrase
+            return f'(?:{body})?'
+        return body
+
+    return emit(root)
+
+
+class CrisisDetector:
+    """Matches crisis phrases as whole words anywhere in a message"""
+
+    def __init__(self, phrases=CRISIS_PHRASES):
+        self.phrases = list(phrases)
+        pattern = trie_pattern(phrase_units(phrase) for phrase in self.phrases)
+        self._pattern = re.compile(r"\b" + pattern + r"\b")
+
+    def match(self, text):
+        """The first crisis phrase found in `text` (lowercased), or None"""
+        found = self._pattern.search(text.lower())
+        return found.group(0) if found else None
+
+    def find_all(self, text):
+        return [found.group(0) for found in self._pattern.finditer(text.lower())]
+
+
+# Compiled once per process
+detector = CrisisDetector()
@@ -0,0 +1,279 @@
+"""Background, incremental export of conversations from the store
+
+An export is one file per session (`chat_<session>.jsonl`), or one file for
+every session (`all_sessions.jsonl`) with a session_id on each line. Formats:
+  jsonl     one compact JSON object per message
+  jsonl.gz  the same, gzip-compressed
+  json      a JSON array, as the app saved before (rewritten in full each time)
+Message ids in the store only grow, so the exporter remembers the last id
+written and the file's size then (in a hidden `.<file>.state` next to the
+export). Each later export serializes only the newer messages and appends
+them in place, as another gzip member for .gz files, so a save costs the
+new messages rather than the whole file. If messages were deleted since
+(Clear Chat History) or the state does not match the file (an append cut
+short by a crash leaves it longer), the export is rewritten from scratch
+into a temporary file that replaces the old one with a single rename.
+
+Exports run on a small thread pool, so the Save Conversation button returns
+at once. Saves of the same file run one at a time, and a save asked for
+while another is still queued joins it.
+
+Run `python exporter.py [--each | --session ID ...] [--format jsonl.gz]` to
+export from the command line.
+"""
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from itertools import chain
+from json.encoder import encode_basestring
+
+from conversation_store import store as default_store
+
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+EXPORT_FORMAT = os.getenv('EXPORT_FORMAT', 'jsonl')
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '2'))
+EXPORT_GZIP_LEVEL = int(os.getenv('EXPORT_GZIP_LEVEL', '1'))
+
+FORMATS = ('jsonl', 'jsonl.gz', 'json')
+BATCH_SIZE = 1000
+
+
+def _string(value):
+    return 'null' if value is None else encode_basestring(value)
+
+
+# Roles and moods repeat on every line, so their JSON is worked out once
+_literals = {None: 'null'}
+
+
+def _literal(value):
+    text = _literals.get(value)
+    if text is None:
+        text = _literals[value] = encode_basestring(value)
+    return text
+
+
+def encode_lines(rows, with_session):
+    """The JSON Lines text for a batch of store rows.
+
+    Lines are assembled around the C string encoder rather than by encoding
+    a dict per message, which is about twice as fast for long histories.
+    """
+    return ''.join(
+        f'{{"id":{message_id},' + (f'"session_id":{_string(session_id)},' if with_session else '') +
+        f'"time":{created_at!r},"role":{_literal(role)},"content":{_string(content)},"mood":{_literal(mood)},'
+        f'"flagged":{"true" if flagged else "false"}}}\n'
+        for message_id, session_id, created_at, role, content, mood, flagged in rows)
+
+
+class Exporter:
+    """Writes store messages to export files off the caller's thread"""
+
+    def __init__(self, store=default_store, directory=EXPORT_DIR, fmt=EXPORT_FORMAT, workers=EXPORT_WORKERS,
+                 gzip_level=EXPORT_GZIP_LEVEL):
+        if fmt not in FORMATS:
+            raise ValueError(f"Export format must be one of {', '.join(FORMATS)}, not {fmt!r}")
+        self.store = store
+        self.directory = directory
+        self.format = fmt
+        self.gzip_level = gzip_level
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        # path -> [lock, number of exports holding or waiting for it]
+        self._path_locks = {}
+        # path -> the newest background export of it, until that finishes
+        self._queued = {}
+
+    def path_for(self, session_id=None, fmt=None):
+        """The export file of a session, or of every session when session_id is None"""
+        name = f"chat_{session_id}" if session_id else "all_sessions"
+        return os.path.join(self.directory, f"{name}.{fmt or self.format}")
+
+    @contextmanager
+    def _path_lock(self, path):
+        """Hold a file's lock; it is dropped once no export needs it, so sessions do not pile up"""
+        with self._lock:
+            entry = self._path_locks.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._path_locks[path]
+
+    def export(self, session_id=None, fmt=None):
+        """Bring one export file up to date now; returns what was written"""
+        fmt = fmt or self.format
+        if fmt not in FORMATS:
+            raise ValueError(f"Export format must be one of {', '.join(FORMATS)}, not {fmt!r}")
+        path = self.path_for(session_id, fmt)
+        with self._path_lock(path):
+            start = time.perf_counter()
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            state = None if fmt == 'json' else self._state(path)
+            if state is not None and self.store.count_through(session_id, state["last_id"]) != state["count"]:
+                state = None
+            rewrite = state is None
+            if rewrite:
+                state = {"last_id": 0, "count": 0}
+            batches = self.store.row_batches(session_id, state["last_id"], BATCH_SIZE)
+            first = next(batches, None)
+            if first is None and not rewrite:
+                return self._result(path, 0, state["count"], False, start)
+            batches = chain([first], batches) if first is not None else batches
+            if rewrite:
+                written, last_id = self._rewrite(path, batches, fmt, with_session=session_id is None)
+            else:
+                with open(path, 'ab') as f:
+                    written, last_id = self._write(f, batches, fmt, with_session=session_id is None)
+                    f.flush()
+                    os.fsync(f.fileno())
+            if fmt != 'json':
+                self._save_state(path, {"last_id": last_id or state["last_id"], "count": state["count"] + written,
+                                        "size": os.path.getsize(path)})
+            return self._result(path, written, state["count"] + written, rewrite, start)
+
+    def _result(self, path, written, messages, rewritten, start):
+        return {"path": path, "written": written, "messages": messages, "bytes": os.path.getsize(path),
+                "rewritten": rewritten, "seconds": time.perf_counter() - start}
+
+    def _rewrite(self, path, batches, fmt, with_session):
+        """Write a whole export beside the old one and swap it in, so readers never see it half done"""
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                result = self._write(f, batches, fmt, with_session)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return result
+
+    def _write(self, f, batches, fmt, with_session):
+        written, last_id = 0, 0
+        if fmt == 'json':
+            f.write(b'[')
+            for batch in batches:
+                text = ',\n'.join(f'{{"role":{_string(role)},"content":{_string(content)}}}'
+                                  for _, _, _, role, content, _, _ in batch)
+                f.write(((',\n' if written else '\n') + text).encode('utf-8'))
+                written += len(batch)
+            f.write(b'\n]\n')
+            return written, last_id
+        out = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=self.gzip_level) if fmt == 'jsonl.gz' else f
+        try:
+            for batch in batches:
+                out.write(encode_lines(batch, with_session).encode('utf-8'))
+                written += len(batch)
+                last_id = batch[-1][0]
+        finally:
+            if out is not f:
+                out.close()
+        return written, last_id
+
+    def _state_path(self, path):
+        directory, name = os.path.split(path)
+        return os.path.join(directory, f".{name}.state")
+
+    def _state(self, path):
+        """The saved position of an export, or None when it cannot be trusted"""
+        try:
+            with open(self._state_path(path), encoding='utf-8') as f:
+                state = json.load(f)
+            # A crash between writing the export and saving its state leaves them apart
+            return state if os.path.getsize(path) == state["size"] else None
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_state(self, path, state):
+        state_path = self._state_path(path)
+        with open(f"{state_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    def submit(self, session_id=None, fmt=None):
+        """Export in the background; returns a future of export()'s result"""
+        path = self.path_for(session_id, fmt)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='exporter')
+            future = self._queued.get(path)
+            # A job that has not started yet will read the newest messages anyway
+            if future is not None and not future.running() and not future.done():
+                return future
+            future = self._queued[path] = self._executor.submit(self.export, session_id, fmt)
+        future.add_done_callback(lambda done: self._forget(path, done))
+        return future
+
+    def _forget(self, path, future):
+        with self._lock:
+            if self._queued.get(path) is future:
+                del self._queued[path]
+
+    def export_many(self, session_ids, fmt=None, progress=None):
+        """Export several sessions to their own files in parallel; returns the results"""
+        futures = [self.submit(session_id, fmt) for session_id in session_ids]
+        results = []
+        for count, future in enumerate(as_completed(futures), 1):
+            results.append(future.result())
+            if progress:
+                progress(count, len(futures))
+        return results
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# Shared by every session; threads start on the first background export
+exporter = Exporter()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export conversations from the store")
+    parser.add_argument('--db', default=None, help='conversation store (default CHAT_DB_PATH)')
+    parser.add_argument('--dir', default=EXPORT_DIR)
+    parser.add_argument('--format', default=EXPORT_FORMAT, choices=FORMATS)
+    parser.add_argument('--session', action='append', default=[], help='export this session (repeatable)')
+    parser.add_argument('--each', action='store_true', help='one file per session instead of one for all')
+    args = parser.parse_args()
+
+    source = default_store
+    if args.db:
+        from conversation_store import ConversationStore
+        source = ConversationStore(args.db)
+    bulk = Exporter(source, args.dir, args.format)
+    start = time.perf_counter()
+    try:
+        if args.session or args.each:
+            session_ids = args.session or source.session_ids()
+            results = bulk.export_many(session_ids, progress=lambda done, total: print(
+                f"\r  {done}/{total} sessions", end='', flush=True))
+            print()
+        else:
+            results = [bulk.export()]
+    finally:
+        bulk.close()
+    elapsed = time.perf_counter() - start
+    written = sum(result["written"] for result in results)
+    size = sum(result["bytes"] for result in results)
+    print(f"{written} new messages in {len(results)} file(s) under {args.dir}, {size / 2 ** 20:.1f} MiB, "
+          f"{elapsed:.2f}s ({written / elapsed if elapsed else 0:,.0f} messages/s)")
+
+
+if __name__ == '__main__':
+    main()
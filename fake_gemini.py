@@ -0,0 +1,176 @@
+"""Local fake of the Gemini REST API for tests and benchmarks
+
+Run it standalone with `python fake_gemini.py --port 8765` and point the app at
+it with GEMINI_API_BASE=http://127.0.0.1:8765/v1beta.
+"""
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+class FakeServer(ThreadingHTTPServer):
+    # The default backlog of 5 overflows when dozens of pooled clients connect at once
+    request_queue_size = 128
+    daemon_threads = True
+
+
+FAKE_MODELS = [
+    {'name': 'models/gemini-2.0-flash-exp', 'supportedGenerationMethods': ['generateContent', 'countTokens']},
+    {'name': 'models/gemini-2.5-flash', 'supportedGenerationMethods': ['generateContent', 'countTokens']},
+    {'name': 'models/text-embedding-004', 'supportedGenerationMethods': ['embedContent']},
+]
+
+
+class FakeGemini:
+    """Threaded HTTP server speaking the generateContent/streamGenerateContent API
+
+    `reply` is either a fixed string or a callable taking (model, prompt).
+    `latency` delays the first byte and `chunk_delay` spaces streamed chunks.
+    `inject(503, 429, ...)` makes the next generate requests fail with those
+    HTTP statuses, in order.
+    """
+
+    def __init__(self, reply='Hello! I am here for you.', latency=0.0, chunk_delay=0.0,
+                 chunks=3, host='127.0.0.1', port=0):
+        self.reply = reply
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunks = chunks
+        self.requests = []
+        self.connections = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.faults = deque()
+        self._lock = threading.Lock()
+        self._server = FakeServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1beta'
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-gemini', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def inject(self, *statuses):
+        with self._lock:
+            self.faults.extend(statuses)
+
+    def reply_for(self, model, prompt):
+        return self.reply(model, prompt) if callable(self.reply) else self.reply
+
+    def split(self, text):
+        size = max(1, -(-len(text) // max(1, self.chunks)))
+        return [text[i:i + size] for i in range(0, len(text), size)] or ['']
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_chunk(self, data):
+                self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+
+            def do_GET(self):
+                fake.connections.add(self.client_address)
+                if urlsplit(self.path).path.rstrip('/') == '/v1beta/models':
+                    self.send_json(200, {'models': FAKE_MODELS})
+                else:
+                    self.send_json(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}})
+
+            def do_POST(self):
+                fake.connections.add(self.client_address)
+                path = urlsplit(self.path).path
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                model, _, method = path.rpartition('/')[2].partition(':')
+                prompt = ''.join(part.get('text', '') for content in body.get('contents', [])
+                                 for part in content.get('parts', []))
+                with fake._lock:
+                    fake.requests.append({'model': model, 'method': method, 'prompt': prompt})
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                    fault = fake.faults.popleft() if fake.faults else None
+                try:
+                    if not self.headers.get('x-goog-api-key'):
+                        self.send_json(401, {'error': {'code': 401, 'message': 'API key not valid',
+                                                       'status': 'UNAUTHENTICATED'}})
+                        return
+                    if fault:
+                        self.send_json(fault, {'error': {'code': fault, 'message': f'Injected fault {fault}',
+                                                         'status': 'INJECTED'}})
+                        return
+                    time.sleep(fake.latency)
+                    text = fake.reply_for(model, prompt)
+                    if method == 'generateContent':
+                        self.send_json(200, _candidate(text))
+                    elif method == 'streamGenerateContent':
+                        self.send_response(200)
+                        self.send_header('Content-Type', 'text/event-stream')
+                        self.send_header('Transfer-Encoding', 'chunked')
+                        self.end_headers()
+                        for index, piece in enumerate(fake.split(text)):
+                            if index:
+                                time.sleep(fake.chunk_delay)
+                            self.send_chunk(f'data: {json.dumps(_candidate(piece))}\r\n\r\n'.encode())
+                        self.send_chunk(b'')
+                    else:
+                        self.send_json(404, {'error': {'code': 404, 'message': f'Unknown method {method}',
+                                                       'status': 'NOT_FOUND'}})
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with fake._lock:
+                        fake.in_flight -= 1
+
+        return Handler
+
+
+def _candidate(text):
+    return {'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}}]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds before the first byte')
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help='seconds between streamed chunks')
+    args = parser.parse_args()
+    server = FakeGemini(latency=args.latency, chunk_delay=args.chunk_delay, port=args.port)
+    print(f"Fake Gemini listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
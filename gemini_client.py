@@ -0,0 +1,306 @@
+"""Async Gemini REST client shared by the app and the helper scripts
+
+Every request runs on one background event loop per process, so all sessions
+share a pooled keep-alive transport per API key and a single in-flight limit.
+Streamlit script threads use the blocking helpers (`generate`, `stream`,
+`list_models`) which wait on that loop with a per-request deadline.
+
+httpx is imported when the first client is built, so importing this module
+(and rendering the app's first page) stays cheap.
+
+With GEMINI_CASSETTE set, every client records to or replays from that
+cassette file instead of (or as well as) calling the API; see cassette.py.
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+
+API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta')
+# Models the app may route turns to, preferred first
+MODELS = [name.strip() for name in os.getenv('GEMINI_MODELS', 'gemini-2.0-flash-exp,gemini-2.5-flash').split(',')
+          if name.strip()]
+DEFAULT_MODEL = MODELS[0]
+REQUEST_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '30'))
+MAX_IN_FLIGHT = int(os.getenv('GEMINI_MAX_IN_FLIGHT', '16'))
+CASSETTE = os.getenv('GEMINI_CASSETTE')
+
+_DONE = object()
+
+
+class GeminiError(Exception):
+    """Raised when the Gemini API rejects a request"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class GeminiTimeout(GeminiError):
+    """Raised when a request misses its deadline"""
+
+
+def _model_path(model):
+    return model if model.startswith('models/') else f'models/{model}'
+
+
+def _request_body(prompt, generation_config=None):
+    body = {'contents': [{'role': 'user', 'parts': [{'text': prompt}]}]}
+    if generation_config:
+        body['generationConfig'] = dict(generation_config)
+    return body
+
+
+def _raise_for_status(response):
+    if response.status_code < 400:
+        return
+    try:
+        message = response.json()['error']['message']
+    except (ValueError, KeyError, TypeError):
+        message = response.text or response.reason_phrase
+    raise GeminiError(f"{response.status_code}: {message}", status=response.status_code)
+
+
+def _extract_text(data):
+    candidates = data.get('candidates') or []
+    if not candidates:
+        reason = (data.get('promptFeedback') or {}).get('blockReason')
+        if reason:
+            raise GeminiError(f"Prompt blocked: {reason}")
+        return ''
+    parts = (candidates[0].get('content') or {}).get('parts') or []
+    return ''.join(part.get('text', '') for part in parts)
+
+
+class AsyncGeminiClient:
+    """Async client for one API key over a pooled keep-alive HTTP transport"""
+
+    def __init__(self, api_key, base_url=API_BASE, max_connections=MAX_IN_FLIGHT, transport=None, cassette=None):
+        import httpx
+
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        if cassette is not None:
+            # Recordings go through a pooled transport of our own; replays never touch the network
+            transport = cassette.transport(transport or (httpx.AsyncHTTPTransport(limits=limits)
+                                                         if cassette.mode != 'replay' else None))
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={'x-goog-api-key': api_key},
+            limits=limits,
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=10.0),
+            transport=transport,
+        )
+
+    async def generate(self, model, prompt, generation_config=None):
+        response = await self._http.post(
+            f'/{_model_path(model)}:generateContent',
+            json=_request_body(prompt, generation_config),
+        )
+        _raise_for_status(response)
+        return _extract_text(response.json())
+
+    async def stream(self, model, prompt, generation_config=None):
+        """Yield reply text chunks as the server-sent events arrive"""
+        async with self._http.stream(
+            'POST',
+            f'/{_model_path(model)}:streamGenerateContent',
+            params={'alt': 'sse'},
+            json=_request_body(prompt, generation_config),
+        ) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                _raise_for_status(response)
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                text = _extract_text(json.loads(line[5:]))
+                if text:
+                    yield text
+
+    async def list_models(self):
+        models, page_token = [], None
+        while True:
+            params = {'pageSize': 1000}
+            if page_token:
+                params['pageToken'] = page_token
+            response = await self._http.get('/models', params=params)
+            _raise_for_status(response)
+            data = response.json()
+            models.extend(data.get('models', []))
+            page_token = data.get('nextPageToken')
+            if not page_token:
+                return models
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+class GeminiRuntime:
+    """Background event loop owning the per-key clients and the in-flight limit"""
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, base_url=API_BASE, cassette=CASSETTE):
+        self.max_in_flight = max_in_flight
+        self.base_url = base_url
+        # A cassette path (opened on the first client) or a cassette.Cassette
+        self.cassette = cassette
+        self._lock = threading.Lock()
+        self._loop = None
+        self._semaphore = None
+        self._clients = {}
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='gemini-client', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def client(self, api_key):
+        """Return the shared client for an API key, creating it on first use"""
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                if isinstance(self.cassette, str):
+                    import cassette
+                    self.cassette = cassette.open_cassette(self.cassette)
+                client = AsyncGeminiClient(api_key, self.base_url, max_connections=self.max_in_flight,
+                                           cassette=self.cassette)
+                self._clients[api_key] = client
+            return client
+
+    def discard(self, api_key):
+        """Close and forget the client for an API key; a later request opens a new one"""
+        with self._lock:
+            client = self._clients.pop(api_key, None)
+            loop = self._loop
+        if client is not None and loop is not None:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+    def submit(self, coro):
+        """Schedule a coroutine on the runtime loop and return a concurrent future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _limited(self, coro, timeout):
+        # Created lazily so the semaphore belongs to the runtime loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def run():
+            async with self._semaphore:
+                return await coro
+
+        try:
+            return await asyncio.wait_for(run(), timeout)
+        except asyncio.TimeoutError:
+            raise GeminiTimeout(f"Request exceeded its {timeout:g}s deadline") from None
+
+    def submit_generate(self, api_key, model, prompt, timeout=REQUEST_TIMEOUT, generation_config=None):
+        """Start a generateContent call and return its future; cancelling the future cancels the request"""
+        coro = self.client(api_key).generate(model, prompt, generation_config)
+        return self.submit(self._limited(coro, timeout))
+
+    def generate(self, api_key, model, prompt, timeout=REQUEST_TIMEOUT, generation_config=None):
+        """Blocking generateContent call; an interrupted caller cancels the request"""
+        future = self.submit_generate(api_key, model, prompt, timeout, generation_config)
+        try:
+            return future.result()
+        finally:
+            future.cancel()
+
+    def stream(self, api_key, model, prompt, timeout=REQUEST_TIMEOUT, generation_config=None):
+        """Yield reply chunks; closing the generator cancels the upstream request"""
+        chunks = queue.SimpleQueue()
+
+        async def feed():
+            async for text in self.client(api_key).stream(model, prompt, generation_config):
+                chunks.put(text)
+
+        async def pump():
+            try:
+                await self._limited(feed(), timeout)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(_DONE)
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item = chunks.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def list_models(self, api_key, timeout=REQUEST_TIMEOUT):
+        future = self.submit(self._limited(self.client(api_key).list_models(), timeout))
+        try:
+            return future.result()
+        finally:
+            future.cancel()
+
+    def close(self):
+        """Close every pooled client and stop the loop"""
+        with self._lock:
+            loop, clients = self._loop, list(self._clients.values())
+            self._loop, self._semaphore, self._clients = None, None, {}
+        if loop is None:
+            return
+
+        async def shutdown():
+            for client in clients:
+                await client.aclose()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+# Process-wide runtime shared by every session
+runtime = GeminiRuntime()
+
+
+def generate(api_key, model, prompt, timeout=REQUEST_TIMEOUT, generation_config=None):
+    return runtime.generate(api_key, model, prompt, timeout, generation_config)
+
+
+def stream(api_key, model, prompt, timeout=REQUEST_TIMEOUT, generation_config=None):
+    return runtime.stream(api_key, model, prompt, timeout, generation_config)
+
+
+def list_models(api_key, timeout=REQUEST_TIMEOUT):
+    return runtime.list_models(api_key, timeout)
+
+
+class GeminiModel:
+    """Per-session handle with a generate_content call like the SDK's GenerativeModel"""
+
+    def __init__(self, api_key, model_name=DEFAULT_MODEL, timeout=REQUEST_TIMEOUT, runtime=runtime,
+                 generation_config=None):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.timeout = timeout
+        self.runtime = runtime
+        self.generation_config = generation_config
+
+    def generate_content(self, prompt, stream=False, timeout=None):
+        """Return the reply text, or an iterator of text chunks when stream=True.
+
+        `timeout` shortens this call's deadline, e.g. to what is left of a retry budget.
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        if stream:
+            return self.runtime.stream(self.api_key, self.model_name, prompt, timeout, self.generation_config)
+        return self.runtime.generate(self.api_key, self.model_name, prompt, timeout, self.generation_config)
+
+    def submit_content(self, prompt, timeout=None):
+        """Start a reply without waiting for it: a future of the text, whose cancel() cancels the request"""
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        return self.runtime.submit_generate(self.api_key, self.model_name, prompt, timeout, self.generation_config)
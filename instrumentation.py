@@ -0,0 +1,291 @@
+"""Per-turn timing spans aggregated into histograms, with Prometheus exporters
+
+Each stage of a chat turn is timed with span() (or timed_stream() for
+streamed replies) and observed into a fixed-bucket histogram, so recording
+costs a couple of perf_counter calls, a bisect and a lock. Stages:
+
+- history: rendering the conversation on a rerun
+- cache: response cache key and lookup
+- context: building the prompt window
+- queue: waiting for admission control
+- first_token: from sending the request until the first streamed chunk
+- generation: the whole model call, or the rest of the stream
+- persist: saving the turn to the store, context window and chat history
+- turn: the whole chat-input branch, from message to saved reply
+
+The histograms are served in the Prometheus text format on
+http://<host>:METRICS_PORT/metrics and/or written to METRICS_FILE every
+METRICS_INTERVAL seconds. profiled() runs a block under cProfile for
+sessions that turn profiling on, one block per process at a time.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_FILE = os.getenv('METRICS_FILE')
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', '15'))
+PROFILING = os.getenv('PROFILING', 'false').lower() == 'true'
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+
+# Seconds; from sub-millisecond local work up to slow model replies
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_NAME = 'mindfulai_turn_stage_seconds'
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Counts of observations per bucket upper bound, plus their sum"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None when empty or beyond the last bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+
+class Span:
+    """Context manager observing its duration into a stage histogram"""
+
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Stage histograms shared by every session in the process"""
+
+    def __init__(self, enabled=METRICS_ENABLED, buckets=BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def span(self, stage):
+        return Span(self, stage)
+
+    def timed_stream(self, chunks, first='first_token', rest='generation'):
+        """Yield `chunks`, observing the wait for the first one and the rest of the stream
+
+        Timing starts now, not at the first next(), since the request is
+        already on its way.
+        """
+        start = time.perf_counter()
+
+        def timed():
+            got_first = None
+            try:
+                for chunk in chunks:
+                    if got_first is None:
+                        got_first = time.perf_counter()
+                        self.observe(first, got_first - start)
+                    yield chunk
+            finally:
+                getattr(chunks, 'close', lambda: None)()
+                if got_first is not None:
+                    self.observe(rest, time.perf_counter() - got_first)
+
+        return timed()
+
+    def snapshot(self):
+        """{stage: (bucket counts, sum, count)} copied under the lock"""
+        with self._lock:
+            return {stage: (list(h.counts), h.sum, h.count) for stage, h in self._histograms.items()}
+
+    def summary(self):
+        """{stage: {count, mean_ms, p95_ms}} for display; p95 is a bucket upper bound"""
+        with self._lock:
+            return {stage: {"count": h.count,
+                            "mean_ms": h.sum / h.count * 1000,
+                            "p95_ms": None if h.quantile(0.95) is None else h.quantile(0.95) * 1000}
+                    for stage, h in self._histograms.items() if h.count}
+
+    def render(self):
+        """The histograms in the Prometheus text exposition format"""
+        lines = [f"# HELP {METRIC_NAME} Time spent in each stage of a chat turn.",
+                 f"# TYPE {METRIC_NAME} histogram"]
+        for stage, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write render() to `path` atomically, for node_exporter's textfile collector or similar"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+def serve(metrics, port, host=''):
+    """Serve /metrics on a daemon thread; returns the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def write_periodically(metrics, path, interval):
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                metrics.write(path)
+            except OSError as e:
+                logger.warning("Could not write metrics to %s: %s", path, e)
+
+    threading.Thread(target=loop, name='metrics-file', daemon=True).start()
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_INTERVAL):
+    """Start the configured exporters once per process; safe to call on every rerun"""
+    global _exporters_started
+    if _exporters_started:
+        return
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        if not metrics.enabled:
+            return
+        if port:
+            try:
+                serve(metrics, port)
+            except OSError as e:
+                # Another worker on this host may already hold the port
+                logger.warning("Metrics endpoint not started on port %d: %s", port, e)
+        if path:
+            write_periodically(metrics, path, interval)
+
+
+class Profile:
+    """Result of a profiled() block: the top functions by cumulative time, and the dump file if any
+
+    `skipped` is set when profiling was asked for but another block held the profiler.
+    """
+
+    def __init__(self):
+        self.report = ""
+        self.path = None
+        self.skipped = False
+
+
+# One cProfile run at a time per process: from Python 3.12 profilers share a
+# single sys.monitoring tool slot, and enabling a second one raises ValueError
+_profiler_lock = threading.Lock()
+
+
+@contextmanager
+def profiled(enabled, label='turn', limit=25, profile_dir=PROFILE_DIR):
+    """Run the block under cProfile when `enabled`; the Profile it yields is filled in on exit
+
+    Only one block in the process is profiled at a time. A block that finds
+    the profiler busy runs unprofiled with `skipped` set rather than waiting,
+    so a profiled session never holds up another session's turn.
+    """
+    profile = Profile()
+    if not enabled:
+        yield profile
+        return
+    if not _profiler_lock.acquire(blocking=False):
+        profile.skipped = True
+        yield profile
+        return
+    try:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Some other tool (a debugger, coverage, an outer profiler) holds the hook
+            profiler = None
+            profile.skipped = True
+        if profiler is None:
+            yield profile
+            return
+        try:
+            yield profile
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+            profile.report = out.getvalue()
+            if profile_dir:
+                os.makedirs(profile_dir, exist_ok=True)
+                profile.path = os.path.join(profile_dir, f"{label}-{time.time_ns()}.prof")
+                profiler.dump_stats(profile.path)
+    finally:
+        _profiler_lock.release()
+
+
+# Shared by every session in the process
+metrics = Metrics()
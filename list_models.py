@@ -1,16 +1,21 @@
 """List available Gemini models"""
-import google.generativeai as genai
 from dotenv import load_dotenv
 import os
 
+import cassette
+import gemini_client
+
 load_dotenv()
 api_key = os.getenv('GOOGLE_API_KEY')
+# A replay-only cassette answers without a key
+if not api_key and gemini_client.CASSETTE and cassette.CASSETTE_MODE == cassette.REPLAY:
+    api_key = 'replay'
 
 if api_key:
-    genai.configure(api_key=api_key)
     print("Available models:")
-    for model in genai.list_models():
-        if 'generateContent' in model.supported_generation_methods:
-            print(f"  - {model.name}")
+    for model in gemini_client.list_models(api_key):
+        if 'generateContent' in model.get('supportedGenerationMethods', []):
+            routed = " (routed by the app)" if model['name'].removeprefix('models/') in gemini_client.MODELS else ""
+            print(f"  - {model['name']}{routed}")
 else:
     print("No API key found")
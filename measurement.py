@@ -0,0 +1,34 @@
+"""Latency percentiles and run metadata shared by the benchmarks and the batch evaluation"""
+import os
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(sorted_samples, q):
+    """Nearest-rank percentile of already sorted samples"""
+    if not sorted_samples:
+        return None
+    rank = max(1, -(-len(sorted_samples) * q // 100))
+    return sorted_samples[int(rank) - 1]
+
+
+def latency_summary(samples, elapsed=None):
+    """Count, throughput and p50/p95/p99 in ms for latencies given in seconds"""
+    ordered = sorted(samples)
+    summary = {"count": len(ordered)}
+    if elapsed:
+        summary["throughput_per_s"] = len(ordered) / elapsed
+    for q in (50, 95, 99):
+        value = percentile(ordered, q)
+        summary[f"p{q}_ms"] = None if value is None else value * 1000
+    return summary
+
+
+def git_commit():
+    """The checked-out commit, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
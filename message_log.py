@@ -0,0 +1,122 @@
+"""Compact in-memory records for the session's message, turn and mood tails
+
+Each record is a __slots__ object rather than a dict, so it has no
+per-instance dict and costs a fixed handful of pointers. Roles and moods are
+interned, mood times are stored as epoch floats instead of datetime objects,
+and a chat turn points at the two message records it pairs instead of
+holding its own references to their text.
+
+Records are read-only Mappings, so code written for the old dicts keeps
+working: message["content"], turn.get("mood"), dict(record) and comparison
+with a plain dict all behave as before.
+"""
+import sys
+import time
+from collections import deque
+from collections.abc import Mapping
+from datetime import datetime
+
+# The moods a user can log, in sidebar order
+MOODS = ("Happy", "Calm", "Sad", "Anxious", "Frustrated", "Tired")
+
+
+def intern(text):
+    return sys.intern(text) if text is not None else None
+
+
+class Record(Mapping):
+    """Dict-style read access to the attributes named in FIELDS"""
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class Message(Record):
+    """One chat message, viewed as {"role", "content", "mood", "flagged"}"""
+
+    __slots__ = ('role', 'content', 'mood', 'flagged')
+    FIELDS = __slots__
+
+    def __init__(self, role, content, mood=None, flagged=False):
+        self.role = intern(role)
+        self.content = content
+        self.mood = intern(mood)
+        self.flagged = bool(flagged)
+
+
+class ChatTurn(Record):
+    """A user message and its reply, viewed as {"timestamp", "user", "assistant", "mood", "crisis"}"""
+
+    __slots__ = ('question', 'reply', 'created_at')
+    FIELDS = ('timestamp', 'user', 'assistant', 'mood', 'crisis')
+
+    def __init__(self, question, reply, created_at=None):
+        self.question = question
+        self.reply = reply
+        self.created_at = time.time() if created_at is None else created_at
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.created_at).isoformat()
+
+    @property
+    def user(self):
+        return self.question.content
+
+    @property
+    def assistant(self):
+        return self.reply.content
+
+    @property
+    def mood(self):
+        return self.question.mood
+
+    @property
+    def crisis(self):
+        return self.question.flagged
+
+
+class MoodEntry(Record):
+    """One mood click, viewed as {"mood", "time"} with time as a datetime"""
+
+    __slots__ = ('mood', 'logged_at')
+    FIELDS = ('mood', 'time')
+
+    def __init__(self, mood, logged_at=None):
+        self.mood = intern(mood)
+        self.logged_at = time.time() if logged_at is None else logged_at
+
+    @property
+    def time(self):
+        return datetime.fromtimestamp(self.logged_at)
+
+
+class MessageLog(deque):
+    """Bounded tail of Message records; append() takes a message's fields and returns its record"""
+
+    def append(self, role, content=None, mood=None, flagged=False):
+        message = role if isinstance(role, Message) else Message(role, content, mood, flagged)
+        super().append(message)
+        return message
+
+    @classmethod
+    def from_dicts(cls, messages, maxlen=None):
+        """A log of the given {"role", "content", ...} dicts, e.g. rows from the conversation store"""
+        log = cls(maxlen=maxlen)
+        for message in messages:
+            log.append(message["role"], message["content"], message.get("mood"), message.get("flagged", False))
+        return log
@@ -0,0 +1,126 @@
+"""Process-wide registry of Gemini models shared between sessions
+
+Sessions lease a model keyed by (API key, model name, generation config)
+instead of building their own, so sessions using the same key share one
+model and its pooled client, while different keys never touch each other's
+configuration. A lease is released when the session switches keys or is
+garbage collected; models nobody has used for MODEL_IDLE_TTL seconds are
+evicted, and the last model for a key closes that key's HTTP client.
+Leasing ROUTED_MODELS builds a ModelRouter over every configured model,
+wrapped in a ResilientModel for retries and a per-key circuit breaker.
+"""
+import json
+import os
+import threading
+import time
+import weakref
+
+import gemini_client
+from model_router import ModelRouter
+from resilience import ResilientModel
+
+MODEL_IDLE_TTL = float(os.getenv('MODEL_IDLE_TTL', '600'))
+ROUTED_MODELS = tuple(gemini_client.MODELS)
+
+
+def registry_key(api_key, model_name=gemini_client.DEFAULT_MODEL, generation_config=None):
+    """Hashable key for a model; equal configs in any key order map to the same entry"""
+    config = json.dumps(generation_config, sort_keys=True) if generation_config else ''
+    return api_key, model_name, config
+
+
+class ModelLease:
+    """A session's reference to a shared model"""
+
+    __slots__ = ('model', 'key', '_finalizer', '__weakref__')
+
+    def __init__(self, registry, key, model):
+        self.model = model
+        self.key = key
+        # Releases the reference even if the session never calls release()
+        self._finalizer = weakref.finalize(self, registry._release, key)
+
+    def release(self):
+        self._finalizer()
+
+    @property
+    def released(self):
+        return not self._finalizer.alive
+
+
+class ModelRegistry:
+    """Thread-safe, reference-counted models with idle eviction"""
+
+    def __init__(self, factory=None, idle_ttl=MODEL_IDLE_TTL, clock=time.monotonic, on_evict=None):
+        self.factory = factory or self._build
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        # Called with the API key when its last model is evicted
+        self.on_evict = on_evict if on_evict is not None else gemini_client.runtime.discard
+        # Reentrant because a lease finalizer may run during garbage collection
+        # triggered while this thread already holds the lock
+        self._lock = threading.RLock()
+        # key -> [model, reference count, last release time]
+        self._entries = {}
+        self.created = 0
+        self.evicted = 0
+
+    @staticmethod
+    def _build(api_key, model_name, generation_config):
+        if isinstance(model_name, tuple):
+            return ResilientModel(ModelRouter([gemini_client.GeminiModel(api_key, name, generation_config=generation_config)
+                                               for name in model_name]))
+        return gemini_client.GeminiModel(api_key, model_name, generation_config=generation_config)
+
+    def acquire(self, api_key, model_name=gemini_client.DEFAULT_MODEL, generation_config=None):
+        """Lease the shared model for this key, model name and config, building it on first use"""
+        key = registry_key(api_key, model_name, generation_config)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [self.factory(api_key, model_name, generation_config), 0, None]
+                self.created += 1
+            entry[1] += 1
+            lease = ModelLease(self, key, entry[0])
+        # After taking the reference, so a key's client survives a swap between its models
+        self.evict_idle()
+        return lease
+
+    def _release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > 0:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    entry[2] = self.clock()
+
+    def evict_idle(self):
+        """Drop unreferenced models idle for longer than idle_ttl; returns how many"""
+        now = self.clock()
+        with self._lock:
+            idle = [key for key, (_, refs, released) in self._entries.items()
+                    if refs == 0 and now - released >= self.idle_ttl]
+            models = [self._entries.pop(key)[0] for key in idle]
+            orphaned = {key[0] for key in idle} - {key[0] for key in self._entries}
+            self.evicted += len(idle)
+        for model in models:
+            if hasattr(model, 'close'):
+                model.close()
+        for api_key in orphaned:
+            self.on_evict(api_key)
+        return len(idle)
+
+    def refs(self, api_key, model_name=gemini_client.DEFAULT_MODEL, generation_config=None):
+        entry = self._entries.get(registry_key(api_key, model_name, generation_config))
+        return entry[1] if entry else 0
+
+    def stats(self):
+        with self._lock:
+            return {"models": len(self._entries),
+                    "leases": sum(refs for _, refs, _ in self._entries.values()),
+                    "created": self.created,
+                    "evicted": self.evicted}
+
+
+# Shared by every session in the process
+registry = ModelRegistry()
@@ -0,0 +1,226 @@
+"""Latency-aware routing of each turn across several Gemini models
+
+The router keeps a rolling window of latencies and outcomes per model and
+sends each request to the fastest model that is not cooling down after a
+failure. Timeouts, quota and server errors fail over to the next model, and a
+reply that is slower than the hedge delay (by default the primary's rolling
+p95) gets a second request to the runner-up; whichever answers first wins
+and the other is cancelled. Streams fail over only before their first chunk and are never hedged. A
+caller's timeout covers every model tried, so failing over never restarts
+the clock.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from gemini_client import GeminiError, GeminiTimeout
+
+ROUTER_WINDOW = int(os.getenv('ROUTER_WINDOW', '100'))
+ROUTER_COOLDOWN = float(os.getenv('ROUTER_COOLDOWN', '30'))
+# Seconds before a slow reply is hedged; empty means the primary's rolling p95
+ROUTER_HEDGE_DELAY = float(os.getenv('ROUTER_HEDGE_DELAY') or 0) or None
+ROUTER_MIN_SAMPLES = 5
+
+# Statuses another model may well answer: model not available, quota, server errors, overload
+FAILOVER_STATUSES = {404, 408, 429, 500, 502, 503, 504}
+
+
+def should_fail_over(error):
+    """Whether another model is worth trying after `error`"""
+    if isinstance(error, GeminiTimeout):
+        return True
+    if isinstance(error, GeminiError):
+        return error.status in FAILOVER_STATUSES
+    # Connection and protocol errors from the transport
+    return True
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty sequence"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _left(deadline):
+    """Seconds until a time.monotonic() deadline, or None without one"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class Route:
+    """One model and its rolling latency and error window"""
+
+    def __init__(self, model, window=ROUTER_WINDOW):
+        self.model = model
+        self.name = getattr(model, 'model_name', repr(model))
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.cooldown_until = 0.0
+
+    def p50(self):
+        return percentile(self.latencies, 0.5) if self.latencies else None
+
+    def p95(self):
+        return percentile(self.latencies, 0.95) if self.latencies else None
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class ModelRouter:
+    """Drop-in model with generate_content that spreads requests over several models"""
+
+    def __init__(self, models, hedge_delay=ROUTER_HEDGE_DELAY, cooldown=ROUTER_COOLDOWN,
+                 window=ROUTER_WINDOW, max_workers=32, clock=time.monotonic):
+        self.routes = [Route(model, window) for model in models]
+        self.model_name = self.routes[0].name
+        self.hedge_delay = hedge_delay
+        self.cooldown = cooldown
+        self.clock = clock
+        self.hedges = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='router')
+
+    def ranked(self):
+        """Routes in the order to try them: healthy first, then by rolling p50"""
+        now = self.clock()
+        with self._lock:
+            # Models without samples yet rank as fastest so they get measured
+            order = sorted(range(len(self.routes)),
+                           key=lambda i: (self.routes[i].cooldown_until > now, self.routes[i].p50() or 0.0, i))
+        return [self.routes[i] for i in order]
+
+    def _record(self, route, elapsed, error=None):
+        with self._lock:
+            route.outcomes.append(error is None)
+            if error is None:
+                route.latencies.append(elapsed)
+            elif should_fail_over(error):
+                route.cooldown_until = self.clock() + self.cooldown
+
+    def _delay_for(self, route):
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        with self._lock:
+            return route.p95() if len(route.latencies) >= ROUTER_MIN_SAMPLES else None
+
+    def _submit(self, route, prompt, timeout):
+        """Start `route`'s call and return its future.
+
+        Models with submit_content (GeminiModel) run on the client's event
+        loop, where cancelling the future cancels the request. Others run on
+        the router's pool and can only be abandoned once they have started.
+        """
+        submit = getattr(route.model, 'submit_content', None)
+        if submit is not None:
+            return submit(prompt, timeout=timeout)
+        return self._executor.submit(route.model.generate_content, prompt, timeout=timeout)
+
+    def _cancel(self, pending):
+        """Stop the calls a decided turn no longer needs"""
+        now = time.perf_counter()
+        for future, (route, start) in pending.items():
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                self._record(route, now - start, future.exception())
+                continue
+            future.cancel()
+            # It took at least this long; counting that keeps a slow model from staying first
+            self._record(route, now - start)
+
+    def generate_content(self, prompt, stream=False, timeout=None):
+        """Return the reply text, or an iterator of text chunks when stream=True.
+
+        `timeout` bounds the whole call: each model gets what is left of it.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if stream:
+            return self._stream(prompt, deadline)
+        candidates = self.ranked()
+        remaining = iter(candidates)
+        # Running calls: future -> (route, start time)
+        pending = {}
+        error = None
+        hedged = False
+
+        def launch():
+            left = _left(deadline)
+            route = next(remaining, None) if left is None or left > 0 else None
+            if route is not None:
+                pending[self._submit(route, prompt, left)] = (route, time.perf_counter())
+            return route is not None
+
+        launch()
+        try:
+            while pending:
+                delay = self._delay_for(candidates[0]) if not hedged and len(candidates) > 1 else None
+                done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    # The primary is slower than usual: race it against the runner-up
+                    hedged = True
+                    if launch():
+                        self.hedges += 1
+                    continue
+                for future in done:
+                    route, start = pending.pop(future)
+                    try:
+                        reply = future.result()
+                    except Exception as e:
+                        self._record(route, time.perf_counter() - start, e)
+                        if not should_fail_over(e):
+                            raise
+                        error = e
+                        continue
+                    self._record(route, time.perf_counter() - start)
+                    return reply
+                if not pending and launch():
+                    self.failovers += 1
+        finally:
+            # The losing side of a hedge, or anything left after an error
+            self._cancel(pending)
+        raise error or GeminiTimeout("No time left to try another model")
+
+    def _stream(self, prompt, deadline):
+        error = None
+        for index, route in enumerate(self.ranked()):
+            left = _left(deadline)
+            if left is not None and left <= 0:
+                break
+            if index:
+                self.failovers += 1
+            start = time.perf_counter()
+            chunks = route.model.generate_content(prompt, stream=True, timeout=left)
+            try:
+                first = next(chunks, None)
+            except Exception as e:
+                self._record(route, time.perf_counter() - start, e)
+                if not should_fail_over(e):
+                    raise
+                error = e
+                continue
+            # Time to first chunk is what the user waits for
+            self._record(route, time.perf_counter() - start)
+            try:
+                if first is not None:
+                    yield first
+                yield from chunks
+            finally:
+                # Closing the upstream stream cancels its request
+                getattr(chunks, 'close', lambda: None)()
+            return
+        raise error or GeminiTimeout("No time left to try another model")
+
+    def stats(self):
+        """Rolling latency (ms) and error rate per model"""
+        now = self.clock()
+        with self._lock:
+            return [{"model": route.name,
+                     "p50_ms": route.p50() * 1000 if route.latencies else None,
+                     "p95_ms": route.p95() * 1000 if route.latencies else None,
+                     "error_rate": route.error_rate(),
+                     "cooling_down": route.cooldown_until > now}
+                    for route in self.routes]
+
+    def close(self):
+        self._executor.shutdown(wait=False)
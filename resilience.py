@@ -0,0 +1,243 @@
+"""Retries, backoff and a circuit breaker around the model call
+
+Errors are classified once: timeouts, rate limits (429), server errors and
+dropped connections are transient and retried with full-jitter exponential
+backoff inside a total deadline, each try getting only the time that is
+left; auth failures, bad requests and blocked prompts are fatal and raised
+at once. Any other exception is a bug on this side, raised at once without
+touching the circuit breaker. After repeated transient failures the
+circuit breaker opens and calls fail fast with CircuitOpen until a single
+probe succeeds, so a Gemini outage costs users milliseconds instead of a
+full deadline each. user_message() turns any of these into chat text that
+does not expose exception details.
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from gemini_client import GeminiError, GeminiTimeout
+
+RETRY_DEADLINE = float(os.getenv('RETRY_DEADLINE', '45'))
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '4'))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '0.5'))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '8'))
+BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD', '5'))
+BREAKER_RESET = float(os.getenv('BREAKER_RESET', '30'))
+
+TIMEOUT = 'timeout'
+RATE_LIMITED = 'rate_limited'
+UNAVAILABLE = 'unavailable'
+AUTH = 'auth'
+INVALID = 'invalid'
+BLOCKED = 'blocked'
+FATAL = 'fatal'
+RETRYABLE = {TIMEOUT, RATE_LIMITED, UNAVAILABLE}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(GeminiError):
+    """Raised without calling the model while the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Gemini circuit open; retry in {retry_after:.0f}s", status=503)
+        self.retry_after = retry_after
+
+
+def classify(error):
+    """One of TIMEOUT, RATE_LIMITED, UNAVAILABLE, AUTH, INVALID, BLOCKED or FATAL"""
+    # An httpx error can only exist once the client has imported httpx, so
+    # this never imports it (and keeps importing this module cheap)
+    httpx = sys.modules.get('httpx')
+    if isinstance(error, (GeminiTimeout, TimeoutError)) or httpx and isinstance(error, httpx.TimeoutException):
+        return TIMEOUT
+    if isinstance(error, CircuitOpen):
+        return UNAVAILABLE
+    if isinstance(error, GeminiError):
+        if error.status is None:
+            return BLOCKED
+        if error.status == 429:
+            return RATE_LIMITED
+        if error.status in (401, 403):
+            return AUTH
+        if error.status == 408:
+            return TIMEOUT
+        if error.status >= 500:
+            return UNAVAILABLE
+        return INVALID
+    # Transport errors: refused or dropped connections, protocol errors
+    if isinstance(error, OSError) or httpx and isinstance(error, httpx.TransportError):
+        return UNAVAILABLE
+    # KeyError, TypeError and the like: a bug here, not a failing service
+    return FATAL
+
+
+def is_retryable(error):
+    return classify(error) in RETRYABLE
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY, rng=random):
+    """Full-jitter delay before retry number `attempt` (starting at 0)"""
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive transient failures; one probe at a time once `reset` has passed"""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset=BREAKER_RESET, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset = reset
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.opened = 0
+        self.short_circuits = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go ahead"""
+        with self._lock:
+            if self.state == OPEN:
+                waited = self.clock() - self.opened_at
+                if waited < self.reset:
+                    self.short_circuits += 1
+                    raise CircuitOpen(self.reset - waited)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.short_circuits += 1
+                    raise CircuitOpen(0)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self._probing = False
+            kind = classify(error)
+            if kind == FATAL:
+                # Says nothing about the service either way; a half-open breaker probes again
+                return
+            if kind not in RETRYABLE:
+                # The service answered; a fatal request error says nothing about its health
+                if self.state == HALF_OPEN:
+                    self.state = CLOSED
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+
+class ResilientModel:
+    """Wraps a model's generate_content with classified retries and a circuit breaker"""
+
+    def __init__(self, model, deadline=RETRY_DEADLINE, max_attempts=RETRY_MAX_ATTEMPTS,
+                 base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY, breaker=None,
+                 clock=time.monotonic, sleep=time.sleep, rng=None):
+        self.model = model
+        self.model_name = getattr(model, 'model_name', None)
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.calls = 0
+        self.retries = 0
+        self.errors = {}
+
+    def _attempts(self, call):
+        """Run `call(timeout)` until it succeeds, fails fatally, or attempts or the deadline run out.
+
+        Each attempt's timeout is what is left of the deadline, so a slow
+        attempt cannot push the whole call past it.
+        """
+        self.calls += 1
+        start = self.clock()
+        for attempt in range(self.max_attempts):
+            remaining = self.deadline - (self.clock() - start)
+            if remaining <= 0:
+                raise GeminiTimeout(f"Model call exceeded its {self.deadline:g}s retry deadline")
+            self.breaker.before_call()
+            try:
+                result = call(remaining)
+            except Exception as e:
+                kind = classify(e)
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+                self.breaker.record_failure(e)
+                if kind not in RETRYABLE or attempt + 1 == self.max_attempts:
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay, self.rng)
+                if self.clock() - start + delay >= self.deadline:
+                    raise
+                logger.info("Retrying model call after %s (%s), attempt %d", kind, e, attempt + 2)
+                self.retries += 1
+                self.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def generate_content(self, prompt, stream=False):
+        """Return the reply text, or an iterator of text chunks when stream=True"""
+        if stream:
+            return self._stream(prompt)
+        return self._attempts(lambda timeout: self.model.generate_content(prompt, timeout=timeout))
+
+    def _stream(self, prompt):
+        # Retry only until the first chunk; after that a failure would repeat text
+        def start(timeout):
+            chunks = iter(self.model.generate_content(prompt, stream=True, timeout=timeout))
+            return chunks, next(chunks, None)
+
+        chunks, first = self._attempts(start)
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+        finally:
+            getattr(chunks, 'close', lambda: None)()
+
+    def stats(self):
+        return {"state": self.breaker.state,
+                "calls": self.calls,
+                "retries": self.retries,
+                "errors": dict(self.errors),
+                "opened": self.breaker.opened,
+                "short_circuits": self.breaker.short_circuits}
+
+    def close(self):
+        if hasattr(self.model, 'close'):
+            self.model.close()
+
+
+def user_message(error):
+    """Chat text for a failed reply that does not expose exception details"""
+    kind = classify(error)
+    if kind == AUTH:
+        return ("I couldn't connect with the API key that's configured. Please check it under "
+                "⚙️ API Configuration in the sidebar.")
+    if kind == BLOCKED:
+        return ("I'm not able to respond to that message as written. Could you try rephrasing it? "
+                "If you're in crisis, the resources in the sidebar are available 24/7.")
+    if kind in (INVALID, FATAL):
+        return "Something went wrong preparing my reply. Please try sending your message again."
+    return ("I'm having trouble reaching my AI service right now. Please try again in a moment — "
+            "and if you need support right away, the crisis resources in the sidebar are available 24/7.")
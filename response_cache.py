@@ -0,0 +1,92 @@
+"""Process-wide cache of bot replies for quick prompts and repeated turns
+
+Entries are keyed on the normalized user message, the current mood and a
+digest of the recent-context window, so identical opening turns across
+sessions share one reply while ongoing conversations never collide.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '512'))
+CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s.!?,;:…]+$')
+
+
+def normalize_message(text):
+    """Fold case, quotes, whitespace and trailing punctuation"""
+    text = text.replace('’', "'").replace('‘', "'").lower()
+    text = _WHITESPACE.sub(' ', text).strip()
+    return _TRAILING_PUNCTUATION.sub('', text)
+
+
+def context_digest(messages):
+    """Stable digest of a window of {"role", "content"} messages"""
+    digest = hashlib.blake2b(digest_size=16)
+    for msg in messages:
+        digest.update(f"{msg['role']}\x1f{normalize_message(msg['content'])}\x1e".encode())
+    return digest.hexdigest()
+
+
+def cache_key(message, mood, messages):
+    return normalize_message(message), mood or '', context_digest(messages)
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a per-entry time to live"""
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared by every session in the process
+shared_cache = ResponseCache()
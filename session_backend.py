@@ -0,0 +1,163 @@
+"""Session state kept outside the worker process, so any worker can resume a session
+
+Messages and mood logs already live in the conversation store. A session
+backend holds the rest of a session as one small JSON document keyed by
+session id: its settings, the rolling summary of older turns and the turns
+still waiting to be summarized. chat_pipeline saves it after every turn and
+rebuilds the session from both stores on whichever worker sees the session
+id next, so workers can sit behind a load balancer and survive restarts.
+
+SESSION_BACKEND picks the implementation:
+  memory               this process only (tests, a single worker)
+  sqlite               a table next to the conversation store (the default)
+  sqlite:///path.db    a separate SQLite file
+  redis://host:6379/0  Redis or anything speaking its protocol (needs the redis package)
+Documents expire SESSION_TTL seconds after the session's last save.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from conversation_store import DB_PATH
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite')
+SESSION_TTL = float(os.getenv('SESSION_TTL', str(30 * 24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expiry ON sessions (expires_at);
+"""
+
+
+class MemorySessionBackend:
+    """Session documents in a dict, for a single process"""
+
+    def __init__(self, ttl=SESSION_TTL, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            state, expires_at = entry
+            if expires_at <= self.clock():
+                del self._sessions[session_id]
+                return None
+        return json.loads(state)
+
+    def put(self, session_id, state):
+        document = json.dumps(state)
+        with self._lock:
+            self._sessions[session_id] = (document, self.clock() + self.ttl)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionBackend:
+    """Session documents in a SQLite table; every process on the machine shares the file"""
+
+    # Expired rows are swept on every Nth save
+    PURGE_EVERY = 256
+
+    def __init__(self, path=DB_PATH, ttl=SESSION_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+        self._saves = 0
+
+    @property
+    def db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self.db.execute('SELECT state FROM sessions WHERE session_id = ? AND expires_at > ?',
+                              (session_id, self.clock())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, session_id, state):
+        now = self.clock()
+        self._saves += 1
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO sessions (session_id, state, expires_at) VALUES (?, ?, ?)',
+                            (session_id, json.dumps(state), now + self.ttl))
+            if self._saves % self.PURGE_EVERY == 0:
+                self.db.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+
+    def delete(self, session_id):
+        with self.db:
+            self.db.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisSessionBackend:
+    """Session documents as Redis strings with a TTL, kept outside the workers' processes"""
+
+    PREFIX = 'mindfulai:session:'
+
+    def __init__(self, url, ttl=SESSION_TTL, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("SESSION_BACKEND=redis://... needs the redis package (pip install redis)") from None
+            client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.client = client
+
+    def get(self, session_id):
+        document = self.client.get(self.PREFIX + session_id)
+        return json.loads(document) if document is not None else None
+
+    def put(self, session_id, state):
+        self.client.set(self.PREFIX + session_id, json.dumps(state), ex=max(1, int(self.ttl)))
+
+    def delete(self, session_id):
+        self.client.delete(self.PREFIX + session_id)
+
+    def close(self):
+        self.client.close()
+
+
+def open_backend(spec=SESSION_BACKEND, ttl=SESSION_TTL):
+    """The backend named by a SESSION_BACKEND value"""
+    if spec == 'memory':
+        return MemorySessionBackend(ttl)
+    if spec == 'sqlite':
+        return SQLiteSessionBackend(DB_PATH, ttl)
+    if spec.startswith('sqlite:///'):
+        return SQLiteSessionBackend(spec[len('sqlite:///'):], ttl)
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisSessionBackend(spec, ttl)
+    raise ValueError(f"Unknown SESSION_BACKEND {spec!r}; use memory, sqlite, sqlite:///path or redis://host:port/db")
+
+
+# Shared by every session in the process; connections open on first use
+session_backend = open_backend()
@@ -0,0 +1,156 @@
+"""Coalesce identical concurrent model requests into one upstream call
+
+Requests are keyed by API key and the full prompt (system prompt, summary,
+recent turns, mood and message). While a call for a key is in flight, later
+identical requests join it instead of calling Gemini again: every caller
+reads the same chunks as they arrive, so streaming and blocking callers can
+share one flight. The upstream call runs on a small pool so a caller that
+leaves early does not cut the reply short for the others; it is cancelled
+only when every caller has left.
+
+A flight may be gated by an `admit` check, which runs once, on the thread
+of the caller that started the flight and before the upstream call. Callers
+that join meanwhile wait for it, and if it raises, they all get its error.
+Because becoming the leader and registering the flight happen under one
+lock, a request can never skip the check by joining a flight that has just
+ended.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+SINGLE_FLIGHT_WORKERS = int(os.getenv('SINGLE_FLIGHT_WORKERS', '32'))
+
+
+def flight_key(api_key, prompt):
+    """Identity of a request; requests with equal keys get the same reply"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update((api_key or '').encode())
+    digest.update(b'\0')
+    digest.update(prompt.encode())
+    return digest.hexdigest()
+
+
+class Flight:
+    """Chunks of one upstream reply, readable by any number of callers"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.callers = 0
+        self.cancelled = False
+        self.cond = threading.Condition()
+
+
+class SingleFlight:
+    """Shares one in-flight upstream call between callers with the same key"""
+
+    def __init__(self, max_workers=SINGLE_FLIGHT_WORKERS):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='single-flight')
+        self.calls = 0
+        self.joined = 0
+
+    def stream(self, key, start, admit=None):
+        """Yield the chunks of the iterator `start()` returns, starting it only if no flight is running.
+
+        When this call starts the flight it first runs `admit()`, if given,
+        on the caller's thread; an exception from it ends the flight for
+        every caller without calling `start`.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            # A flight everyone has left is being torn down and may be cut short
+            leader = flight is None or flight.cancelled
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.calls += 1
+            else:
+                self.joined += 1
+            with flight.cond:
+                flight.callers += 1
+        if leader:
+            if admit is not None:
+                try:
+                    admit()
+                except Exception as e:
+                    self._finish(key, flight, e)
+                    return self._follow(flight)
+                except BaseException:
+                    # The leader was stopped (a Streamlit rerun); whoever joined must not wait forever
+                    self._finish(key, flight, CancelledError())
+                    raise
+            self._executor.submit(self._pump, key, flight, start)
+        return self._follow(flight)
+
+    def do(self, key, call, admit=None):
+        """Return `call()`'s text, sharing the call with concurrent identical requests"""
+        return ''.join(self.stream(key, lambda: iter([call()]), admit))
+
+    def _pump(self, key, flight, start):
+        try:
+            chunks = start()
+            try:
+                for chunk in chunks:
+                    with flight.cond:
+                        if flight.cancelled:
+                            break
+                        flight.chunks.append(chunk)
+                        flight.cond.notify_all()
+            finally:
+                # Closing the upstream stream cancels its request
+                getattr(chunks, 'close', lambda: None)()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._finish(key, flight, flight.error)
+
+    def _finish(self, key, flight, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.error = error
+            flight.done = True
+            flight.cond.notify_all()
+
+    def _follow(self, flight):
+        index = 0
+        try:
+            while True:
+                with flight.cond:
+                    while index == len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    ready = flight.chunks[index:]
+                    index += len(ready)
+                    if not ready:
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+                yield from ready
+        finally:
+            with flight.cond:
+                flight.callers -= 1
+                if flight.callers == 0 and not flight.done:
+                    flight.cancelled = True
+
+    def running(self, key):
+        """Whether a request with this key would join a flight rather than start one.
+
+        Only a snapshot: the flight may end before the request is made, so
+        gate starting a flight with stream()'s `admit`, not with this.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            return flight is not None and not flight.cancelled
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+# Shared by every session in the process
+flights = SingleFlight()
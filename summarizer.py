@@ -0,0 +1,89 @@
+"""Rolling summary of turns evicted from a session's context window
+
+Summaries are produced on a small background pool after the reply has been
+rendered, so the model call never sits on a user's request path.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+SUMMARY_MAX_WORDS = int(os.getenv('SUMMARY_MAX_WORDS', '120'))
+
+SUMMARY_PROMPT = """You maintain a private running summary of a supportive conversation between a user and MindfulAI, a mental health companion.
+Update the summary with the new turns below. Keep what matters for continuing the conversation: the user's concerns, feelings, context they shared, coping strategies already suggested and how they responded, and any safety concerns.
+Write plain prose in the third person, under {max_words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+
+def build_summary_prompt(summary, turns, max_words=SUMMARY_MAX_WORDS):
+    lines = "\n".join(f"{'User' if role == 'user' else 'MindfulAI'}: {content}" for role, content in turns)
+    return SUMMARY_PROMPT.format(max_words=max_words, summary=summary or "(none yet)", turns=lines)
+
+
+class ConversationSummarizer:
+    """Folds a builder's pending turns into its running summary in the background"""
+
+    def __init__(self, max_workers=2, max_words=SUMMARY_MAX_WORDS):
+        self.max_words = max_words
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='summarizer')
+        self._lock = threading.Lock()
+        self._running = {}
+
+    def schedule(self, builder, generate, on_summary=None):
+        """Start a summary job for `builder` if it has pending turns and none is running.
+
+        `generate` takes a prompt and returns the model's text. The job's turns
+        move to `builder.summarizing` until their summary is in, and
+        `on_summary`, if given, is called on the job's thread once it is.
+        Returns the job's future, or None when there is nothing to do.
+        """
+        with self._lock:
+            if not builder.pending or id(builder) in self._running:
+                return None
+            turns, builder.pending = builder.pending, []
+            builder.summarizing = turns
+            future = self._executor.submit(self._summarize, builder, generate, turns, builder.summary,
+                                           builder.epoch, on_summary)
+            self._running[id(builder)] = future
+        future.add_done_callback(lambda _: self._finished(builder))
+        return future
+
+    def wait(self, builder, timeout=None):
+        """Block until `builder`'s running summary job, if any, has finished"""
+        with self._lock:
+            future = self._running.get(id(builder))
+        if future is not None:
+            wait([future], timeout)
+
+    def _summarize(self, builder, generate, turns, summary, epoch, on_summary=None):
+        try:
+            updated = generate(build_summary_prompt(summary, turns, self.max_words))
+        except Exception:
+            # Keep the turns for the next attempt unless the chat was cleared meanwhile
+            if builder.epoch == epoch:
+                builder.pending[:0] = turns
+                builder.summarizing = []
+            raise
+        if builder.epoch != epoch:
+            return updated
+        if updated and updated.strip():
+            builder.set_summary(updated)
+        builder.summarizing = []
+        if on_summary is not None:
+            on_summary()
+        return updated
+
+    def _finished(self, builder):
+        with self._lock:
+            self._running.pop(id(builder), None)
+
+
+# Shared by every session in the process
+summarizer = ConversationSummarizer()
@@ -0,0 +1,170 @@
+"""Tests for admission control, driven by a fake clock"""
+import threading
+import time
+
+import pytest
+
+from admission import (BUSY, GRANTED, QUEUED, SESSION_LIMIT, AdmissionController, TokenBucket, canned_reply,
+                       quota_ticket)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def controller(clock, **kwargs):
+    settings = dict(session_rpm=60, session_burst=3, session_tpm=600_000, global_rpm=60, global_tpm=6_000_000,
+                    max_wait=5, max_queue=10)
+    settings.update(kwargs)
+    return AdmissionController(clock=clock, **settings)
+
+
+def test_token_bucket_refills_at_rate_up_to_capacity():
+    bucket = TokenBucket(rate=2, capacity=4, now=0)
+    bucket.take(4)
+    assert bucket.wait_time(1, now=0) == 0.5
+    assert bucket.wait_time(1, now=0.5) == 0
+    assert bucket.wait_time(bucket.cost(100), now=100) == 0  # one oversized request only needs a full bucket
+    assert bucket.tokens == 4
+    assert bucket.wait_time(6, now=100) == 1.0  # queued demand beyond capacity waits for the refill
+
+
+def test_session_burst_then_fast_rejection_with_retry_hint():
+    clock = FakeClock()
+    admission = controller(clock)
+    assert [admission.request('spammer', 100).state for _ in range(3)] == [GRANTED] * 3
+    rejected = admission.request('spammer', 100)
+    assert rejected.state == SESSION_LIMIT
+    assert rejected.retry_after == pytest.approx(1.0)
+    # Other sessions are unaffected
+    assert admission.request('someone-else', 100).granted
+    clock.advance(1.0)
+    assert admission.request('spammer', 100).granted
+
+
+def test_session_token_budget_limits_large_prompts():
+    clock = FakeClock()
+    admission = controller(clock, session_tpm=6000)
+    assert admission.request('s', 5000).granted
+    ticket = admission.request('s', 5000)
+    assert ticket.state == SESSION_LIMIT
+    assert ticket.retry_after == pytest.approx(40.0)
+
+
+def test_global_budget_queues_then_grants_as_it_refills():
+    clock = FakeClock()
+    admission = controller(clock, global_rpm=2, max_wait=60)
+    assert admission.request('a', 10).granted
+    assert admission.request('b', 10).granted
+    waiting = admission.request('c', 10)
+    assert waiting.state == QUEUED
+    assert waiting.retry_after == pytest.approx(30.0)
+    clock.advance(29.0)
+    admission.pump()
+    assert waiting.state == QUEUED
+    clock.advance(1.0)
+    admission.pump()
+    assert waiting.granted
+
+
+def test_global_wait_over_max_wait_is_rejected_as_busy():
+    clock = FakeClock()
+    admission = controller(clock, global_rpm=2, max_wait=5)
+    admission.request('a', 10)
+    admission.request('b', 10)
+    # The next request slot is 30 s away
+    ticket = admission.request('c', 10)
+    assert ticket.state == BUSY
+    assert ticket.retry_after == pytest.approx(30.0)
+    assert admission.stats()[BUSY] == 1
+
+
+def test_queue_serves_sessions_round_robin():
+    clock = FakeClock()
+    admission = controller(clock, global_rpm=60, max_wait=10)
+    # One request per second globally, no burst
+    admission._global[0].capacity = admission._global[0].tokens = 1
+    assert admission.request('greedy', 10).granted
+    tickets = [admission.request(name, 10) for name in ('greedy', 'greedy', 'polite', 'quiet')]
+    assert all(ticket.state == QUEUED for ticket in tickets)
+    # Each waiter is told how long the backlog ahead of it takes
+    assert [ticket.retry_after for ticket in tickets] == pytest.approx([1.0, 2.0, 3.0, 4.0])
+    order = []
+    for _ in range(4):
+        clock.advance(1.0)
+        admission.pump()
+        order.extend(ticket.session_id for ticket in tickets if ticket.granted and ticket not in order)
+        order = [t for t in tickets if t.granted and t in order] + [t for t in tickets if t.granted and t not in order]
+    granted = sorted(tickets, key=order.index)
+    assert [t.session_id for t in granted] == ['greedy', 'polite', 'quiet', 'greedy']
+
+
+def test_queued_tickets_expire_and_refund_the_session():
+    clock = FakeClock()
+    admission = controller(clock, global_rpm=60, max_wait=2, session_burst=2)
+    admission._global[0].capacity = 1
+    admission._global[0].tokens = 0
+    ticket = admission.request('s', 10)
+    assert ticket.state == QUEUED
+    clock.advance(0.5)
+    admission._global[0].rate = 0  # the upstream budget stops refilling
+    clock.advance(2.0)
+    admission.pump()
+    assert ticket.state == BUSY
+    # The expired request did not use up the session's burst
+    assert admission._sessions['s'][0].tokens == pytest.approx(2.0)
+
+
+def test_cancel_removes_a_waiting_ticket():
+    clock = FakeClock()
+    admission = controller(clock)
+    admission._global[0].tokens = 0
+    ticket = admission.request('s', 10)
+    assert ticket.state == QUEUED
+    admission.cancel(ticket)
+    assert ticket.state == BUSY
+    assert admission.stats()['waiting'] == 0
+
+
+def test_full_queue_rejects_instead_of_waiting():
+    clock = FakeClock()
+    admission = controller(clock, max_queue=2)
+    admission._global[0].tokens = 0
+    states = [admission.request(f's{i}', 10).state for i in range(3)]
+    assert states == [QUEUED, QUEUED, BUSY]
+
+
+def test_admit_waits_until_a_pump_grants_the_ticket():
+    clock = FakeClock()
+    admission = controller(clock, max_wait=60)
+    request_bucket = admission._global[0]
+    request_bucket.tokens = 0
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(admission.admit('s', 10)))
+    waiter.start()
+    while not admission.stats()['waiting']:
+        time.sleep(0.001)
+    assert not result
+    request_bucket.tokens = 1
+    admission.pump()
+    waiter.join(timeout=5)
+    assert result[0].granted
+
+
+def test_canned_replies_are_friendly_and_never_leak_errors():
+    clock = FakeClock()
+    admission = controller(clock, session_burst=1)
+    admission.request('s', 10)
+    limited = canned_reply(admission.request('s', 10), mood='Anxious')
+    assert 'try again in about 1 second' in limited
+    busy = canned_reply(quota_ticket('s'), mood='Anxious')
+    assert 'try again in about 30 seconds' in busy
+    assert 'breathing' in busy
+    assert 'Error' not in limited + busy
@@ -0,0 +1,101 @@
+"""Tests for the analytics snapshot and vectorized reports against a small store"""
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+import pytest
+
+from analytics import DAY, MOODS, Snapshot, code_sessions, mood_trends, report, response_times, session_report
+from conversation_store import ConversationStore
+
+START = 1_700_000_000.0
+
+
+def seeded_store(path):
+    store = ConversationStore(path)
+    # Session a: two turns answered in 2 s and 4 s; session b: one turn answered in 1 s
+    store.append_message('a', 'user', 'hi', 'Calm', created_at=START)
+    store.append_message('b', 'user', 'hello there', None, created_at=START + 0.5)
+    store.append_message('a', 'assistant', 'Hello! How are you?', 'Calm', created_at=START + 2)
+    store.append_message('b', 'assistant', 'Hi!', None, created_at=START + 1.5)
+    store.append_message('a', 'user', 'tired', 'Tired', created_at=START + 10, flagged=True)
+    store.append_message('a', 'assistant', 'Rest matters.', 'Tired', created_at=START + 14)
+    store.log_mood('a', 'Calm', created_at=START)
+    store.log_mood('a', 'Happy', created_at=START + 60)
+    store.log_mood('a', 'Sad', created_at=START + DAY)
+    return store
+
+
+def test_report_from_a_snapshot():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = seeded_store(os.path.join(tmp, 'chat.db'))
+        snapshot = Snapshot(os.path.join(tmp, 'analytics'))
+        assert snapshot.refresh(store.path) == (6, 3)
+        messages, moods, sessions = snapshot.load()
+        summary = report(messages, moods)
+        assert sorted(sessions) == ['a', 'b']
+        assert summary["messages"] == 6 and summary["sessions"] == 2 and summary["flagged"] == 1
+        assert sorted(response_times(messages)) == pytest.approx([1.0, 2.0, 4.0])
+        assert summary["lengths"]["user"]["count"] == 3
+        assert summary["lengths"]["assistant"]["p50"] == pytest.approx(len('Rest matters.'))
+        assert summary["moods"]["totals"] == {"Happy": 1, "Calm": 1, "Sad": 1, "Anxious": 0, "Frustrated": 0,
+                                              "Tired": 0}
+        assert summary["moods"]["valence"] == [1.5, -1.0]
+        store.close()
+
+
+def test_refresh_only_ingests_new_rows():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = seeded_store(os.path.join(tmp, 'chat.db'))
+        snapshot = Snapshot(os.path.join(tmp, 'analytics'))
+        snapshot.refresh(store.path)
+        assert snapshot.refresh(store.path) == (0, 0)
+        store.append_message('c', 'user', 'new session', 'Anxious', created_at=START + 20)
+        store.log_mood('c', 'Anxious', created_at=START + 20)
+        assert snapshot.refresh(store.path) == (1, 1)
+        messages, moods, sessions = snapshot.load()
+        assert len(messages['id']) == 7 and len(moods['id']) == 4
+        # Session codes stay stable across parts
+        assert sessions[messages['session'][-1]] == 'c'
+        assert len(set(messages['id'].tolist())) == 7
+        store.close()
+
+
+def test_session_report_reads_one_session():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = seeded_store(os.path.join(tmp, 'chat.db'))
+        summary = session_report(store.path, 'b')
+        assert summary["messages"] == 2
+        assert summary["response_seconds"]["p50"] == pytest.approx(1.0)
+        assert summary["moods"]["logs"] == 0
+        store.close()
+
+
+def test_a_session_report_codes_only_its_own_session():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = seeded_store(os.path.join(tmp, 'chat.db'))
+        conn = sqlite3.connect(store.path)
+        sessions = {}
+        code_sessions(conn, sessions, ['b'])
+        assert sessions == {'b': 0}
+        assert conn.execute('SELECT session_id, code FROM temp.session_codes').fetchall() == [('b', 0)]
+        code_sessions(conn, sessions)
+        assert sessions == {'b': 0, 'a': 1}
+        conn.close()
+        store.close()
+
+
+def test_mood_trends_match_a_python_count():
+    rng = np.random.default_rng(0)
+    created = START + rng.uniform(0, 30 * DAY, 10_000)
+    codes = rng.integers(-1, len(MOODS), 10_000).astype(np.int8)
+    trends = mood_trends({'created_at': created, 'mood': codes})
+    expected = {}
+    for at, code in zip(created, codes):
+        if code >= 0:
+            key = (int(at // DAY) * DAY, int(code))
+            expected[key] = expected.get(key, 0) + 1
+    got = {(int(day), code): int(count) for day, row in zip(trends["days"], trends["counts"])
+           for code, count in enumerate(row) if count}
+    assert got == expected
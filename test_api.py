@@ -1,13 +1,17 @@
 """Simple test script to verify Google Gemini API key"""
-import google.generativeai as genai
 from dotenv import load_dotenv
 import os
 
+import cassette
+import gemini_client
+
 # Load environment variables
 load_dotenv()
 
-# Get API key
+# Get API key; a replay-only cassette answers without one
 api_key = os.getenv('GOOGLE_API_KEY')
+if not api_key and gemini_client.CASSETTE and cassette.CASSETTE_MODE == cassette.REPLAY:
+    api_key = 'replay'
 
 if not api_key:
     print("❌ No API key found in .env file")
@@ -15,18 +19,19 @@ if not api_key:
 
 print(f"✓ API Key found: {api_key[:10]}...")
 
-try:
-    # Configure and test
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    
-    print("✓ Model initialized successfully (Gemini 2.5 Flash)")
-    
-    # Test with a simple prompt
-    response = model.generate_content("Say hello in one sentence")
-    print(f"✓ Response received: {response.text}")
-    
-    print("\n✅ API key is working perfectly!")
-    
-except Exception as e:
-    print(f"❌ Error: {str(e)}")
+working = 0
+for model_name in gemini_client.MODELS:
+    try:
+        # Share the app's client layer (pooled transport, deadline, in-flight limit)
+        model = gemini_client.GeminiModel(api_key, model_name)
+        
+        # Test each model the app routes to with a simple prompt
+        response = model.generate_content("Say hello in one sentence")
+        print(f"✓ {model_name}: {response}")
+        working += 1
+        
+    except Exception as e:
+        print(f"❌ {model_name}: {str(e)}")
+
+if working:
+    print(f"\n✅ API key is working perfectly! ({working}/{len(gemini_client.MODELS)} models answered)")
@@ -0,0 +1,207 @@
+"""Tests for the headless chat API against the fake Gemini server"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import api_server
+import gemini_client
+from conversation_store import store
+from fake_gemini import FakeGemini
+
+
+@contextmanager
+def served(reply='I hear you.', api_key=True):
+    """A TestClient for the API, with a fresh key so the model client points at a fresh fake"""
+    saved, base_url = os.environ.pop('GOOGLE_API_KEY', None), gemini_client.runtime.base_url
+    if api_key:
+        os.environ['GOOGLE_API_KEY'] = f"test-{uuid.uuid4().hex}"
+    try:
+        with FakeGemini(reply=reply, chunks=3) as fake:
+            gemini_client.runtime.base_url = fake.url
+            with TestClient(api_server.app) as client:
+                yield fake, client
+    finally:
+        gemini_client.runtime.base_url = base_url
+        os.environ.pop('GOOGLE_API_KEY', None)
+        if saved is not None:
+            os.environ['GOOGLE_API_KEY'] = saved
+
+
+def new_session(client):
+    response = client.post('/v1/sessions')
+    assert response.status_code == 201
+    return response.json()['session_id']
+
+
+def sse_events(text):
+    events = []
+    for block in text.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_json_turn_is_saved_and_uses_the_logged_mood():
+    with served(reply='Breathing slowly can help.') as (fake, client):
+        session_id = new_session(client)
+        assert client.post(f'/v1/sessions/{session_id}/mood', json={'mood': 'Anxious'}).json() == {'mood': 'Anxious'}
+        body = client.post(f'/v1/sessions/{session_id}/chat', json={'message': 'Exams tomorrow'}).json()
+        assert body == {'reply': 'Breathing slowly can help.', 'mood': 'Anxious', 'crisis': False}
+        assert 'Exams tomorrow' in fake.requests[-1]['prompt'] and 'Anxious' in fake.requests[-1]['prompt']
+        history = client.get(f'/v1/sessions/{session_id}/messages').json()['messages']
+        assert [(m['role'], m['content']) for m in history] == [('user', 'Exams tomorrow'),
+                                                                ('assistant', 'Breathing slowly can help.')]
+
+
+def test_bad_requests_are_rejected():
+    with served() as (fake, client):
+        session_id = new_session(client)
+        assert client.post(f'/v1/sessions/{session_id}/mood', json={'mood': 'Elated'}).status_code == 422
+        assert client.post(f'/v1/sessions/{session_id}/chat', json={'message': '  '}).status_code == 422
+        assert client.post(f'/v1/sessions/{session_id}/chat', content=b'{not json').status_code == 400
+        assert not fake.requests
+    with served(api_key=False) as (fake, client):
+        assert client.post('/v1/sessions').status_code == 401
+        assert client.post('/v1/sessions', headers={'X-API-Key': 'client-key'}).status_code == 201
+
+
+def test_history_needs_a_key_and_a_known_session():
+    with served() as (fake, client):
+        session_id = new_session(client)
+        assert client.get(f'/v1/sessions/{session_id}/messages').json()['messages'] == []
+        assert client.get(f'/v1/sessions/{uuid.uuid4().hex}/messages').status_code == 404
+        assert client.get('/v1/sessions/not..a-session/messages').status_code == 404
+        assert client.get(f'/v1/sessions/{session_id}/messages?start=x').status_code == 422
+    with served(api_key=False) as (fake, client):
+        assert client.get(f'/v1/sessions/{session_id}/messages').status_code == 401
+        # A new worker: the pool is empty, but the id was saved when the session was created
+        assert client.get(f'/v1/sessions/{session_id}/messages', headers={'X-API-Key': 'k'}).status_code == 200
+
+
+def test_clients_cannot_choose_their_own_session_id():
+    with served() as (fake, client):
+        chosen = uuid.uuid4().hex
+        assert client.post(f'/v1/sessions/{chosen}/chat', json={'message': 'hello'}).status_code == 404
+        assert client.post(f'/v1/sessions/{chosen}/chat/stream', json={'message': 'hello'}).status_code == 404
+        assert client.post(f'/v1/sessions/{chosen}/mood', json={'mood': 'Calm'}).status_code == 404
+        with pytest.raises(WebSocketDisconnect) as closed:
+            with client.websocket_connect(f'/v1/sessions/{chosen}/ws') as ws:
+                ws.receive_json()
+        assert closed.value.code == 4404
+        assert not fake.requests and store.count_messages(chosen) == 0 and store.count_moods(chosen) == 0
+        # Nothing was created, so the id stays unknown
+        assert client.get(f'/v1/sessions/{chosen}/messages').status_code == 404
+
+
+def test_sse_streams_chunks_then_the_full_reply():
+    with served(reply='One step at a time, together.') as (fake, client):
+        session_id = new_session(client)
+        response = client.post(f'/v1/sessions/{session_id}/chat/stream', json={'message': 'Where do I start?'})
+        assert response.headers['content-type'].startswith('text/event-stream')
+        events = sse_events(response.text)
+        assert [event for event, _ in events] == ['chunk'] * 3 + ['done']
+        assert ''.join(data['text'] for _, data in events[:-1]) == 'One step at a time, together.'
+        assert events[-1][1]['reply'] == 'One step at a time, together.'
+        assert fake.requests[-1]['method'] == 'streamGenerateContent'
+        assert store.count_messages(session_id) == 2
+
+
+def test_crisis_resources_are_sent_before_the_reply():
+    with served() as (fake, client):
+        session_id = new_session(client)
+        body = client.post(f'/v1/sessions/{session_id}/chat', json={'message': 'I want to end my life'}).json()
+        assert body['crisis'] and '988' in body['banner'] and body['resources']
+        response = client.post(f'/v1/sessions/{session_id}/chat/stream', json={'message': 'nobody would miss me'})
+        events = sse_events(response.text)
+        assert events[0][0] == 'crisis' and events[-1][1]['crisis']
+        assert all(m['flagged'] for m in store.tail(session_id))
+
+
+def test_websocket_mood_and_streamed_turn():
+    with served(reply='Rest is important.') as (fake, client):
+        session_id = new_session(client)
+        with client.websocket_connect(f'/v1/sessions/{session_id}/ws') as ws:
+            ws.send_json({'mood': 'Tired'})
+            assert ws.receive_json() == {'type': 'mood', 'mood': 'Tired'}
+            ws.send_json({'mood': 'Sleepy'})
+            assert ws.receive_json()['type'] == 'error'
+            ws.send_json({'message': 'I slept badly'})
+            frames = [ws.receive_json() for _ in range(4)]
+        assert [frame['type'] for frame in frames] == ['chunk', 'chunk', 'chunk', 'done']
+        assert frames[-1]['reply'] == 'Rest is important.' and frames[-1]['mood'] == 'Tired'
+
+
+def test_another_worker_resumes_the_session_from_the_store():
+    with served() as (fake, client):
+        session_id = new_session(client)
+        client.post(f'/v1/sessions/{session_id}/mood', json={'mood': 'Calm'})
+        client.post(f'/v1/sessions/{session_id}/chat', json={'message': 'My cat is called Miso'})
+        # A different worker process has none of this session in memory
+        api_server.sessions, first_worker = api_server.SessionPool(), api_server.sessions
+        try:
+            body = client.post(f'/v1/sessions/{session_id}/chat', json={'message': 'What is her name?'}).json()
+        finally:
+            api_server.sessions.clear()
+            api_server.sessions = first_worker
+        assert body['mood'] == 'Calm'
+        assert 'My cat is called Miso' in fake.requests[-1]['prompt']
+        assert store.count_messages(session_id) == 4
+
+
+def test_session_pool_evicts_least_recently_used():
+    pool = api_server.SessionPool(capacity=2)
+    first, second = pool.create('key'), pool.create('key')
+    assert pool.get(first.session_id, 'key') is first
+    pool.create('key')
+    assert len(pool) == 2
+    assert pool.get(second.session_id, 'key') is not second
+    pool.clear()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_turns_spread_across_worker_processes():
+    with FakeGemini(reply='Still here.') as fake, tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(os.environ, GEMINI_API_BASE=fake.url, GOOGLE_API_KEY='workers',
+                   CHAT_DB_PATH=os.path.join(tmp, 'workers.db'), METRICS_PORT='0')
+        server = subprocess.Popen([sys.executable, 'api_server.py', '--port', str(port), '--workers', '2'],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+        base = f'http://127.0.0.1:{port}'
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    httpx.get(f'{base}/healthz')
+                    break
+                except httpx.TransportError:
+                    assert time.monotonic() < deadline and server.poll() is None
+                    time.sleep(0.1)
+            session_ids = [httpx.post(f'{base}/v1/sessions').json()['session_id'] for _ in range(4)]
+            # New connections each time, so the kernel hands requests to either worker
+            for turn in range(2):
+                for session_id in session_ids:
+                    reply = httpx.post(f'{base}/v1/sessions/{session_id}/chat',
+                                       json={'message': f'turn {turn} of {session_id}'}).json()['reply']
+                    assert reply == 'Still here.'
+            for session_id in session_ids:
+                messages = httpx.get(f'{base}/v1/sessions/{session_id}/messages').json()['messages']
+                assert [m['content'] for m in messages[::2]] == [f'turn {t} of {session_id}' for t in range(2)]
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
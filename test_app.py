@@ -0,0 +1,99 @@
+"""Streamlit AppTest runs of the chat page's history: paging and its render cache"""
+from unittest import mock
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import gemini_client
+from chat_pipeline import new_session_id
+from conversation_store import MEMORY_TAIL, store
+from fake_gemini import FakeGemini
+
+PAGE = 4
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """The chat page with a short history page, answering from the fake server"""
+    monkeypatch.setenv('GOOGLE_API_KEY', 'app-test-key')
+    monkeypatch.setenv('HISTORY_PAGE_SIZE', str(PAGE))
+    monkeypatch.setenv('RESPONSE_CACHE', 'false')
+    with FakeGemini(reply=lambda model, prompt: 'Breathe slowly.') as fake, \
+            mock.patch.object(gemini_client.runtime, 'base_url', fake.url):
+        yield AppTest.from_file('app.py', default_timeout=60)
+
+
+def seeded_session(count):
+    session_id = new_session_id()
+    for i in range(count):
+        store.append_message(session_id, 'user' if i % 2 == 0 else 'assistant', f'old message {i}',
+                             created_at=1_000.0 + i)
+    return session_id
+
+
+def older_button(at):
+    return next((button for button in at.button if button.label.startswith('⬆️ Show older')), None)
+
+
+def show_all_older(at):
+    while (button := older_button(at)) is not None:
+        button.click().run()
+
+
+def pages(at):
+    return {expander.label: expander.markdown[0].value for expander in at.expander
+            if expander.label.startswith('Messages ')}
+
+
+def test_older_history_pages_in_from_the_store(app):
+    total = MEMORY_TAIL + 10
+    app.query_params['session'] = seeded_session(total)
+    app.run()
+    assert not app.exception
+    assert older_button(app).label == f'⬆️ Show older messages ({total - PAGE} more)'
+    assert pages(app) == {}
+
+    older_button(app).click().run()
+    assert list(pages(app)) == [f'Messages {total - 2 * PAGE + 1}–{total - PAGE}']
+    show_all_older(app)
+    shown = pages(app)
+    assert len(shown) == (total - PAGE) // PAGE
+    # The first messages are long gone from the in-memory tail but still page in
+    assert len(app.session_state['messages']) == MEMORY_TAIL
+    assert '**You:** old message 0' in shown['Messages 1–4']
+    assert '**🧠 MindfulAI:** old message 3' in shown['Messages 1–4']
+
+
+def test_a_new_message_moves_into_the_paged_history(app):
+    app.query_params['session'] = seeded_session(2 * PAGE)
+    app.run()
+    show_all_older(app)
+    assert list(pages(app)) == ['Messages 1–4']
+
+    app.chat_input[0].set_value('I feel restless').run()
+    assert not app.exception
+    # History is drawn before the turn runs, so the next rerun shows where the turn left it
+    app.run()
+    shown = pages(app)
+    # Messages 5-6 were on screen as bubbles and now page in, read fresh from the store;
+    # one page of older messages is still shown, so the first two go back behind the button
+    assert list(shown) == ['Messages 3–4', 'Messages 5–6']
+    assert 'old message 4' in shown['Messages 5–6'] and 'old message 5' in shown['Messages 5–6']
+    assert 'old message 2' in shown['Messages 3–4'] and 'old message 1' not in shown['Messages 3–4']
+    assert older_button(app).label == '⬆️ Show older messages (2 more)'
+
+
+def test_clearing_the_chat_drops_cached_pages(app):
+    app.query_params['session'] = seeded_session(2 * PAGE)
+    app.run()
+    show_all_older(app)
+    assert 'old message 0' in pages(app)['Messages 1–4']
+
+    next(button for button in app.button if 'Clear Chat History' in button.label).click().run()
+    assert pages(app) == {} and older_button(app) is None
+    for text in ('new one', 'new two', 'new three', 'new four'):
+        app.chat_input[0].set_value(text).run()
+    show_all_older(app)
+    # Same session and positions as the page cached before the clear, so only the epoch tells them apart
+    first = pages(app)['Messages 1–4']
+    assert 'new one' in first and 'old message' not in first
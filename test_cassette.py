@@ -0,0 +1,120 @@
+"""Tests for recording Gemini calls to a cassette and replaying them without the server"""
+import gzip
+import itertools
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+from cassette import AUTO, RECORD, REPLAY, Cassette, request_key
+from fake_gemini import FakeGemini
+from gemini_client import GeminiError, GeminiRuntime
+from resilience import INVALID, classify
+
+
+def record(path, fake, *prompts, stream=False):
+    runtime = GeminiRuntime(base_url=fake.url, cassette=Cassette(path, RECORD))
+    replies = [list(runtime.stream('secret-key', 'gemini-2.5-flash', prompt)) if stream
+               else runtime.generate('secret-key', 'gemini-2.5-flash', prompt) for prompt in prompts]
+    runtime.close()
+    return replies
+
+
+def test_replay_serves_recorded_replies_and_chunks_without_the_server():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'calls.jsonl.gz')
+        with FakeGemini(reply='Breathe in slowly, then out.', chunks=4) as fake:
+            recorded = record(path, fake, 'hi') + record(path, fake, 'hi', stream=True)
+            url = fake.url
+        runtime = GeminiRuntime(base_url=url, cassette=Cassette(path, REPLAY))
+        assert runtime.generate('another-key', 'gemini-2.5-flash', 'hi') == recorded[0]
+        assert list(runtime.stream('another-key', 'gemini-2.5-flash', 'hi')) == recorded[1]
+        assert len(recorded[1]) == 4
+        runtime.close()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            assert 'secret-key' not in f.read()
+
+
+def test_unknown_requests_fail_in_replay_and_are_recorded_in_auto_mode():
+    with tempfile.TemporaryDirectory() as tmp, FakeGemini(reply='Hello') as fake:
+        path = os.path.join(tmp, 'calls.jsonl')
+        runtime = GeminiRuntime(base_url=fake.url, cassette=Cassette(path, REPLAY))
+        with pytest.raises(GeminiError) as error:
+            runtime.generate('key', 'gemini-2.5-flash', 'never recorded')
+        assert error.value.status == 404 and classify(error.value) == INVALID
+        assert not fake.requests
+        runtime.close()
+
+        cassette = Cassette(path, AUTO)
+        runtime = GeminiRuntime(base_url=fake.url, cassette=cassette)
+        for _ in range(3):
+            assert runtime.generate('key', 'gemini-2.5-flash', 'first time') == 'Hello'
+        assert len(fake.requests) == 1
+        assert cassette.stats() == {"mode": AUTO, "recordings": 1, "hits": 2, "misses": 1, "recorded": 1}
+        runtime.close()
+
+
+def test_replay_can_reproduce_the_recorded_timing():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'calls.jsonl')
+        with FakeGemini(reply='Take your time.', latency=0.2) as fake:
+            record(path, fake, 'slow')
+            url = fake.url
+        for speed, low, high in ((1.0, 0.18, 1.0), (0.0, 0.0, 0.1)):
+            runtime = GeminiRuntime(base_url=url, cassette=Cassette(path, REPLAY, speed=speed))
+            start = time.perf_counter()
+            runtime.generate('key', 'gemini-2.5-flash', 'slow')
+            assert low <= time.perf_counter() - start < high, speed
+            runtime.close()
+
+
+def test_errors_and_repeated_requests_replay_in_recorded_order():
+    counter = itertools.count(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'calls.jsonl')
+        with FakeGemini(reply=lambda model, prompt: f"reply {next(counter)}") as fake:
+            fake.inject(429)
+            with pytest.raises(GeminiError):
+                record(path, fake, 'busy')
+            record(path, fake, 'again', 'again')
+            url = fake.url
+        runtime = GeminiRuntime(base_url=url, cassette=Cassette(path, REPLAY))
+        with pytest.raises(GeminiError) as error:
+            runtime.generate('key', 'gemini-2.5-flash', 'busy')
+        assert error.value.status == 429
+        assert [runtime.generate('key', 'gemini-2.5-flash', 'again') for _ in range(3)] == \
+               ['reply 1', 'reply 2', 'reply 1']
+        runtime.close()
+
+
+def test_auto_mode_asks_again_after_an_error_instead_of_replaying_it():
+    with tempfile.TemporaryDirectory() as tmp, FakeGemini(reply='Hello') as fake:
+        path = os.path.join(tmp, 'calls.jsonl')
+        # An error captured on purpose in record mode, then one hit in auto mode
+        fake.inject(503)
+        with pytest.raises(GeminiError):
+            record(path, fake, 'busy')
+        cassette = Cassette(path, AUTO)
+        assert len(cassette) == 0
+        runtime = GeminiRuntime(base_url=fake.url, cassette=cassette)
+        fake.inject(429)
+        with pytest.raises(GeminiError) as error:
+            runtime.generate('key', 'gemini-2.5-flash', 'busy')
+        assert error.value.status == 429 and cassette.recorded == 0
+        assert runtime.generate('key', 'gemini-2.5-flash', 'busy') == 'Hello'
+        assert runtime.generate('key', 'gemini-2.5-flash', 'busy') == 'Hello'
+        assert len(fake.requests) == 3 and cassette.stats()["recorded"] == 1
+        runtime.close()
+        with open(path, encoding='utf-8') as f:
+            assert [json.loads(line)['status'] for line in f] == [503, 200]
+
+
+def test_request_key_ignores_host_api_key_and_json_layout():
+    body = b'{"contents": [{"role": "user", "parts": [{"text": "hi"}]}]}'
+    relaid = b'{"contents":[{"parts":[{"text":"hi"}],"role":"user"}]}'
+    key = request_key('POST', '/v1beta/models/gemini-2.5-flash:generateContent', {}, body)
+    assert key == request_key('POST', '/proxy/v1beta/models/gemini-2.5-flash:generateContent', {'key': 'x'}, relaid)
+    assert key != request_key('POST', '/v1beta/models/gemini-2.0-flash-exp:generateContent', {}, body)
+    assert key != request_key('POST', '/v1beta/models/gemini-2.5-flash:generateContent', {'alt': 'sse'}, body)
@@ -0,0 +1,83 @@
+"""Tests for the token-budgeted context window"""
+from unittest import mock
+
+import chat_pipeline
+from chat_pipeline import ChatSession, finish_turn, get_bot_response, start_turn
+from context_builder import ContextBuilder, estimate_tokens
+
+
+class RecordingModel:
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False, timeout=None):
+        self.prompts.append(prompt)
+        return 'summary' if prompt.startswith('You maintain') else 'I hear you.'
+
+
+def turn_line(role, content):
+    return f"{'User' if role == 'user' else 'MindfulAI'}: {content}\n"
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('I am ok.') == 4
+    assert estimate_tokens('overwhelmed') == 3
+
+
+def test_the_budget_evicts_the_oldest_turns_into_pending():
+    builder = ContextBuilder('System.', budget=30)
+    turns = [('user' if i % 2 == 0 else 'assistant', f'turn number {i} of the chat') for i in range(8)]
+    for role, content in turns:
+        builder.add(role, content)
+    kept = len(builder)
+    assert builder.pending == turns[:-kept] and builder.dropped == len(turns) - kept
+    assert builder.messages() == [{"role": role, "content": content} for role, content in turns[-kept:]]
+    assert builder.window_tokens == sum(estimate_tokens(turn_line(*turn)) for turn in turns[-kept:]) <= 30
+    prompt = builder.build('hello')
+    assert turns[0][1] not in prompt and turns[-1][1] in prompt
+
+
+def test_the_newest_turn_is_kept_even_over_budget():
+    builder = ContextBuilder('System.', budget=5)
+    builder.add('user', 'short')
+    builder.add('assistant', 'a much longer reply than the whole budget allows')
+    assert len(builder) == 1 and builder.pending == [('user', 'short')]
+
+
+def test_prompt_tokens_matches_the_estimate_of_build():
+    builder = ContextBuilder('You are MindfulAI, a caring companion.', budget=60)
+    for i in range(10):
+        builder.add('user' if i % 2 == 0 else 'assistant', f'message {i}, about sleep and stress')
+    for mood in (None, 'Anxious'):
+        assert builder.prompt_tokens('How do I rest?', mood) == estimate_tokens(builder.build('How do I rest?', mood))
+    builder.set_summary('User sleeps badly before exams.')
+    assert builder.prompt_tokens('How do I rest?') == estimate_tokens(builder.build('How do I rest?'))
+
+
+def test_clear_empties_the_window_and_bumps_the_epoch():
+    builder = ContextBuilder('System.', budget=10)
+    for i in range(5):
+        builder.add('user', f'turn {i} text')
+    builder.set_summary('Earlier.')
+    epoch = builder.epoch
+    builder.clear()
+    assert (len(builder), builder.pending, builder.summary, builder.window_tokens) == (0, [], '', 0)
+    assert builder.epoch == epoch + 1 and 'Earlier.' not in builder.build('hi')
+
+
+def test_the_new_message_appears_once_in_each_prompt():
+    model = RecordingModel()
+    state = ChatSession('context-key')
+    with mock.patch.object(chat_pipeline, 'get_model', lambda state: model):
+        for text in ('I feel tense today', 'Still tense', 'I feel tense today'):
+            question, _ = start_turn(state, text, 'Anxious')
+            response = get_bot_response(state, text, 'Anxious', use_cache=False)
+            finish_turn(state, question, response, 'Anxious')
+    prompts = [prompt for prompt in model.prompts if not prompt.startswith('You maintain')]
+    assert len(prompts) == 3
+    assert prompts[0].count('User: I feel tense today') == 1
+    assert prompts[1].count('User: Still tense') == 1
+    # The same words again: once from the earlier turn in the window, once as the new message
+    assert prompts[2].count('User: I feel tense today') == 2
+    assert all(prompt.endswith('\nMindfulAI:') for prompt in prompts)
@@ -0,0 +1,122 @@
+"""Tests for the SQLite conversation store: tails, slices, batches and the schema migration"""
+import sqlite3
+
+import pytest
+
+from conversation_store import ConversationStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ConversationStore(str(tmp_path / 'chat.db'))
+    yield store
+    store.close()
+
+
+def fill(store, session_id, count, start=1.0):
+    for i in range(count):
+        store.append_message(session_id, 'user' if i % 2 == 0 else 'assistant', f'm{i}', created_at=start + i)
+
+
+def contents(messages):
+    return [message["content"] for message in messages]
+
+
+def test_tail_is_the_newest_messages_oldest_first(store):
+    fill(store, 'a', 10)
+    fill(store, 'b', 3)
+    assert contents(store.tail('a', 4)) == ['m6', 'm7', 'm8', 'm9']
+    assert contents(store.tail('a', 50)) == [f'm{i}' for i in range(10)]
+    assert store.tail('a', 0) == [] and store.tail('missing') == []
+    assert store.tail('a', 1) == [{"role": 'assistant', "content": 'm9', "mood": None, "time": 10.0,
+                                   "flagged": False}]
+
+
+def test_messages_with_equal_timestamps_keep_their_insert_order(store):
+    for text in ('first', 'second', 'third'):
+        store.append_message('a', 'user', text, created_at=5.0)
+    store.append_message('a', 'user', 'earlier', created_at=4.0)
+    assert contents(store.tail('a')) == ['earlier', 'first', 'second', 'third']
+    assert contents(store.tail('a', 2)) == ['second', 'third']
+    assert contents(store.slice('a', 1, 3)) == ['first', 'second']
+    assert contents(store.iter_messages('a', batch_size=2)) == ['earlier', 'first', 'second', 'third']
+
+
+def test_mood_tail_orders_ties_by_insert(store):
+    for mood in ('Calm', 'Tired', 'Anxious'):
+        store.log_mood('a', mood, created_at=7.0)
+    store.log_mood('a', 'Happy', created_at=8.0)
+    assert store.mood_tail('a', 3) == [('Tired', 7.0), ('Anxious', 7.0), ('Happy', 8.0)]
+    assert store.count_moods('a') == 4 and store.mood_tail('b') == []
+
+
+def test_slice_bounds(store):
+    fill(store, 'a', 5)
+    assert contents(store.slice('a', 0, 2)) == ['m0', 'm1']
+    assert contents(store.slice('a', 3, 99)) == ['m3', 'm4']
+    assert store.slice('a', 5, 10) == [] and store.slice('a', 2, 2) == []
+    # A reversed range is empty, not an error
+    assert store.slice('a', 4, 1) == []
+
+
+def test_row_batches_resume_after_an_id_and_cover_every_session(store):
+    fill(store, 'a', 5)
+    fill(store, 'b', 2)
+    batches = list(store.row_batches('a', batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    rows = [row for batch in batches for row in batch]
+    assert [row[4] for row in rows] == contents(store.iter_messages('a'))
+    after = rows[2][0]
+    assert [row[4] for batch in store.row_batches('a', after_id=after) for row in batch] == ['m3', 'm4']
+    everything = [row for batch in store.row_batches() for row in batch]
+    assert len(everything) == 7 and [row[0] for row in everything] == sorted(row[0] for row in everything)
+    assert list(store.row_batches('a', after_id=everything[-1][0])) == []
+
+
+def test_count_through_notices_deleted_rows(store):
+    fill(store, 'a', 3)
+    fill(store, 'b', 2)
+    last_a = [row for batch in store.row_batches('a') for row in batch][-1][0]
+    last = [row for batch in store.row_batches() for row in batch][-1][0]
+    assert store.count_through('a', last_a) == 3 and store.count_through(None, last) == 5
+    store.clear_messages('a')
+    assert store.count_through('a', last_a) == 0 and store.count_through(None, last) == 2
+    # Rows added after the delete have higher ids, so they are not counted
+    fill(store, 'a', 1, start=100.0)
+    assert store.count_through('a', last_a) == 0 and store.count_messages('a') == 1
+
+
+def test_clear_messages_leaves_other_sessions_and_moods(store):
+    fill(store, 'a', 3)
+    fill(store, 'b', 2)
+    store.log_mood('a', 'Calm')
+    store.clear_messages('a')
+    assert store.count_messages('a') == 0 and store.tail('a') == []
+    assert contents(store.tail('b')) == ['m0', 'm1'] and store.count_moods('a') == 1
+    assert store.session_ids() == ['b']
+
+
+def test_flags_round_trip(store):
+    store.append_message('a', 'user', 'I want to die', created_at=1.0, flagged=True)
+    store.append_message('a', 'assistant', 'You are not alone.', created_at=2.0)
+    assert [m["flagged"] for m in store.tail('a')] == [True, False]
+    assert [m["flagged"] for m in store.slice('a', 0, 2)] == [True, False]
+
+
+def test_databases_from_before_flags_gain_the_column(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE messages (id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, created_at REAL NOT NULL,
+                               role TEXT NOT NULL, content TEXT NOT NULL, mood TEXT);
+        INSERT INTO messages (session_id, created_at, role, content, mood) VALUES ('a', 1.0, 'user', 'old', 'Calm');
+    """)
+    conn.close()
+    store = ConversationStore(path)
+    try:
+        assert store.tail('a') == [{"role": 'user', "content": 'old', "mood": 'Calm', "time": 1.0,
+                                    "flagged": False}]
+        store.append_message('a', 'user', 'new', created_at=2.0, flagged=True)
+        assert [m["flagged"] for m in store.tail('a')] == [False, True]
+    finally:
+        store.close()
@@ -0,0 +1,93 @@
+"""Tests for the local crisis-phrase detector"""
+import random
+import re
+
+import pytest
+
+from crisis_detector import CRISIS_PHRASES, CrisisDetector, detector, phrase_units, trie_pattern
+
+
+@pytest.mark.parametrize('text', [
+    "I want to end my life",
+    "i've been thinking about suicide",
+    "Sometimes I feel suicidal.",
+    "I wish I was dead",
+    "I don't want to live anymore",
+    "I dont want to live anymore",
+    "I don’t want to live anymore",
+    "I keep hurting myself",
+    "I used to cut myself",
+    "I thought about hanging myself",
+    "I overdosed last year",
+    "what if I overdose",
+    "I've been self harming again",
+    "self-harm",
+    "selfharm",
+    "self   harm",
+    "Nobody would miss me.",
+    "(kill myself)",
+])
+def test_crisis_phrases_and_their_inflections_are_caught(text):
+    assert detector.match(text)
+
+
+@pytest.mark.parametrize('text', [
+    # Figures of speech that share words with crisis phrases
+    "This exam is killing me",
+    "I'm dying to see that movie",
+    "My feet are killing me after that hike",
+    "I could die of embarrassment",
+    "That joke killed me",
+    # Crisis words inside longer words
+    "The skill myself and others need",
+    "We talked about the overdosage label on the bottle",
+    "",
+])
+def test_ordinary_messages_are_not_flagged(text):
+    assert detector.match(text) is None
+
+
+def test_figures_of_speech_with_a_whole_crisis_phrase_are_flagged_on_purpose():
+    # Showing resources to someone who did not need them costs little; missing one who did does not
+    assert detector.match("Ugh, I could kill myself for forgetting her birthday") == "kill myself"
+
+
+def test_case_spacing_and_unicode_are_normalized():
+    assert detector.match("I WANT TO DIE") == "want to die"
+    assert detector.match("I Want\tTo\nDie") == "want\tto\ndie"
+    # A no-break space, as phones insert after autocorrect
+    assert detector.match("kill\u00a0myself") == "kill\u00a0myself"
+    assert detector.match("I can’t go on") == "can’t go on"
+    assert detector.match("Désolé… I WANT TO DIE 💔") == "want to die"
+
+
+def test_find_all_returns_every_phrase_in_order():
+    assert detector.find_all("I want to die. I keep hurting myself. no way out") == [
+        "want to die", "hurting myself", "no way out"]
+
+
+def test_longer_phrases_win_over_their_prefixes():
+    assert CrisisDetector(["self harm", "self harming"]).match("self harming") == "self harming"
+    assert CrisisDetector(["suicide", "suicidal"]).match("suicidal") == "suicidal"
+
+
+def test_trie_pattern_agrees_with_one_regex_per_phrase():
+    reference = [re.compile(r"\b" + ''.join(phrase_units(phrase)) + r"\b") for phrase in CRISIS_PHRASES]
+    trie = re.compile(r"\b" + trie_pattern(phrase_units(phrase) for phrase in CRISIS_PHRASES) + r"\b")
+    words = "i feel tired and my mind keeps racing but friends say rest helps myself dead live".split()
+    rng = random.Random(13)
+    for _ in range(3000):
+        message = rng.choices(words, k=rng.randint(1, 20))
+        if rng.random() < 0.3:
+            message.insert(rng.randrange(len(message) + 1), rng.choice(CRISIS_PHRASES))
+        text = ' '.join(message)
+        assert bool(trie.search(text)) == any(pattern.search(text) for pattern in reference), text
+
+
+def test_trie_agrees_with_a_substring_scan_on_whole_word_phrases():
+    # The plain `phrase in text` check the benchmark compares against, on text where it cannot misfire
+    lowered = [phrase.lower() for phrase in CRISIS_PHRASES]
+    for phrase in CRISIS_PHRASES:
+        for text in (phrase, f"honestly {phrase} today", phrase.upper()):
+            assert detector.match(text) is not None
+            assert any(candidate in text.lower() for candidate in lowered)
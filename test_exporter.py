@@ -0,0 +1,158 @@
+"""Tests for background, incremental conversation export"""
+import gzip
+import json
+import os
+import tempfile
+import threading
+
+import pytest
+
+from conversation_store import ConversationStore
+from exporter import Exporter
+
+
+def read_lines(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def chat(store, session_id, count, start=0):
+    for i in range(start, start + count):
+        store.append_message(session_id, 'user' if i % 2 == 0 else 'assistant', f"message {i} 💙", 'Calm')
+
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'jsonl.gz'])
+def test_later_exports_append_only_new_messages(fmt):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ConversationStore(os.path.join(tmp, 'chat.db'))
+        exporter = Exporter(store, os.path.join(tmp, 'exports'), fmt)
+        chat(store, 'a', 4)
+        chat(store, 'b', 3)
+        first = exporter.export('a')
+        assert (first["written"], first["messages"], first["rewritten"]) == (4, 4, True)
+        chat(store, 'a', 2, start=4)
+        second = exporter.export('a')
+        assert (second["written"], second["messages"], second["rewritten"]) == (2, 6, False)
+        assert exporter.export('a')["written"] == 0
+        lines = read_lines(second["path"])
+        assert [line["content"] for line in lines] == [f"message {i} 💙" for i in range(6)]
+        assert lines[0]["role"] == 'user' and lines[0]["mood"] == 'Calm' and lines[0]["flagged"] is False
+        assert sorted(os.listdir(os.path.join(tmp, 'exports'))) == [f".chat_a.{fmt}.state", f"chat_a.{fmt}"]
+
+
+def test_clearing_the_chat_or_a_stale_state_rewrites_the_export():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ConversationStore(os.path.join(tmp, 'chat.db'))
+        exporter = Exporter(store, tmp, 'jsonl.gz')
+        chat(store, 'a', 3)
+        path = exporter.export('a')["path"]
+        store.clear_messages('a')
+        chat(store, 'a', 1, start=10)
+        assert exporter.export('a')["rewritten"]
+        assert [line["content"] for line in read_lines(path)] == ["message 10 💙"]
+        # The export changed behind the exporter's back, e.g. restored from a backup
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(b''))
+        chat(store, 'a', 1, start=11)
+        result = exporter.export('a')
+        assert result["rewritten"] and result["messages"] == 2
+
+
+def test_incremental_saves_append_in_place_and_a_torn_append_is_rewritten():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ConversationStore(os.path.join(tmp, 'chat.db'))
+        exporter = Exporter(store, tmp, 'jsonl')
+        chat(store, 'a', 3)
+        path = exporter.export('a')["path"]
+        inode = os.stat(path).st_ino
+        chat(store, 'a', 2, start=3)
+        assert not exporter.export('a')["rewritten"]
+        # The same file grew; it was not copied and swapped
+        assert os.stat(path).st_ino == inode and not os.path.exists(path + '.tmp')
+        # A crash halfway through an append, before the state was saved
+        with open(path, 'ab') as f:
+            f.write(b'{"id":99,"ti')
+        chat(store, 'a', 1, start=5)
+        result = exporter.export('a')
+        assert result["rewritten"] and [line["content"] for line in read_lines(path)] == \
+            [f"message {i} 💙" for i in range(6)]
+
+
+def test_finished_exports_leave_no_locks_or_queue_entries_behind():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ConversationStore(os.path.join(tmp, 'chat.db'))
+        exporter = Exporter(store, tmp, 'jsonl', workers=4)
+        for session in range(20):
+            chat(store, f"s{session}", 2)
+        assert len(exporter.export_many(store.session_ids())) == 20
+        exporter.export('s0')
+        exporter.close()
+        assert exporter._path_locks == {} and exporter._queued == {}
+
+
+def test_bulk_export_of_every_session_and_one_file_each():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ConversationStore(os.path.join(tmp, 'chat.db'))
+        exporter = Exporter(store, tmp, 'jsonl', workers=4)
+        for session in range(5):
+            chat(store, f"s{session}", session + 1)
+        combined = exporter.export()
+        lines = read_lines(combined["path"])
+        assert combined["path"].endswith('all_sessions.jsonl') and len(lines) == 15
+        assert [line["id"] for line in lines] == sorted(line["id"] for line in lines)
+        assert {line["session_id"] for line in lines} == {f"s{session}" for session in range(5)}
+        results = exporter.export_many(store.session_ids())
+        assert sorted(result["messages"] for result in results) == [1, 2, 3, 4, 5]
+        chat(store, 's0', 1, start=1)
+        assert exporter.export()["written"] == 1
+        exporter.close()
+
+
+def test_legacy_json_array_is_rewritten_in_full():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ConversationStore(os.path.join(tmp, 'chat.db'))
+        exporter = Exporter(store, tmp, 'json')
+        chat(store, 'a', 2)
+        exporter.export('a')
+        chat(store, 'a', 1, start=2)
+        result = exporter.export('a')
+        with open(result["path"], encoding='utf-8') as f:
+            assert json.load(f) == [{"role": "user", "content": "message 0 💙"},
+                                    {"role": "assistant", "content": "message 1 💙"},
+                                    {"role": "user", "content": "message 2 💙"}]
+        assert result["written"] == 3 and not os.path.exists(result["path"] + '.tmp')
+
+
+class SlowStore(ConversationStore):
+    """Holds the first export's read until released"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.release = threading.Event()
+
+    def row_batches(self, *args):
+        self.release.wait(5)
+        return super().row_batches(*args)
+
+
+def test_background_saves_do_not_block_and_queued_ones_coalesce():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SlowStore(os.path.join(tmp, 'chat.db'))
+        exporter = Exporter(store, tmp, 'jsonl', workers=1)
+        chat(store, 'a', 2)
+        running = exporter.submit('a')
+        while not running.running():
+            pass
+        # The running save may have read already, so a new one queues; later clicks join it
+        queued = exporter.submit('a')
+        assert queued is not running and exporter.submit('a') is queued
+        chat(store, 'a', 1, start=2)
+        store.release.set()
+        assert running.result(5)["written"] + queued.result(5)["written"] == 3
+        exporter.close()
+
+
+def test_unknown_format_is_refused():
+    with pytest.raises(ValueError, match="jsonl, jsonl.gz, json"):
+        Exporter(fmt='csv')
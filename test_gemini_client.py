@@ -0,0 +1,107 @@
+"""Tests for the async Gemini client against the local fake server"""
+import threading
+import time
+
+import pytest
+
+from fake_gemini import FakeGemini
+from gemini_client import GeminiError, GeminiRuntime, GeminiTimeout
+
+
+def run_with(fake, **kwargs):
+    return GeminiRuntime(base_url=fake.url, **kwargs)
+
+
+def test_generate_returns_reply_text():
+    with FakeGemini(reply="You're not alone.") as fake:
+        runtime = run_with(fake)
+        assert runtime.generate('key', 'gemini-2.0-flash-exp', 'hi') == "You're not alone."
+        assert fake.requests[0] == {'model': 'gemini-2.0-flash-exp', 'method': 'generateContent', 'prompt': 'hi'}
+        runtime.close()
+
+
+def test_stream_yields_chunks_in_order():
+    with FakeGemini(reply='Breathe in slowly, then out.', chunks=4) as fake:
+        runtime = run_with(fake)
+        chunks = list(runtime.stream('key', 'gemini-2.0-flash-exp', 'hi'))
+        assert len(chunks) == 4
+        assert ''.join(chunks) == 'Breathe in slowly, then out.'
+        runtime.close()
+
+
+def test_sequential_requests_reuse_one_connection():
+    with FakeGemini() as fake:
+        runtime = run_with(fake)
+        for _ in range(5):
+            runtime.generate('key', 'gemini-2.0-flash-exp', 'hi')
+        list(runtime.stream('key', 'gemini-2.0-flash-exp', 'hi'))
+        assert len(fake.connections) == 1
+        runtime.close()
+
+
+def test_in_flight_requests_are_capped():
+    with FakeGemini(latency=0.1) as fake:
+        runtime = run_with(fake, max_in_flight=2)
+        threads = [threading.Thread(target=runtime.generate, args=(f'key-{i % 2}', 'm', 'hi'))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(fake.requests) == 8
+        assert fake.max_in_flight == 2
+        runtime.close()
+
+
+def test_deadline_raises_timeout():
+    with FakeGemini(latency=1.0) as fake:
+        runtime = run_with(fake)
+        start = time.perf_counter()
+        with pytest.raises(GeminiTimeout):
+            runtime.generate('key', 'm', 'hi', timeout=0.1)
+        assert time.perf_counter() - start < 0.5
+        runtime.close()
+
+
+def test_closing_stream_cancels_and_frees_the_slot():
+    with FakeGemini(reply='a' * 50, chunks=10, chunk_delay=0.5) as fake:
+        runtime = run_with(fake, max_in_flight=1)
+        chunks = runtime.stream('key', 'm', 'hi')
+        assert next(chunks)
+        chunks.close()
+        # The only slot must be free again long before the abandoned stream would finish
+        start = time.perf_counter()
+        fake.reply, fake.chunks = 'ok', 1
+        assert runtime.generate('key', 'm', 'hi', timeout=2) == 'ok'
+        assert time.perf_counter() - start < 1.0
+        runtime.close()
+
+
+def test_cancelling_a_submitted_call_frees_the_slot():
+    with FakeGemini(reply=lambda model, prompt: time.sleep(1) or 'late' if prompt == 'slow' else 'ok') as fake:
+        runtime = run_with(fake, max_in_flight=1)
+        future = runtime.submit_generate('key', 'm', 'slow')
+        time.sleep(0.1)
+        assert future.cancel()
+        start = time.perf_counter()
+        assert runtime.generate('key', 'm', 'hi', timeout=2) == 'ok'
+        assert time.perf_counter() - start < 0.5
+        runtime.close()
+
+
+def test_api_errors_carry_status():
+    with FakeGemini() as fake:
+        runtime = run_with(fake)
+        with pytest.raises(GeminiError) as info:
+            runtime.generate('', 'm', 'hi')
+        assert info.value.status == 401
+        runtime.close()
+
+
+def test_list_models():
+    with FakeGemini() as fake:
+        runtime = run_with(fake)
+        names = [model['name'] for model in runtime.list_models('key')
+                 if 'generateContent' in model['supportedGenerationMethods']]
+        assert names == ['models/gemini-2.0-flash-exp', 'models/gemini-2.5-flash']
+        runtime.close()
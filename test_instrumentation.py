@@ -0,0 +1,143 @@
+"""Tests for timing spans, histograms and the Prometheus exporters"""
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from instrumentation import METRIC_NAME, Histogram, Metrics, profiled, serve
+
+
+def test_histogram_buckets_are_upper_bounds():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(1.0) is None
+
+
+def test_spans_record_per_stage():
+    metrics = Metrics(enabled=True)
+    with metrics.span('context'):
+        time.sleep(0.01)
+    with metrics.span('context'):
+        pass
+    summary = metrics.summary()
+    assert summary['context']['count'] == 2
+    assert summary['context']['mean_ms'] >= 5
+
+
+def test_span_records_even_when_the_block_raises():
+    metrics = Metrics(enabled=True)
+    try:
+        with metrics.span('generation'):
+            raise ValueError
+    except ValueError:
+        pass
+    assert metrics.summary()['generation']['count'] == 1
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False)
+    with metrics.span('turn'):
+        pass
+    assert metrics.summary() == {}
+
+
+def test_timed_stream_splits_first_token_from_generation():
+    metrics = Metrics(enabled=True)
+
+    def chunks():
+        time.sleep(0.02)
+        yield 'a'
+        time.sleep(0.01)
+        yield 'b'
+
+    stream = metrics.timed_stream(chunks())
+    assert list(stream) == ['a', 'b']
+    summary = metrics.summary()
+    assert summary['first_token']['mean_ms'] >= 15
+    assert 5 <= summary['generation']['mean_ms'] < summary['first_token']['mean_ms']
+
+
+def test_render_uses_cumulative_prometheus_buckets():
+    metrics = Metrics(enabled=True, buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 2.0):
+        metrics.observe('turn', value)
+    text = metrics.render()
+    assert f'# TYPE {METRIC_NAME} histogram' in text
+    assert f'{METRIC_NAME}_bucket{{stage="turn",le="0.1"}} 1' in text
+    assert f'{METRIC_NAME}_bucket{{stage="turn",le="1"}} 2' in text
+    assert f'{METRIC_NAME}_bucket{{stage="turn",le="+Inf"}} 3' in text
+    assert f'{METRIC_NAME}_count{{stage="turn"}} 3' in text
+    assert f'{METRIC_NAME}_sum{{stage="turn"}} 2.550000' in text
+
+
+def test_file_and_http_exporters():
+    metrics = Metrics(enabled=True)
+    metrics.observe('cache', 0.0001)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'mindfulai.prom')
+        metrics.write(path)
+        with open(path) as f:
+            assert f.read() == metrics.render()
+        assert os.listdir(tmp) == ['mindfulai.prom']
+    server = serve(metrics, 0, host='127.0.0.1')
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert response.read().decode() == metrics.render()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_profiled_reports_only_when_enabled():
+    with profiled(False) as profile:
+        sum(range(1000))
+    assert profile.report == ''
+    with tempfile.TemporaryDirectory() as tmp:
+        with profiled(True, profile_dir=tmp) as profile:
+            sorted(range(1000), key=lambda n: -n)
+        assert 'function calls' in profile.report
+        assert os.path.exists(profile.path)
+
+
+def test_only_one_block_is_profiled_at_a_time():
+    inside, release = threading.Event(), threading.Event()
+    results = {}
+
+    def turn():
+        with profiled(True, profile_dir=None) as profile:
+            inside.set()
+            release.wait(5)
+        results['first'] = profile
+
+    thread = threading.Thread(target=turn)
+    thread.start()
+    assert inside.wait(5)
+    # A second session's turn runs at once, unprofiled, instead of waiting or failing
+    with profiled(True, profile_dir=None) as profile:
+        total = sum(range(100))
+    assert total == 4950 and profile.skipped and profile.report == ''
+    release.set()
+    thread.join(5)
+    assert 'function calls' in results['first'].report and not results['first'].skipped
+    with profiled(True, profile_dir=None) as profile:
+        sum(range(100))
+    assert profile.report and not profile.skipped
+
+
+def test_the_profiler_is_released_when_the_block_raises():
+    with pytest.raises(RuntimeError):
+        with profiled(True, profile_dir=None):
+            raise RuntimeError('turn failed')
+    with profiled(True, profile_dir=None) as profile:
+        sum(range(100))
+    assert profile.report and not profile.skipped
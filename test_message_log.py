@@ -0,0 +1,61 @@
+"""Tests for the slotted session-state records and their dict-compatible views"""
+import pickle
+from datetime import datetime
+
+import pytest
+
+from message_log import ChatTurn, Message, MessageLog, MoodEntry
+
+
+def test_message_reads_like_the_old_dict():
+    message = Message("user", "I can't sleep", "Tired", flagged=True)
+    assert message["role"] == "user" and message["content"] == "I can't sleep"
+    assert message.get("flagged") is True
+    assert message.get("missing") is None
+    assert dict(message) == {"role": "user", "content": "I can't sleep", "mood": "Tired", "flagged": True}
+    assert message == {"role": "user", "content": "I can't sleep", "mood": "Tired", "flagged": True}
+    with pytest.raises(KeyError):
+        message["time"]
+    assert not hasattr(message, '__dict__')
+
+
+def test_roles_and_moods_are_interned():
+    first = Message("".join(["assis", "tant"]), "a", "".join(["Cal", "m"]))
+    second = Message("assistant", "b", "Calm")
+    assert first.role is second.role
+    assert first.mood is second.mood
+
+
+def test_log_is_bounded_and_append_returns_the_record():
+    log = MessageLog(maxlen=3)
+    records = [log.append("user", f"message {i}") for i in range(5)]
+    assert len(log) == 3
+    assert log[-1] is records[-1]
+    assert [m["content"] for m in log] == ["message 2", "message 3", "message 4"]
+    assert list(log)[-2:] == [records[3], records[4]]
+
+
+def test_chat_turn_shares_the_message_text():
+    log = MessageLog()
+    question = log.append("user", "hello", "Happy", flagged=False)
+    reply = log.append("assistant", "Hi there!", "Happy")
+    turn = ChatTurn(question, reply, created_at=0)
+    assert turn["user"] is question.content and turn["assistant"] is reply.content
+    assert turn["mood"] == "Happy" and turn["crisis"] is False
+    assert turn["timestamp"] == datetime.fromtimestamp(0).isoformat()
+    assert set(turn) == {"timestamp", "user", "assistant", "mood", "crisis"}
+
+
+def test_mood_entry_time_is_a_datetime():
+    entry = MoodEntry("Calm", logged_at=1_700_000_000)
+    assert entry["time"] == datetime.fromtimestamp(1_700_000_000)
+    assert entry["mood"] == "Calm"
+
+
+def test_log_round_trips_through_pickle_and_from_dicts():
+    log = MessageLog.from_dicts([{"role": "user", "content": "hi", "flagged": True},
+                                 {"role": "assistant", "content": "hello"}], maxlen=10)
+    restored = pickle.loads(pickle.dumps(log))
+    assert restored.maxlen == 10
+    assert [dict(m) for m in restored] == [dict(m) for m in log]
+    assert restored[0]["flagged"] is True
@@ -0,0 +1,141 @@
+"""Tests for the shared model registry with stub models and the local fake server"""
+import gc
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_gemini import FakeGemini
+from gemini_client import GeminiModel, GeminiRuntime
+from model_registry import ModelRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubModel:
+    """Answers with the key and config it was built with"""
+
+    def __init__(self, api_key, model_name, generation_config):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.generation_config = generation_config
+
+    def generate_content(self, prompt, stream=False):
+        return f"{self.api_key}|{self.model_name}|{prompt}"
+
+
+def make_registry(**kwargs):
+    evicted = []
+    registry = ModelRegistry(factory=StubModel, on_evict=evicted.append, **kwargs)
+    return registry, evicted
+
+
+def test_same_key_shares_one_model():
+    registry, _ = make_registry()
+    first = registry.acquire('key-a')
+    second = registry.acquire('key-a')
+    assert first.model is second.model
+    assert registry.refs('key-a') == 2
+    assert registry.stats()['created'] == 1
+
+
+def test_keys_models_and_configs_are_isolated():
+    registry, _ = make_registry()
+    a = registry.acquire('key-a')
+    b = registry.acquire('key-b')
+    other_model = registry.acquire('key-a', 'gemini-2.5-flash')
+    warm = registry.acquire('key-a', generation_config={'temperature': 0.9, 'topP': 0.8})
+    same_warm = registry.acquire('key-a', generation_config={'topP': 0.8, 'temperature': 0.9})
+    assert len({id(lease.model) for lease in (a, b, other_model, warm)}) == 4
+    assert warm.model is same_warm.model
+    assert b.model.generate_content('hi') == 'key-b|gemini-2.0-flash-exp|hi'
+
+
+def test_idle_models_are_evicted_after_ttl():
+    clock = FakeClock()
+    registry, evicted = make_registry(idle_ttl=60, clock=clock)
+    lease = registry.acquire('key-a')
+    clock.now = 1000
+    assert registry.evict_idle() == 0  # still leased
+    lease.release()
+    lease.release()  # releasing twice is harmless
+    assert registry.refs('key-a') == 0
+    clock.now = 1059
+    assert registry.evict_idle() == 0
+    clock.now = 1060
+    assert registry.evict_idle() == 1
+    assert evicted == ['key-a']
+    assert registry.stats() == {'models': 0, 'leases': 0, 'created': 1, 'evicted': 1}
+
+
+def test_key_client_is_kept_while_another_model_uses_it():
+    clock = FakeClock()
+    registry, evicted = make_registry(idle_ttl=0, clock=clock)
+    registry.acquire('key-a', 'gemini-2.5-flash').release()
+    kept = registry.acquire('key-a')
+    assert registry.stats()['evicted'] == 1
+    assert evicted == []
+    kept.release()
+    registry.evict_idle()
+    assert evicted == ['key-a']
+
+
+def test_garbage_collected_lease_releases_its_reference():
+    registry, _ = make_registry()
+    lease = registry.acquire('key-a')
+    assert registry.refs('key-a') == 1
+    del lease
+    gc.collect()
+    assert registry.refs('key-a') == 0
+
+
+def test_many_concurrent_sessions_with_different_keys():
+    registry, _ = make_registry(idle_ttl=0)
+    keys = [f'key-{i}' for i in range(8)]
+    errors = []
+
+    def session(n):
+        rng = random.Random(n)
+        for turn in range(50):
+            key = rng.choice(keys)
+            lease = registry.acquire(key)
+            reply = lease.model.generate_content(f'{n}-{turn}')
+            if reply != f'{key}|gemini-2.0-flash-exp|{n}-{turn}':
+                errors.append(reply)
+            lease.release()
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        list(pool.map(session, range(200)))
+    assert errors == []
+    assert registry.stats()['leases'] == 0
+    assert all(registry.refs(key) == 0 for key in keys)
+
+
+def test_sessions_share_pooled_clients_against_fake_server():
+    with FakeGemini(reply='ok', latency=0.01) as fake:
+        runtime = GeminiRuntime(base_url=fake.url)
+        registry = ModelRegistry(factory=lambda key, name, config: GeminiModel(key, name, runtime=runtime),
+                                 idle_ttl=0, on_evict=runtime.discard)
+        barrier = threading.Barrier(40)
+
+        def session(n):
+            lease = registry.acquire(f'key-{n % 2}')
+            barrier.wait()
+            try:
+                return lease.model.generate_content('hi')
+            finally:
+                lease.release()
+
+        with ThreadPoolExecutor(max_workers=40) as pool:
+            replies = list(pool.map(session, range(40)))
+        assert replies == ['ok'] * 40
+        assert registry.stats()['created'] == 2
+        assert len(runtime._clients) == 2
+        registry.evict_idle()
+        assert runtime._clients == {}
+        runtime.close()
@@ -0,0 +1,224 @@
+"""Tests for latency-aware model routing with stub models and injected delays"""
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from fake_gemini import FakeGemini
+from gemini_client import GeminiError, GeminiModel, GeminiRuntime, GeminiTimeout
+from model_router import ModelRouter, percentile
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubModel:
+    """Replies with its name after `delay` seconds, or raises `error`"""
+
+    def __init__(self, model_name, delay=0.0, error=None, chunks=2):
+        self.model_name = model_name
+        self.delay = delay
+        self.error = error
+        self.chunks = chunks
+        self.calls = 0
+        self.timeouts = []
+        self.closed = threading.Event()
+
+    def generate_content(self, prompt, stream=False, timeout=None):
+        self.calls += 1
+        self.timeouts.append(timeout)
+        if stream:
+            return self._stream()
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.model_name
+
+    def _stream(self):
+        try:
+            time.sleep(self.delay)
+            if self.error:
+                raise self.error
+            for i in range(self.chunks):
+                yield f"{self.model_name}-{i} "
+        finally:
+            self.closed.set()
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 51
+    assert percentile(values, 0.95) == 96
+    assert percentile([7], 0.95) == 7
+
+
+def test_routes_to_the_fastest_model_once_measured():
+    slow, fast = StubModel('slow', delay=0.03), StubModel('fast', delay=0.0)
+    router = ModelRouter([slow, fast], hedge_delay=10)
+    replies = [router.generate_content('hi') for _ in range(10)]
+    # Each model is tried until it has a sample, then the fast one takes every turn
+    assert replies[2:] == ['fast'] * 8
+    assert slow.calls == 1
+    assert [route.name for route in router.ranked()] == ['fast', 'slow']
+
+
+@pytest.mark.parametrize('error', [GeminiTimeout('deadline'), GeminiError('429: quota', status=429),
+                                   GeminiError('503: overloaded', status=503), ConnectionError('reset')])
+def test_fails_over_and_cools_down_the_failing_model(error):
+    clock = FakeClock()
+    broken, backup = StubModel('broken', error=error), StubModel('backup', delay=0.01)
+    router = ModelRouter([broken, backup], hedge_delay=10, cooldown=30, clock=clock)
+    assert router.generate_content('hi') == 'backup'
+    assert router.failovers == 1
+    assert router.stats()[0]['cooling_down']
+    assert router.stats()[0]['error_rate'] == 1.0
+    # While cooling down the broken model is not tried first
+    router.generate_content('hi')
+    assert broken.calls == 1
+    # After the cooldown it is healthy again and, unmeasured, gets retried
+    broken.error = None
+    clock.now = 31
+    assert router.generate_content('hi') == 'broken'
+
+
+def test_client_errors_are_raised_without_failover():
+    bad_request, backup = StubModel('a', error=GeminiError('400: bad', status=400)), StubModel('b')
+    router = ModelRouter([bad_request, backup], hedge_delay=10)
+    with pytest.raises(GeminiError):
+        router.generate_content('hi')
+    assert backup.calls == 0
+    assert not router.stats()[0]['cooling_down']
+
+
+def test_last_error_is_raised_when_every_model_fails():
+    router = ModelRouter([StubModel('a', error=GeminiTimeout('a')), StubModel('b', error=GeminiTimeout('b'))],
+                         hedge_delay=10)
+    with pytest.raises(GeminiTimeout):
+        router.generate_content('hi')
+
+
+def test_failover_gets_only_what_is_left_of_the_timeout():
+    broken, backup = StubModel('broken', delay=0.2, error=GeminiTimeout('a')), StubModel('backup')
+    router = ModelRouter([broken, backup], hedge_delay=10)
+    assert router.generate_content('hi', timeout=1.0) == 'backup'
+    assert broken.timeouts == [pytest.approx(1.0, abs=0.05)] and backup.timeouts[0] < 0.85
+    # Nothing left after the first model: the backup is not tried
+    stuck = StubModel('stuck', delay=0.3, error=GeminiTimeout('a'))
+    router = ModelRouter([stuck, StubModel('late')], hedge_delay=10)
+    with pytest.raises(GeminiTimeout):
+        router.generate_content('hi', timeout=0.2)
+    assert router.routes[1].model.calls == 0 and router.failovers == 0
+
+
+def test_slow_primary_is_hedged_by_the_runner_up():
+    degraded, healthy = StubModel('degraded', delay=0.5), StubModel('healthy', delay=0.02)
+    router = ModelRouter([degraded, healthy], hedge_delay=0.05)
+    start = time.perf_counter()
+    assert router.generate_content('hi') == 'healthy'
+    assert time.perf_counter() - start < 0.3
+    assert router.hedges == 1
+
+
+class CancellableModel:
+    """Answers through submit_content with a future that can be cancelled until it resolves, like GeminiModel's"""
+
+    def __init__(self, model_name, delay=0.0, error=None):
+        self.model_name = model_name
+        self.delay = delay
+        self.error = error
+        self.futures = []
+
+    def submit_content(self, prompt, timeout=None):
+        future = Future()
+        self.futures.append(future)
+        timer = threading.Timer(self.delay, self._resolve, args=(future,))
+        timer.daemon = True
+        timer.start()
+        return future
+
+    def _resolve(self, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        if self.error:
+            future.set_exception(self.error)
+        else:
+            future.set_result(self.model_name)
+
+
+def test_the_losing_hedge_is_cancelled_and_counted_as_slow():
+    degraded, healthy = CancellableModel('degraded', delay=5), CancellableModel('healthy', delay=0.02)
+    router = ModelRouter([degraded, healthy], hedge_delay=0.05)
+    start = time.perf_counter()
+    assert router.generate_content('hi') == 'healthy'
+    assert time.perf_counter() - start < 0.3
+    assert degraded.futures[0].cancelled() and healthy.futures[0].result() == 'healthy'
+    # The cancelled call was at least as slow as the winner, so the winner now ranks first
+    assert list(router.routes[0].latencies) == [pytest.approx(0.07, abs=0.05)]
+    assert [route.name for route in router.ranked()] == ['healthy', 'degraded']
+
+
+def test_a_hedge_still_running_when_the_primary_fails_is_cancelled():
+    broken = CancellableModel('broken', delay=0.1, error=GeminiError('400: bad request', status=400))
+    backup = CancellableModel('backup', delay=5)
+    router = ModelRouter([broken, backup], hedge_delay=0.05)
+    with pytest.raises(GeminiError):
+        router.generate_content('hi')
+    assert backup.futures[0].cancelled() and router.stats()[0]['error_rate'] == 1.0
+
+
+def test_hedging_gemini_models_cancels_the_slower_request():
+    delays = {'slow': 2.0, 'steady': 0.5, 'fast': 0.0}
+    with FakeGemini(reply=lambda model, prompt: time.sleep(delays[model]) or model) as fake:
+        runtime = GeminiRuntime(base_url=fake.url, max_in_flight=2)
+        router = ModelRouter([GeminiModel('key', 'slow', runtime=runtime), GeminiModel('key', 'fast', runtime=runtime)],
+                             hedge_delay=0.05)
+        assert router.generate_content('hi') == 'fast'
+        # Both in-flight slots are free at once: run one after the other, these two would miss their deadline
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(runtime.generate('key', 'steady', 'x', timeout=0.8)))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert results == ['steady', 'steady']
+        runtime.close()
+        router.close()
+
+
+def test_hedge_delay_defaults_to_the_primary_p95():
+    model, backup = StubModel('a', delay=0.01), StubModel('b', delay=0.0)
+    router = ModelRouter([model, backup], hedge_delay=None)
+    router.routes[0].latencies.extend([0.1] * 10)
+    router.routes[1].latencies.extend([0.5] * 10)
+    for _ in range(5):
+        assert router.generate_content('hi') == 'a'
+    assert router.hedges == 0
+    # The primary degrades far past its p95: the backup is raced and wins
+    model.delay = 1.0
+    start = time.perf_counter()
+    assert router.generate_content('hi') == 'b'
+    assert time.perf_counter() - start < 0.5
+    assert router.hedges == 1
+
+
+def test_stream_fails_over_before_the_first_chunk():
+    broken, backup = StubModel('broken', error=GeminiTimeout('deadline')), StubModel('backup', chunks=3)
+    router = ModelRouter([broken, backup], hedge_delay=10)
+    assert list(router.generate_content('hi', stream=True)) == ['backup-0 ', 'backup-1 ', 'backup-2 ']
+    assert router.failovers == 1
+
+
+def test_closing_a_routed_stream_closes_the_upstream_stream():
+    model = StubModel('a', chunks=5)
+    router = ModelRouter([model], hedge_delay=10)
+    chunks = router.generate_content('hi', stream=True)
+    assert next(chunks) == 'a-0 '
+    chunks.close()
+    assert model.closed.is_set()
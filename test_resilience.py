@@ -0,0 +1,237 @@
+"""Tests for retries, backoff and the circuit breaker with a fault-injecting stub"""
+import os
+import random
+import subprocess
+import sys
+
+import httpx
+import pytest
+
+from fake_gemini import FakeGemini
+from gemini_client import GeminiError, GeminiModel, GeminiRuntime, GeminiTimeout
+from resilience import (AUTH, BLOCKED, CLOSED, FATAL, HALF_OPEN, INVALID, OPEN, RATE_LIMITED, TIMEOUT,
+                        UNAVAILABLE, CircuitBreaker, CircuitOpen, ResilientModel, backoff_delay, classify, user_message)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FlakyModel:
+    """Raises the queued faults in order, then answers; each call takes `latency` on `clock`"""
+
+    def __init__(self, *faults, reply='ok', clock=None, latency=0.0):
+        self.faults = list(faults)
+        self.reply = reply
+        self.clock = clock
+        self.latency = latency
+        self.calls = 0
+        self.timeouts = []
+
+    def generate_content(self, prompt, stream=False, timeout=None):
+        self.calls += 1
+        self.timeouts.append(timeout)
+        if self.clock is not None:
+            self.clock.sleep(self.latency)
+        if stream:
+            return self._stream()
+        if self.faults:
+            raise self.faults.pop(0)
+        return self.reply
+
+    def _stream(self):
+        if self.faults:
+            raise self.faults.pop(0)
+        yield from self.reply.split()
+
+
+def resilient(model, clock, **kwargs):
+    kwargs.setdefault('breaker', CircuitBreaker(threshold=3, reset=30, clock=clock))
+    return ResilientModel(model, clock=clock, sleep=clock.sleep, rng=random.Random(1), **kwargs)
+
+
+@pytest.mark.parametrize('error, kind', [
+    (GeminiTimeout('deadline'), TIMEOUT),
+    (GeminiError('408', status=408), TIMEOUT),
+    (GeminiError('429', status=429), RATE_LIMITED),
+    (GeminiError('503', status=503), UNAVAILABLE),
+    (ConnectionError('reset'), UNAVAILABLE),
+    (httpx.ConnectError('refused'), UNAVAILABLE),
+    (httpx.RemoteProtocolError('dropped'), UNAVAILABLE),
+    (httpx.ReadTimeout('slow'), TIMEOUT),
+    (KeyError('candidates'), FATAL),
+    (TypeError('not iterable'), FATAL),
+    (AttributeError('text'), FATAL),
+    (GeminiError('401', status=401), AUTH),
+    (GeminiError('403', status=403), AUTH),
+    (GeminiError('400', status=400), INVALID),
+    (GeminiError('Prompt blocked: SAFETY'), BLOCKED),
+])
+def test_errors_are_classified(error, kind):
+    assert classify(error) == kind
+
+
+def test_importing_the_pipeline_does_not_import_httpx():
+    check = ("import sys, resilience, chat_pipeline; "
+             "print(resilience.classify(KeyError('x')), resilience.classify(OSError()), 'httpx' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', check], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.split() == [FATAL, UNAVAILABLE, 'False']
+
+
+def test_backoff_is_jittered_and_capped():
+    rng = random.Random(0)
+    delays = [backoff_delay(attempt, base=0.5, cap=4, rng=rng) for attempt in range(8) for _ in range(50)]
+    assert all(0 <= delay <= 4 for delay in delays)
+    assert len(set(delays)) == len(delays)
+    assert max(backoff_delay(0, base=0.5, cap=4, rng=rng) for _ in range(100)) <= 0.5
+
+
+def test_transient_errors_are_retried_until_success():
+    clock = FakeClock()
+    model = resilient(FlakyModel(GeminiError('503', status=503), GeminiTimeout('slow')), clock)
+    assert model.generate_content('hi') == 'ok'
+    assert model.retries == 2
+    assert model.stats()['errors'] == {UNAVAILABLE: 1, TIMEOUT: 1}
+    assert 0 < clock.now <= 0.5 + 1.0
+
+
+def test_fatal_errors_are_not_retried():
+    clock = FakeClock()
+    flaky = FlakyModel(GeminiError('401: API key not valid', status=401))
+    model = resilient(flaky, clock)
+    with pytest.raises(GeminiError):
+        model.generate_content('hi')
+    assert flaky.calls == 1
+    assert model.breaker.state == CLOSED
+
+
+def test_retries_stop_at_max_attempts():
+    clock = FakeClock()
+    flaky = FlakyModel(*[GeminiError('429', status=429)] * 5)
+    model = resilient(flaky, clock, max_attempts=3, breaker=CircuitBreaker(threshold=10, clock=clock))
+    with pytest.raises(GeminiError):
+        model.generate_content('hi')
+    assert flaky.calls == 3
+
+
+def test_retries_stop_before_the_total_deadline():
+    clock = FakeClock()
+    flaky = FlakyModel(*[GeminiTimeout('slow')] * 10)
+    model = resilient(flaky, clock, max_attempts=10, base_delay=1, max_delay=100, deadline=3,
+                      breaker=CircuitBreaker(threshold=100, clock=clock))
+    with pytest.raises(GeminiTimeout):
+        model.generate_content('hi')
+    assert clock.now < 3
+    assert flaky.calls < 10
+
+
+def test_each_attempt_gets_only_what_is_left_of_the_deadline():
+    clock = FakeClock()
+    flaky = FlakyModel(*[GeminiTimeout('slow')] * 10, clock=clock, latency=4)
+    model = resilient(flaky, clock, max_attempts=10, base_delay=0.1, max_delay=0.1, deadline=10,
+                      breaker=CircuitBreaker(threshold=100, clock=clock))
+    with pytest.raises(GeminiTimeout):
+        model.generate_content('hi')
+    assert flaky.timeouts[0] == 10
+    assert all(later < earlier for earlier, later in zip(flaky.timeouts, flaky.timeouts[1:]))
+    # Two slow tries use most of the deadline; a third gets the remainder and no fourth starts
+    assert flaky.calls == 3 and flaky.timeouts[-1] < 2 and clock.now < 10 + 4
+
+
+def test_bugs_are_raised_at_once_and_leave_the_breaker_alone():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=1, reset=10, clock=clock)
+    flaky = FlakyModel(KeyError('candidates'), KeyError('candidates'))
+    model = resilient(flaky, clock, breaker=breaker)
+    with pytest.raises(KeyError):
+        model.generate_content('hi')
+    assert flaky.calls == 1 and breaker.state == CLOSED and breaker.failures == 0
+    assert model.stats()['errors'] == {FATAL: 1}
+    breaker.record_failure(GeminiTimeout('slow'))
+    clock.now = 10
+    # A bug during the probe neither closes nor reopens the circuit; the next call probes again
+    with pytest.raises(KeyError):
+        model.generate_content('hi')
+    assert breaker.state == HALF_OPEN
+    assert model.generate_content('hi') == 'ok' and breaker.state == CLOSED
+
+
+def test_breaker_opens_fails_fast_and_recovers_after_a_probe():
+    clock = FakeClock()
+    flaky = FlakyModel(*[GeminiError('503', status=503)] * 3)
+    model = resilient(flaky, clock, max_attempts=1)
+    for _ in range(3):
+        with pytest.raises(GeminiError):
+            model.generate_content('hi')
+    assert model.breaker.state == OPEN
+    # Open: no call reaches the model
+    with pytest.raises(CircuitOpen) as raised:
+        model.generate_content('hi')
+    assert flaky.calls == 3
+    assert raised.value.retry_after == pytest.approx(30 - clock.now)
+    clock.now += 30
+    # The first call after the reset timeout is a probe; its success closes the circuit
+    assert model.generate_content('hi') == 'ok'
+    assert model.breaker.state == CLOSED
+    assert model.stats()['short_circuits'] == 1
+    assert model.stats()['opened'] == 1
+
+
+def test_failed_probe_reopens_the_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=1, reset=10, clock=clock)
+    breaker.record_failure(GeminiTimeout('slow'))
+    assert breaker.state == OPEN
+    clock.now = 10
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    # Only one probe at a time
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    breaker.record_failure(GeminiTimeout('slow'))
+    assert breaker.state == OPEN
+    assert breaker.opened_at == 10
+
+
+def test_stream_retries_before_the_first_chunk_only():
+    clock = FakeClock()
+    model = resilient(FlakyModel(GeminiTimeout('slow'), reply='take a breath'), clock)
+    assert list(model.generate_content('hi', stream=True)) == ['take', 'a', 'breath']
+    assert model.retries == 1
+
+
+def test_user_messages_never_expose_exception_details():
+    secret = 'https://internal.example/v1beta?key=AIza-secret'
+    for error in (GeminiError(f'401: {secret}', status=401), GeminiError(f'400: {secret}', status=400),
+                  GeminiTimeout(secret), ConnectionError(secret), GeminiError(f'Prompt blocked: {secret}'),
+                  KeyError(secret)):
+        message = user_message(error)
+        assert secret not in message and 'Error' not in message
+    assert 'API key' in user_message(GeminiError('401', status=401))
+
+
+def test_against_the_fake_server_with_injected_faults():
+    with FakeGemini(reply='steady now') as fake:
+        runtime = GeminiRuntime(base_url=fake.url)
+        clock = FakeClock()
+        model = resilient(GeminiModel('key', runtime=runtime), clock)
+        fake.inject(503, 429)
+        assert model.generate_content('hi') == 'steady now'
+        assert model.stats()['errors'] == {UNAVAILABLE: 1, RATE_LIMITED: 1}
+        fake.inject(503, 503)
+        assert ''.join(model.generate_content('hi', stream=True)) == 'steady now'
+        assert len(fake.requests) == 6
+        # A bad key is fatal: one request, no retry
+        fake.inject(403)
+        with pytest.raises(GeminiError):
+            model.generate_content('hi')
+        assert len(fake.requests) == 7
+        runtime.close()
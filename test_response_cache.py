@@ -0,0 +1,102 @@
+"""Tests for the reply cache, its key and its normalization"""
+import threading
+
+from response_cache import ResponseCache, cache_key, context_digest, normalize_message
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_folds_case_quotes_whitespace_and_trailing_punctuation():
+    assert normalize_message("  I’m   FEELING\tanxious!!! ") == "i'm feeling anxious"
+    assert normalize_message("How do I relax?") == normalize_message("how do i relax")
+    assert normalize_message("Wait... what?") == "wait... what"
+    assert normalize_message("a\n\nb") == "a b"
+    assert normalize_message("?!") == ""
+    # Punctuation inside the message is meaning, not noise
+    assert normalize_message("I'm not okay.") != normalize_message("Im not okay")
+
+
+def test_key_changes_with_mood_and_context_only():
+    window = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"}]
+    key = cache_key("How do I sleep better?", "Tired", window)
+    assert cache_key("how do i sleep better", "Tired", window) == key
+    assert cache_key("How do I sleep better?", "Tired", [dict(m) for m in window]) == key
+    assert cache_key("How do I sleep better?", "Anxious", window) != key
+    assert cache_key("How do I sleep better?", None, window) != key
+    assert cache_key("How do I sleep better?", "Tired", window[:1]) != key
+    assert cache_key("How do I sleep better?", "Tired", []) != key
+    # The same words said by the other side are a different conversation
+    swapped = [{"role": "assistant", "content": "Hi"}, {"role": "user", "content": "Hello!"}]
+    assert cache_key("How do I sleep better?", "Tired", swapped) != key
+
+
+def test_context_digest_ignores_formatting_but_not_order():
+    first = [{"role": "user", "content": "I feel low"}, {"role": "assistant", "content": "I'm here."}]
+    assert context_digest(first) == context_digest([{"role": "user", "content": "i feel  LOW!"},
+                                                    {"role": "assistant", "content": "I’m here"}])
+    assert context_digest(first) != context_digest(first[::-1])
+    # Message boundaries are part of the digest
+    assert context_digest([{"role": "user", "content": "a b"}]) != \
+        context_digest([{"role": "user", "content": "a"}, {"role": "user", "content": "b"}])
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = ResponseCache(max_entries=3, ttl=60, clock=FakeClock())
+    for key in 'abc':
+        cache.set(key, key.upper())
+    assert cache.get('a') == 'A'
+    cache.set('d', 'D')
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['A', 'C', 'D']
+    # Overwriting refreshes an entry's place as well
+    cache.set('a', 'A2')
+    cache.set('e', 'E')
+    assert cache.get('c') is None and cache.get('a') == 'A2'
+    assert cache.stats()['size'] == 3 and cache.stats()['evictions'] == 2
+
+
+def test_entries_expire_after_the_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=10, ttl=30, clock=clock)
+    cache.set('a', 'A')
+    clock.now += 29.9
+    assert cache.get('a') == 'A'
+    # A hit does not extend the entry's life
+    clock.now += 0.1
+    assert cache.get('a') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 1, 'size': 0, 'hit_rate': 0.5}
+    cache.set('a', 'again')
+    assert cache.get('a') == 'again'
+
+
+def test_counters_and_clear():
+    cache = ResponseCache(max_entries=10, ttl=60, clock=FakeClock())
+    assert cache.stats()['hit_rate'] == 0.0
+    cache.set('a', 'A')
+    assert [cache.get('a'), cache.get('a'), cache.get('b'), cache.get('c')] == ['A', 'A', None, None]
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'evictions': 0, 'size': 1, 'hit_rate': 0.5}
+    cache.clear()
+    assert cache.get('a') is None and cache.stats()['size'] == 0
+
+
+def test_concurrent_use_keeps_the_bound_and_the_counts():
+    cache = ResponseCache(max_entries=50, ttl=60)
+
+    def work(worker):
+        for i in range(500):
+            cache.set((worker, i % 80), i)
+            cache.get((worker, (i * 7) % 80))
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert stats['size'] == 50 and stats['hits'] + stats['misses'] == 8 * 500
@@ -0,0 +1,210 @@
+"""Tests for the session backends and resuming sessions across worker processes"""
+import json
+import os
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from functools import partial
+from unittest import mock
+
+import pytest
+
+import chat_pipeline
+import gemini_client
+from chat_pipeline import ChatSession, finish_turn, is_session_id, log_mood, restore, start_turn
+from context_builder import ContextBuilder
+from conversation_store import ConversationStore
+from fake_gemini import FakeGemini
+from session_backend import MemorySessionBackend, RedisSessionBackend, SQLiteSessionBackend, open_backend
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """The three commands the Redis backend uses, with expiry on a fake clock"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, 0))
+        return value.encode() if value is not None and expires_at > self.clock() else None
+
+    def set(self, key, value, ex):
+        self.data[key] = (value, self.clock() + ex)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def backends(clock, tmp_path):
+    return [MemorySessionBackend(ttl=60, clock=clock),
+            SQLiteSessionBackend(str(tmp_path / 'backend.db'), ttl=60, clock=clock),
+            RedisSessionBackend('redis://unused', ttl=60, client=FakeRedis(clock))]
+
+
+@contextmanager
+def scratch_stores(tmp_path):
+    """The pipeline's conversation store and session backend swapped for fresh ones under tmp_path"""
+    store = ConversationStore(str(tmp_path / 'chat.db'))
+    backend = SQLiteSessionBackend(str(tmp_path / 'sessions.db'))
+    try:
+        with mock.patch.object(chat_pipeline, 'store', store), \
+                mock.patch.object(chat_pipeline, 'session_backend', backend):
+            yield
+    finally:
+        backend.close()
+        store.close()
+
+
+def test_backends_store_expire_and_delete_documents(tmp_path):
+    clock = FakeClock()
+    for backend in backends(clock, tmp_path):
+        state = {"settings": {"use_cache": False}, "summary": "Talked about exams.", "pending": [["user", "hi"]]}
+        backend.put('a' * 32, state)
+        assert backend.get('a' * 32) == state
+        assert backend.get('b' * 32) is None
+        clock.now += 59
+        backend.put('b' * 32, {"summary": ""})
+        clock.now += 2
+        assert backend.get('a' * 32) is None, type(backend).__name__
+        assert backend.get('b' * 32) == {"summary": ""}
+        backend.delete('b' * 32)
+        assert backend.get('b' * 32) is None
+        if not isinstance(backend, RedisSessionBackend):
+            backend.close()
+
+
+def test_sqlite_documents_are_shared_between_connections(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    first, second = SQLiteSessionBackend(path), SQLiteSessionBackend(path)
+    first.put('c' * 32, {"summary": "shared"})
+    assert second.get('c' * 32) == {"summary": "shared"}
+    first.close()
+    second.close()
+
+
+def test_open_backend_parses_the_setting(tmp_path):
+    assert isinstance(open_backend('memory'), MemorySessionBackend)
+    backend = open_backend(f"sqlite:///{tmp_path / 'named.db'}")
+    assert backend.path.endswith('named.db')
+    backend.close()
+    with pytest.raises(ValueError):
+        open_backend('postgres://db')
+
+
+def test_restore_rebuilds_turns_moods_summary_and_settings(tmp_path):
+    with scratch_stores(tmp_path), FakeGemini(reply='Rest helps.') as fake, \
+            mock.patch.object(gemini_client.runtime, 'base_url', fake.url):
+        session = ChatSession('restore-key')
+        session.use_cache = False
+        log_mood(session, 'Tired')
+        for text in ('I slept badly', 'Again last night'):
+            question, _ = start_turn(session, text, 'Tired')
+            finish_turn(session, question, 'Rest helps.', 'Tired')
+        session.context.set_summary('User has trouble sleeping.')
+        finish_turn(session, start_turn(session, 'Any tips?', 'Tired')[0], 'Try a wind-down routine.', 'Tired')
+        session.close()
+
+        resumed = ChatSession('restore-key')
+        assert restore(resumed, session.session_id)
+        assert [m["content"] for m in resumed.messages] == [m["content"] for m in session.messages]
+        assert [(t["user"], t["assistant"]) for t in resumed.chat_history] == \
+               [(t["user"], t["assistant"]) for t in session.chat_history]
+        assert resumed.mood_history[-1]["mood"] == 'Tired'
+        assert resumed.context.summary == 'User has trouble sleeping.'
+        assert resumed.context.build('hello') == session.context.build('hello')
+        assert resumed.use_cache is False
+        assert not restore(ChatSession('restore-key'), 'f' * 32)
+    assert is_session_id(session.session_id) and not is_session_id('../etc') and not is_session_id(None)
+
+
+class SummaryModel:
+    """Summarizes once released, keeping any fact about the user's dog"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def generate_content(self, prompt, stream=False, timeout=None):
+        self.release.wait(5)
+        return "User's dog Biscuit is ill." if 'Biscuit' in prompt else "Small talk."
+
+
+def test_evicted_turns_survive_a_resume_during_and_after_their_summary(tmp_path):
+    model = SummaryModel()
+    with scratch_stores(tmp_path), mock.patch.object(chat_pipeline, 'get_model', lambda state: model), \
+            mock.patch.object(chat_pipeline, 'ContextBuilder', partial(ContextBuilder, budget=40)):
+        session = ChatSession('resume-key')
+        for text in ('My dog Biscuit is ill', 'I keep checking on him', 'I could not sleep', 'Work was long'):
+            finish_turn(session, start_turn(session, text)[0], 'That sounds hard.')
+        assert session.context.summarizing and not session.context.summary
+
+        # A worker resuming while the summary is running still has the evicted turns to summarize
+        resumed = ChatSession('resume-key')
+        assert restore(resumed, session.session_id)
+        assert ('user', 'My dog Biscuit is ill') in resumed.context.pending
+
+        model.release.set()
+        chat_pipeline.summarizer.wait(session.context, 5)
+        resumed = ChatSession('resume-key')
+        assert restore(resumed, session.session_id)
+        assert 'Biscuit' in resumed.context.build('How is he?')
+        assert ('user', 'My dog Biscuit is ill') not in resumed.context.pending
+        assert 'Biscuit' not in ''.join(m['content'] for m in resumed.context.messages())
+
+
+WORKER = """
+import json, os, sys
+from streamlit.testing.v1 import AppTest
+
+session_id, messages = sys.argv[1], sys.argv[2:]
+at = AppTest.from_file('app.py', default_timeout=60)
+if session_id != 'new':
+    at.query_params['session'] = session_id
+at.run()
+before = [m['content'] for m in at.session_state['messages']]
+if session_id == 'new':
+    [b for b in at.button if 'Calm' in b.label][0].click().run()
+    at.toggle(key='stream_responses').set_value(False).run()
+for message in messages:
+    at.chat_input[0].set_value(message).run()
+print(json.dumps({'session_id': at.session_state['session_id'], 'before': before,
+                  'stream': at.session_state['stream_responses'],
+                  'moods': [entry['mood'] for entry in at.session_state['mood_history']],
+                  'exception': [str(e.value) for e in at.exception]}))
+"""
+
+
+def run_worker(env, session_id, *messages):
+    """One Streamlit worker process serving one browser visit, then exiting (a restart)"""
+    result = subprocess.run([sys.executable, '-c', WORKER, session_id, *messages], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=180)
+    assert result.returncode == 0, result.stderr[-2000:]
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_sessions_resume_on_another_worker_process(tmp_path):
+    with FakeGemini(reply=lambda model, prompt: f"Reply {prompt.count('User:')}") as fake:
+        env = dict(os.environ, GEMINI_API_BASE=fake.url, GOOGLE_API_KEY='workers',
+                   CHAT_DB_PATH=str(tmp_path / 'workers.db'), SESSION_BACKEND='sqlite')
+        first = run_worker(env, 'new', 'My dog is called Pepper', 'She is old now')
+        assert not first['exception'] and first['stream'] is False
+        second = run_worker(env, first['session_id'], 'What is her name?')
+        assert second['session_id'] == first['session_id']
+        assert second['before'] == ['My dog is called Pepper', 'Reply 1', 'She is old now', 'Reply 2']
+        assert second['moods'] == ['Calm'] and second['stream'] is False
+        # The second worker's prompt carried the conversation from the first
+        assert 'My dog is called Pepper' in fake.requests[-1]['prompt']
+        assert fake.requests[-1]['method'] == 'generateContent'
+        stranger = run_worker(env, 'e' * 32)
+        assert stranger['session_id'] != 'e' * 32 and stranger['before'] == []
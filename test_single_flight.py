@@ -0,0 +1,349 @@
+"""Tests for coalescing identical model requests, with blocking fake calls"""
+import threading
+from unittest import mock
+
+import pytest
+
+import chat_pipeline
+from admission import BUSY, GRANTED, Ticket, TurnedAway, canned_reply
+from chat_pipeline import ChatSession, get_bot_response
+from single_flight import SingleFlight, flight_key
+
+
+class BlockingCall:
+    """An upstream stream that waits for `release` before its first chunk"""
+
+    def __init__(self, chunks=('one ', 'two ', 'three'), error=None):
+        self.chunks = chunks
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.closed = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        if not self.release.wait(5):
+            raise TimeoutError("never released")
+        if self.error is not None:
+            raise self.error
+        return self._chunks()
+
+    def _chunks(self):
+        try:
+            yield from self.chunks
+        finally:
+            self.closed.set()
+
+
+class EndlessCall(BlockingCall):
+    """Streams until the flight stops reading"""
+
+    def _chunks(self):
+        try:
+            while True:
+                yield 'more '
+                self.release.wait(0.005)
+        finally:
+            self.closed.set()
+
+
+def read_in_thread(stream, into):
+    """Read a stream to the end on a new thread; pass a function to also open the stream there"""
+    def read():
+        try:
+            into.append(list(stream() if callable(stream) else stream))
+        except Exception as e:
+            into.append(e)
+    thread = threading.Thread(target=read)
+    thread.start()
+    return thread
+
+
+def test_flight_key_depends_on_key_and_prompt():
+    assert flight_key('k', 'prompt') == flight_key('k', 'prompt')
+    assert flight_key('k', 'prompt') != flight_key('other', 'prompt')
+    assert flight_key('k', 'prompt') != flight_key('k', 'prompt ')
+    assert flight_key(None, 'ab') != flight_key('a', 'b')
+
+
+def test_identical_requests_share_one_upstream_call_and_its_chunks():
+    flights = SingleFlight(max_workers=2)
+    call, unused = BlockingCall(), BlockingCall()
+    results = []
+    leader = read_in_thread(flights.stream('k', call), results)
+    assert call.started.wait(2)
+    followers = [read_in_thread(flights.stream('k', unused), results) for _ in range(4)]
+    call.release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert results == [['one ', 'two ', 'three']] * 5
+    assert (call.calls, unused.calls, flights.calls, flights.joined) == (1, 0, 1, 4)
+    assert flights.in_flight() == 0
+
+
+def test_a_follower_joining_late_still_gets_every_chunk():
+    flights = SingleFlight(max_workers=2)
+    rest = threading.Event()
+
+    def call():
+        yield 'one '
+        rest.wait(5)
+        yield from ('two ', 'three')
+
+    leader = flights.stream('k', call)
+    assert next(leader) == 'one '
+    late = flights.stream('k', BlockingCall())
+    rest.set()
+    assert list(late) == ['one ', 'two ', 'three']
+    assert list(leader) == ['two ', 'three'] and flights.calls == 1
+
+
+def test_do_shares_a_blocking_call():
+    flights = SingleFlight(max_workers=2)
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'whole reply'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do('k', call))) for _ in range(3)]
+    threads[0].start()
+    # The call runs only once its flight is registered
+    assert started.wait(2)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ['whole reply'] * 3 and len(calls) == 1
+
+
+def test_errors_reach_every_caller_and_clear_the_key():
+    flights = SingleFlight(max_workers=2)
+    call = BlockingCall(error=ConnectionError('reset'))
+    results = []
+    threads = [read_in_thread(flights.stream('k', call), results)]
+    assert call.started.wait(2)
+    threads.append(read_in_thread(flights.stream('k', call), results))
+    call.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert all(isinstance(result, ConnectionError) for result in results) and len(results) == 2
+    assert not flights.running('k') and flights.in_flight() == 0
+    # The next request starts a fresh call
+    retry = BlockingCall()
+    retry.release.set()
+    assert list(flights.stream('k', retry)) == ['one ', 'two ', 'three'] and retry.calls == 1
+
+
+def test_upstream_is_cancelled_only_when_every_caller_has_left():
+    flights = SingleFlight(max_workers=2)
+    call = EndlessCall()
+    first, second = flights.stream('k', call), flights.stream('k', BlockingCall())
+    call.release.set()
+    assert next(first) == 'more '
+    first.close()
+    # One reader is left, so the stream goes on
+    assert [next(second) for _ in range(3)] == ['more '] * 3
+    assert not call.closed.is_set()
+    second.close()
+    assert call.closed.wait(2)
+    assert not flights.running('k')
+
+
+def test_running_reports_whether_a_request_would_join():
+    flights = SingleFlight(max_workers=2)
+    call = BlockingCall()
+    assert not flights.running('k')
+    stream = flights.stream('k', call)
+    assert flights.running('k') and not flights.running('other')
+    call.release.set()
+    assert list(stream) == ['one ', 'two ', 'three']
+    assert not flights.running('k')
+    # A flight everyone left is torn down, so a new request starts its own
+    endless = EndlessCall()
+    stream = flights.stream('k', endless)
+    endless.release.set()
+    next(stream)
+    stream.close()
+    assert not flights.running('k')
+    assert endless.closed.wait(2)
+
+
+class ObservedFlights(SingleFlight):
+    """Sets `all_joined` once `expected` requests have joined a flight"""
+
+    def __init__(self, expected):
+        super().__init__(max_workers=2)
+        self.expected = expected
+        self.all_joined = threading.Event()
+        if expected == 0:
+            self.all_joined.set()
+
+    def stream(self, key, start, admit=None):
+        chunks = super().stream(key, start, admit)
+        if self.joined >= self.expected:
+            self.all_joined.set()
+        return chunks
+
+
+class Gate:
+    """An admit check that counts its runs and waits for `release`"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.threads = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.threads.append(threading.current_thread())
+        self.entered.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+
+
+def test_only_the_leader_runs_admit_on_its_own_thread_before_the_call():
+    flights = ObservedFlights(expected=1)
+    call, gate, unused_gate = BlockingCall(), Gate(), Gate()
+    results = []
+    leader = read_in_thread(lambda: flights.stream('k', call, gate), results)
+    assert gate.entered.wait(2)
+    # Waiting for admission: the flight is registered, but not started
+    follower = read_in_thread(lambda: flights.stream('k', BlockingCall(), unused_gate), results)
+    assert flights.all_joined.wait(2) and call.calls == 0
+    gate.release.set()
+    call.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == [['one ', 'two ', 'three']] * 2
+    assert gate.threads == [leader] and unused_gate.threads == [] and call.calls == 1
+
+
+def test_an_admit_error_reaches_every_caller_and_skips_the_call():
+    flights = ObservedFlights(expected=1)
+    call, gate = BlockingCall(), Gate(error=ValueError('turned away'))
+    results = []
+    leader = read_in_thread(lambda: flights.stream('k', call, gate), results)
+    assert gate.entered.wait(2)
+    follower = read_in_thread(lambda: flights.stream('k', call, gate), results)
+    assert flights.all_joined.wait(2)
+    gate.release.set()
+    leader.join(5)
+    follower.join(5)
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert call.calls == 0 and len(gate.threads) == 1 and not flights.running('k')
+
+
+def test_a_request_after_a_flight_ended_is_admitted_even_if_it_saw_it_running():
+    flights = SingleFlight(max_workers=2)
+    admitted = []
+    first = BlockingCall()
+    stream = flights.stream('k', first, lambda: admitted.append('first'))
+    # A caller checks here and sees a flight it could join ...
+    assert flights.running('k')
+    first.release.set()
+    assert list(stream) == ['one ', 'two ', 'three']
+    # ... but the flight ends before it asks, so it leads a new one and must be admitted
+    second = BlockingCall()
+    second.release.set()
+    assert list(flights.stream('k', second, lambda: admitted.append('second'))) == ['one ', 'two ', 'three']
+    assert admitted == ['first', 'second'] and second.calls == 1
+
+
+class CountingAdmission:
+    """Grants or turns away every request once released, counting them"""
+
+    def __init__(self, state=GRANTED, release=None):
+        self.state = state
+        self.admitted = []
+        self.entered = threading.Event()
+        self.release = release or threading.Event()
+
+    def admit(self, session_id, tokens):
+        self.admitted.append(session_id)
+        self.entered.set()
+        self.release.wait(5)
+        return Ticket(session_id, tokens, self.state, retry_after=5)
+
+
+class BlockingModel:
+    def __init__(self, release=None):
+        self.calls = 0
+        self.release = release or threading.Event()
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        self.release.wait(5)
+        return 'Take a slow breath.'
+
+
+def concurrent_turns(admission, model, sessions=3):
+    """Identical turns from several sessions, the later ones sent while the first waits for admission"""
+    states = [ChatSession('shared-key') for _ in range(sessions)]
+    results = {}
+
+    def turn(state):
+        results[state.session_id] = get_bot_response(state, 'I feel tense', 'Anxious', use_cache=False)
+
+    flights = ObservedFlights(expected=sessions - 1)
+    with mock.patch.object(chat_pipeline, 'admission', admission), \
+            mock.patch.object(chat_pipeline, 'get_model', lambda state: model), \
+            mock.patch.object(chat_pipeline, 'flights', flights):
+        threads = [threading.Thread(target=turn, args=(state,)) for state in states]
+        threads[0].start()
+        assert admission.entered.wait(2)
+        for thread in threads[1:]:
+            thread.start()
+        assert flights.all_joined.wait(2)
+        admission.release.set()
+        model.release.set()
+        for thread in threads:
+            thread.join(5)
+    return states, [results[state.session_id] for state in states]
+
+
+def test_only_the_flight_leader_is_admitted():
+    admission, model = CountingAdmission(), BlockingModel()
+    states, replies = concurrent_turns(admission, model)
+    assert replies == ['Take a slow breath.'] * 3
+    assert admission.admitted == [states[0].session_id] and model.calls == 1
+
+
+@pytest.mark.parametrize('sessions', [1, 3])
+def test_a_turned_away_flight_falls_back_for_every_caller(sessions):
+    admission, model = CountingAdmission(BUSY), BlockingModel()
+    states, replies = concurrent_turns(admission, model, sessions)
+    expected = canned_reply(Ticket('s', 0, BUSY, retry_after=5), 'Anxious')
+    assert replies == [expected] * sessions
+    assert len(admission.admitted) == 1 and model.calls == 0
+
+
+def test_every_upstream_call_was_admitted_under_churn():
+    released = threading.Event()
+    released.set()
+    admission, model = CountingAdmission(release=released), BlockingModel(release=released)
+    states = [ChatSession('shared-key') for _ in range(16)]
+    with mock.patch.object(chat_pipeline, 'admission', admission), \
+            mock.patch.object(chat_pipeline, 'get_model', lambda state: model), \
+            mock.patch.object(chat_pipeline, 'flights', SingleFlight(max_workers=4)):
+        threads = [threading.Thread(target=lambda s=state: [get_bot_response(s, 'hi', 'Calm', use_cache=False)
+                                                             for _ in range(20)])
+                   for state in states]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+    assert len(admission.admitted) == model.calls > 0
+
+
+def test_turned_away_is_a_fallback_not_an_error():
+    state = ChatSession('key')
+    ticket = Ticket(state.session_id, 10, BUSY, retry_after=5)
+    assert chat_pipeline.error_reply(state, TurnedAway(ticket), None, 'Calm') == canned_reply(ticket, 'Calm')
@@ -0,0 +1,133 @@
+"""Tests for the rolling conversation summary using a stub model"""
+import threading
+
+from context_builder import ContextBuilder
+from summarizer import ConversationSummarizer
+
+
+class StubModel:
+    """Returns a canned summary, optionally blocking until released"""
+
+    def __init__(self, reply='User is stressed about exams and sleeping badly.', fail=False):
+        self.reply = reply
+        self.fail = fail
+        self.prompts = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError('model unavailable')
+        return self.reply
+
+
+def chatty_builder(turns=20, budget=60):
+    builder = ContextBuilder('You are MindfulAI.', budget=budget)
+    for i in range(turns):
+        builder.add('user' if i % 2 == 0 else 'assistant', f'turn {i}: exams are stressing me out and I cannot sleep')
+    return builder
+
+
+def test_evicted_turns_are_folded_into_the_summary():
+    builder = chatty_builder()
+    evicted = list(builder.pending)
+    assert evicted and builder.dropped == len(evicted)
+    model = StubModel()
+    ConversationSummarizer().schedule(builder, model.generate_content).result(5)
+    assert builder.pending == []
+    assert all(content in model.prompts[0] for _, content in evicted)
+    prompt = builder.build('hello')
+    assert prompt.index('Summary of earlier conversation:\nUser is stressed') < prompt.index('Recent conversation:')
+
+
+def test_schedule_runs_off_the_calling_thread():
+    builder = chatty_builder()
+    model = StubModel()
+    model.release.clear()
+    future = ConversationSummarizer().schedule(builder, model.generate_content)
+    # The caller is not blocked while the model works
+    assert not future.done()
+    assert builder.summary == ''
+    model.release.set()
+    future.result(5)
+    assert builder.summary
+
+
+def test_wait_returns_once_the_running_job_is_done():
+    builder = chatty_builder()
+    model = StubModel()
+    model.release.clear()
+    summarizer = ConversationSummarizer()
+    future = summarizer.schedule(builder, model.generate_content)
+    summarizer.wait(builder, timeout=0.05)
+    assert not future.done()
+    threading.Timer(0.05, model.release.set).start()
+    summarizer.wait(builder)
+    assert future.done() and builder.summary
+    # Nothing running: returns at once
+    summarizer.wait(builder)
+
+
+def test_one_job_per_session_at_a_time():
+    builder = chatty_builder()
+    model = StubModel()
+    model.release.clear()
+    summarizer = ConversationSummarizer()
+    first = summarizer.schedule(builder, model.generate_content)
+    builder.add('user', 'one more long message about exams and sleep ' * 5)
+    assert summarizer.schedule(builder, model.generate_content) is None
+    model.release.set()
+    first.result(5)
+    assert summarizer.schedule(builder, model.generate_content).result(5)
+
+
+def test_turns_stay_in_summarizing_until_their_summary_is_in():
+    builder = chatty_builder()
+    evicted = list(builder.pending)
+    model = StubModel()
+    model.release.clear()
+    saved = []
+    future = ConversationSummarizer().schedule(
+        builder, model.generate_content, on_summary=lambda: saved.append((builder.summary, list(builder.summarizing))))
+    assert builder.summarizing == evicted and builder.pending == []
+    model.release.set()
+    future.result(5)
+    assert saved == [(model.reply, [])] and builder.summarizing == []
+
+
+def test_failed_job_keeps_turns_for_next_attempt():
+    builder = chatty_builder()
+    evicted = list(builder.pending)
+    saved = []
+    future = ConversationSummarizer().schedule(builder, StubModel(fail=True).generate_content,
+                                               on_summary=lambda: saved.append(1))
+    assert future.exception(5)
+    assert builder.pending == evicted and builder.summarizing == []
+    assert builder.summary == '' and saved == []
+
+
+def test_clear_discards_a_late_summary():
+    builder = chatty_builder()
+    model = StubModel()
+    model.release.clear()
+    future = ConversationSummarizer().schedule(builder, model.generate_content)
+    builder.clear()
+    model.release.set()
+    future.result(5)
+    assert builder.summary == ''
+
+
+def test_prompt_size_stays_flat_with_summary():
+    builder = ContextBuilder('You are MindfulAI.', budget=200)
+    summarizer = ConversationSummarizer()
+    model = StubModel()
+    sizes = []
+    for i in range(200):
+        builder.add('user' if i % 2 == 0 else 'assistant', f'turn {i}: I keep worrying about my exams and my sleep')
+        job = summarizer.schedule(builder, model.generate_content)
+        if job:
+            job.result(5)
+        sizes.append(builder.prompt_tokens('hello'))
+    assert max(sizes[50:]) == max(sizes[150:])
@@ -0,0 +1,46 @@
+"""Tests for the minified theme stylesheet and its self-hosted fonts"""
+import os
+from unittest import mock
+
+import pytest
+
+import theme
+
+
+@pytest.fixture
+def fonts(tmp_path):
+    """A static folder holding only the Inter font, with a fresh stylesheet cache"""
+    (tmp_path / 'fonts').mkdir()
+    (tmp_path / 'fonts' / 'inter-latin.woff2').write_bytes(b'wOF2')
+    theme.stylesheet_tag.cache_clear()
+    with mock.patch.object(theme, 'STATIC_DIR', str(tmp_path)), \
+            mock.patch.object(theme, 'FONTS_DIR', str(tmp_path / 'fonts')):
+        yield tmp_path
+    theme.stylesheet_tag.cache_clear()
+
+
+def test_minify_keeps_rules_and_drops_comments_and_whitespace():
+    css = "/* note */\n.a > .b {\n    color : red;\n    margin: 0 auto;\n}\n"
+    assert theme.minify(css) == ".a>.b{color:red;margin:0 auto}"
+
+
+def test_only_fetched_fonts_are_declared(fonts):
+    rules = theme.font_faces('fonts/')
+    assert rules.count('@font-face') == 1 and "font-family: 'Inter'" in rules
+    assert "url('fonts/inter-latin.woff2')" in rules
+    os.remove(fonts / 'fonts' / 'inter-latin.woff2')
+    assert theme.font_faces('fonts/') == ''
+
+
+def test_linked_stylesheet_finds_fonts_next_to_it(fonts):
+    tag = theme.stylesheet_tag()
+    name = tag.split(f'{theme.STATIC_URL}/')[1].split('"')[0]
+    css = (fonts / name).read_text()
+    assert "url('fonts/inter-latin.woff2')" in css and 'space-grotesk' not in css
+
+
+def test_inline_fallback_points_fonts_at_the_static_route(fonts):
+    # A static folder it cannot write to, as on a read-only deployment
+    with mock.patch.object(theme, 'STATIC_DIR', str(fonts / 'read-only')):
+        tag = theme.stylesheet_tag()
+    assert tag.startswith('<style>') and f"url('{theme.STATIC_URL}/fonts/inter-latin.woff2')" in tag
@@ -0,0 +1,110 @@
+"""Minified, content-hashed theme stylesheet served from Streamlit's static folder
+
+static/theme.css is the editable source. On first use it is minified into
+static/theme.<hash>.min.css and the app links to that file, so each rerun
+sends a short <link> tag instead of the whole stylesheet and browsers can
+keep the file cached until its content (and therefore its name) changes.
+Requires `enableStaticServing = true` in .streamlit/config.toml.
+
+Run `python theme.py --fetch-fonts` once to download the Inter and Space
+Grotesk files into static/fonts so the app never loads them from Google.
+The stylesheet declares only the fonts that are there, so a checkout without
+them makes no requests for missing files.
+"""
+import argparse
+import functools
+import glob
+import hashlib
+import os
+import re
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+SOURCE = os.path.join(STATIC_DIR, 'theme.css')
+FONTS_DIR = os.path.join(STATIC_DIR, 'fonts')
+STATIC_URL = 'app/static'
+
+# File in static/fonts -> (family, weight range)
+FONTS = {
+    'inter-latin.woff2': ('Inter', '300 800'),
+    'space-grotesk-latin.woff2': ('Space Grotesk', '500 700'),
+}
+
+_COMMENTS = re.compile(r'/\*.*?\*/', re.S)
+_WHITESPACE = re.compile(r'\s+')
+_AROUND_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+_DECLARATION_COLON = re.compile(r'(?<=[{;])([\w-]+)\s*:\s*')
+
+
+def minify(css):
+    """Drop comments and redundant whitespace; leaves selectors and values intact"""
+    css = _COMMENTS.sub('', css)
+    css = _WHITESPACE.sub(' ', css)
+    css = _AROUND_PUNCTUATION.sub(r'\1', css)
+    css = _DECLARATION_COLON.sub(r'\1:', css)
+    return css.replace(';}', '}').strip()
+
+
+def font_faces(base):
+    """@font-face rules for the fetched theme fonts, with URLs starting at `base`"""
+    rules = []
+    for filename, (family, weights) in FONTS.items():
+        if os.path.exists(os.path.join(FONTS_DIR, filename)):
+            rules.append(f"@font-face {{ font-family: '{family}'; font-style: normal; font-weight: {weights}; "
+                         f"font-display: swap; src: local('{family}'), url('{base}{filename}') format('woff2'); }}")
+    return '\n'.join(rules)
+
+
+@functools.lru_cache(maxsize=1)
+def stylesheet_tag():
+    """Markup that loads the theme; built once per process"""
+    with open(SOURCE, encoding='utf-8') as f:
+        source = f.read()
+    # Font URLs in the linked file are relative to it, in inline CSS to the page
+    css = minify(font_faces('fonts/') + source)
+    digest = hashlib.sha256(css.encode()).hexdigest()[:12]
+    name = f'theme.{digest}.min.css'
+    path = os.path.join(STATIC_DIR, name)
+    try:
+        if not os.path.exists(path):
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(css)
+            os.replace(tmp, path)
+            for stale in glob.glob(os.path.join(STATIC_DIR, 'theme.*.min.css')):
+                if stale != path:
+                    os.remove(stale)
+    except OSError:
+        # Read-only deployment: inline the minified stylesheet instead
+        return f'<style>{minify(font_faces(f"{STATIC_URL}/fonts/") + source)}</style>'
+    return f'<link rel="stylesheet" href="{STATIC_URL}/{name}">'
+
+
+def fetch_fonts():
+    """Download the latin subset of each theme font into static/fonts"""
+    import urllib.request
+
+    os.makedirs(FONTS_DIR, exist_ok=True)
+    # A modern user agent makes Google Fonts answer with woff2 sources
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                             '(KHTML, like Gecko) Chrome/120.0 Safari/537.36'}
+    for filename, (family, weights) in FONTS.items():
+        query = f"{family.replace(' ', '+')}:wght@{weights.replace(' ', '..')}"
+        request = urllib.request.Request(f'https://fonts.googleapis.com/css2?family={query}&display=swap',
+                                         headers=headers)
+        css = urllib.request.urlopen(request, timeout=30).read().decode()
+        latin = css[css.index('/* latin */'):]
+        url = re.search(r'url\((https://[^)]+\.woff2)\)', latin).group(1)
+        with urllib.request.urlopen(url, timeout=30) as response, \
+                open(os.path.join(FONTS_DIR, filename), 'wb') as f:
+            f.write(response.read())
+        print(f"✓ {filename}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the minified theme or fetch its fonts')
+    parser.add_argument('--fetch-fonts', action='store_true', help='download the theme fonts into static/fonts')
+    args = parser.parse_args()
+    if args.fetch_fonts:
+        fetch_fonts()
+    else:
+        print(stylesheet_tag())